@@ -14,3 +14,7 @@ from django.core.asgi import get_asgi_application
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'millie.settings')
 
 application = get_asgi_application()
+
+from millie.product.warmup import warm_on_startup  # noqa: E402 (needs the apps loaded above)
+
+warm_on_startup()
@@ -0,0 +1,490 @@
+import asyncio
+import random
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from django.core.cache import cache
+from .metrics import record_cache_access
+from .settings import (L1_CACHE_MAX_SIZE, L1_CACHE_TIMEOUT, L1_CACHE_SYNC_INTERVAL, CACHE_MIN_TIMEOUT, CACHE_MAX_TIMEOUT,
+                       CACHE_STALE_TIMEOUT, CACHE_REBUILD_LOCK_TIMEOUT, CACHE_REBUILD_WAIT, CACHE_VERSION_TIMEOUT)
+import logging
+
+logger = logging.getLogger(__name__)
+
+_MISSING = object()
+
+# deleted keys are journaled in the shared cache for other workers; a worker further behind than this
+# (or missing part of the journal) drops its whole local cache instead
+L1_JOURNAL_TIMEOUT = 60 * 60
+L1_JOURNAL_MAX = 1000
+
+
+class L1Cache(object):
+    '''
+    Bounded per-worker cache (LRU + short TTL) in front of the shared django cache
+    - reads hit the local copy first and fall back to the shared cache
+    - writes go through to the shared cache
+    - deleted keys are journaled under a shared sequence number, other workers drop
+      their local copies of those keys (only) on the next sync
+    Cached values are shared between requests and must be treated as read-only.
+    '''
+    seq_key = 'l1_cache_seq'
+    journal_prefix = 'l1_cache_deleted_'
+
+    def __init__(self, shared_cache, max_size=L1_CACHE_MAX_SIZE, timeout=L1_CACHE_TIMEOUT, sync_interval=L1_CACHE_SYNC_INTERVAL):
+        self.shared_cache = shared_cache
+        self.max_size = max_size
+        self.timeout = timeout
+        self.sync_interval = min(sync_interval, timeout)
+        self._entries = OrderedDict()   # key -> (expires_at, value)
+        self._lock = threading.Lock()
+        self._seq = None
+        self._synced_at = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def _sync_due(self, now):
+        if now - self._synced_at < self.sync_interval:
+            return False
+        self._synced_at = now
+        return True
+
+    def _journal_keys(self, seq):
+        # journal entries between the last applied sequence number and seq, None to drop everything
+        if seq == self._seq or self._seq is None:
+            # nothing new, or the first sync of this worker (it only holds what it just wrote)
+            return []
+        if seq is None or not 0 < seq - self._seq <= L1_JOURNAL_MAX:
+            return None
+        return [f'{self.journal_prefix}{i}' for i in range(self._seq + 1, seq + 1)]
+
+    def _apply_journal(self, seq, journal_keys, entries):
+        with self._lock:
+            if journal_keys is None or len(entries) < len(journal_keys):
+                # too far behind, or part of the journal is gone (expired, or not written yet)
+                self._entries.clear()
+            else:
+                for deleted_keys in entries.values():
+                    for key in deleted_keys:
+                        self._entries.pop(key, None)
+        self._seq = seq
+
+    def _sync(self, now):
+        if self._sync_due(now):
+            seq = self.shared_cache.get(self.seq_key)
+            if seq is None:
+                # first worker (or lost sequence): start one, so the next delete is a journal entry for everyone
+                self.shared_cache.add(self.seq_key, time.time_ns(), timeout=None)
+                seq = self.shared_cache.get(self.seq_key)
+            journal_keys = self._journal_keys(seq)
+            entries = self.shared_cache.get_many(journal_keys) if journal_keys else {}
+            self._apply_journal(seq, journal_keys, entries)
+
+    async def _async_sync(self, now):
+        if self._sync_due(now):
+            seq = await self.shared_cache.aget(self.seq_key)
+            if seq is None:
+                await self.shared_cache.aadd(self.seq_key, time.time_ns(), timeout=None)
+                seq = await self.shared_cache.aget(self.seq_key)
+            journal_keys = self._journal_keys(seq)
+            entries = await self.shared_cache.aget_many(journal_keys) if journal_keys else {}
+            self._apply_journal(seq, journal_keys, entries)
+
+    def _journaled(self, seq):
+        # this worker already dropped the keys of its own entry
+        if self._seq == seq - 1:
+            self._seq = seq
+
+    def _broadcast(self, keys):
+        try:
+            seq = self.shared_cache.incr(self.seq_key)
+        except ValueError:
+            # started from the current time, so a lost sequence never matches an old one
+            self.shared_cache.add(self.seq_key, time.time_ns(), timeout=None)
+            seq = self.shared_cache.incr(self.seq_key)
+        self.shared_cache.set(f'{self.journal_prefix}{seq}', keys, timeout=L1_JOURNAL_TIMEOUT)
+        self._journaled(seq)
+
+    async def _async_broadcast(self, keys):
+        try:
+            seq = await self.shared_cache.aincr(self.seq_key)
+        except ValueError:
+            await self.shared_cache.aadd(self.seq_key, time.time_ns(), timeout=None)
+            seq = await self.shared_cache.aincr(self.seq_key)
+        await self.shared_cache.aset(f'{self.journal_prefix}{seq}', keys, timeout=L1_JOURNAL_TIMEOUT)
+        self._journaled(seq)
+
+    def _get_local(self, key, now):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return _MISSING
+            if entry[0] <= now:
+                del self._entries[key]
+                return _MISSING
+            self._entries.move_to_end(key)
+            return entry[1]
+
+    def _set_local(self, key, value, timeout, now):
+        timeout = self.timeout if timeout is None else min(timeout, self.timeout)
+        with self._lock:
+            self._entries[key] = (now + timeout, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def _delete_local(self, keys):
+        with self._lock:
+            for key in keys:
+                self._entries.pop(key, None)
+
+    def get(self, key, default=None):
+        now = time.monotonic()
+        self._sync(now)
+        value = self._get_local(key, now)
+        if value is not _MISSING:
+            self.hits += 1
+            record_cache_access(1, 0)
+            return value
+
+        self.misses += 1
+        value = self.shared_cache.get(key, _MISSING)
+        if value is _MISSING:
+            record_cache_access(0, 1)
+            return default
+        record_cache_access(1, 0)
+        self._set_local(key, value, None, now)
+        return value
+
+    def get_many(self, keys):
+        keys = list(keys)
+        now = time.monotonic()
+        self._sync(now)
+        values = {}
+        misses = []
+        for key in keys:
+            value = self._get_local(key, now)
+            if value is _MISSING:
+                misses.append(key)
+            else:
+                values[key] = value
+        self.hits += len(values)
+        self.misses += len(misses)
+
+        if misses:
+            shared_values = self.shared_cache.get_many(misses)
+            for key, value in shared_values.items():
+                self._set_local(key, value, None, now)
+            values.update(shared_values)
+        record_cache_access(len(values), len(keys) - len(values))
+        return values
+
+    def set(self, key, value, timeout=None):
+        self.shared_cache.set(key, value, timeout=timeout)
+        self._set_local(key, value, timeout, time.monotonic())
+
+    def set_many(self, data, timeout=None):
+        self.shared_cache.set_many(data, timeout=timeout)
+        now = time.monotonic()
+        for key, value in data.items():
+            self._set_local(key, value, timeout, now)
+
+    def publish_many(self, data, timeout=None):
+        # set_many() replacing values other workers may hold: their local copies are dropped on the next sync
+        keys = list(data)
+        self._delete_local(keys)
+        self.shared_cache.set_many(data, timeout=timeout)
+        self._broadcast(keys)
+
+    def add(self, key, value, timeout=None):
+        # the shared cache decides who wins, the local copy is refilled on the next get
+        self._delete_local([key])
+        return self.shared_cache.add(key, value, timeout=timeout)
+
+    def incr(self, key, delta=1):
+        self._delete_local([key])
+        value = self.shared_cache.incr(key, delta)
+        self._broadcast([key])
+        return value
+
+    def delete(self, key):
+        self.delete_many([key])
+
+    def delete_many(self, keys):
+        keys = list(keys)
+        self._delete_local(keys)
+        self.shared_cache.delete_many(keys)
+        self._broadcast(keys)
+
+    # async API (for async views): local lookups stay in memory, shared cache calls are awaited
+
+    async def aget(self, key, default=None):
+        now = time.monotonic()
+        await self._async_sync(now)
+        value = self._get_local(key, now)
+        if value is not _MISSING:
+            self.hits += 1
+            record_cache_access(1, 0)
+            return value
+
+        self.misses += 1
+        value = await self.shared_cache.aget(key, _MISSING)
+        if value is _MISSING:
+            record_cache_access(0, 1)
+            return default
+        record_cache_access(1, 0)
+        self._set_local(key, value, None, now)
+        return value
+
+    async def aget_many(self, keys):
+        keys = list(keys)
+        now = time.monotonic()
+        await self._async_sync(now)
+        values = {}
+        misses = []
+        for key in keys:
+            value = self._get_local(key, now)
+            if value is _MISSING:
+                misses.append(key)
+            else:
+                values[key] = value
+        self.hits += len(values)
+        self.misses += len(misses)
+
+        if misses:
+            shared_values = await self.shared_cache.aget_many(misses)
+            for key, value in shared_values.items():
+                self._set_local(key, value, None, now)
+            values.update(shared_values)
+        record_cache_access(len(values), len(keys) - len(values))
+        return values
+
+    async def aset(self, key, value, timeout=None):
+        await self.shared_cache.aset(key, value, timeout=timeout)
+        self._set_local(key, value, timeout, time.monotonic())
+
+    async def aset_many(self, data, timeout=None):
+        await self.shared_cache.aset_many(data, timeout=timeout)
+        now = time.monotonic()
+        for key, value in data.items():
+            self._set_local(key, value, timeout, now)
+
+    async def aadd(self, key, value, timeout=None):
+        self._delete_local([key])
+        return await self.shared_cache.aadd(key, value, timeout=timeout)
+
+    async def aincr(self, key, delta=1):
+        self._delete_local([key])
+        value = await self.shared_cache.aincr(key, delta)
+        await self._async_broadcast([key])
+        return value
+
+    async def adelete(self, key):
+        await self.adelete_many([key])
+
+    async def adelete_many(self, keys):
+        keys = list(keys)
+        self._delete_local(keys)
+        await self.shared_cache.adelete_many(keys)
+        await self._async_broadcast(keys)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+        self.shared_cache.clear()
+
+    def stats(self):
+        lookups = self.hits + self.misses
+        return {
+            'size': len(self._entries),
+            'max_size': self.max_size,
+            'hits': self.hits,
+            'misses': self.misses,
+            'evictions': self.evictions,
+            'hit_rate': round(self.hits / lookups, 4) if lookups else 0.0,
+        }
+
+
+l1_cache = L1Cache(cache)
+
+
+def _needs_rebuild(entry, now):
+    if now >= entry['expires_at']:
+        return True
+    if now < entry['fresh_until']:
+        return False
+    # probabilistic early expiry: the chance grows linearly over the [min, max] window,
+    # so hot keys get rebuilt by one request before they expire for everyone
+    window = entry['expires_at'] - entry['fresh_until']
+    return random.random() < (now - entry['fresh_until']) / window
+
+
+def _rebuildable_entry(value, min_timeout, max_timeout):
+    now = time.time()
+    return {'value': value, 'fresh_until': now + min_timeout, 'expires_at': now + max_timeout}
+
+
+def set_rebuildable(cache_key, value, min_timeout=CACHE_MIN_TIMEOUT, max_timeout=CACHE_MAX_TIMEOUT):
+    set_many_rebuildable({cache_key: value}, min_timeout, max_timeout)
+
+
+async def aset_rebuildable(cache_key, value, min_timeout=CACHE_MIN_TIMEOUT, max_timeout=CACHE_MAX_TIMEOUT):
+    entry = _rebuildable_entry(value, min_timeout, max_timeout)
+    await l1_cache.aset(cache_key, entry, timeout=max_timeout + CACHE_STALE_TIMEOUT)
+
+
+def set_many_rebuildable(data, min_timeout=CACHE_MIN_TIMEOUT, max_timeout=CACHE_MAX_TIMEOUT):
+    entries = {cache_key: _rebuildable_entry(value, min_timeout, max_timeout) for cache_key, value in data.items()}
+    # keep the entries after they expire so they can be served stale during a rebuild
+    l1_cache.set_many(entries, timeout=max_timeout + CACHE_STALE_TIMEOUT)
+
+
+def get_many_rebuildable(cache_keys):
+    # unexpired values only, anything else is left to the caller to rebuild in bulk
+    now = time.time()
+    entries = l1_cache.get_many(cache_keys)
+    return {cache_key: entry['value'] for cache_key, entry in entries.items() if now < entry['expires_at']}
+
+
+def _release_lock(lock_key, token):
+    # only our own lock: after CACHE_REBUILD_LOCK_TIMEOUT it may belong to another rebuild
+    # (get then delete, the django cache API has no atomic compare-and-delete)
+    if cache.get(lock_key) == token:
+        cache.delete(lock_key)
+
+
+async def _arelease_lock(lock_key, token):
+    if await cache.aget(lock_key) == token:
+        await cache.adelete(lock_key)
+
+
+def get_or_rebuild(cache_key, rebuild, min_timeout=CACHE_MIN_TIMEOUT, max_timeout=CACHE_MAX_TIMEOUT, wait=CACHE_REBUILD_WAIT):
+    '''
+    Single-flight cache read: only the worker holding the rebuild lock runs rebuild(),
+    the others get the stale value or wait for the new one
+    '''
+    entry = l1_cache.get(cache_key)
+    if entry is not None and not _needs_rebuild(entry, time.time()):
+        return entry['value']
+
+    # locks live in the shared cache only, so every worker sees them
+    lock_key = f'{cache_key}_rebuild_lock'
+    token = uuid.uuid4().hex
+    if cache.add(lock_key, token, timeout=CACHE_REBUILD_LOCK_TIMEOUT):
+        try:
+            value = rebuild()
+            set_rebuildable(cache_key, value, min_timeout, max_timeout)
+        finally:
+            _release_lock(lock_key, token)
+        return value
+
+    if entry is not None:
+        # stale while another worker revalidates
+        return entry['value']
+
+    deadline = time.monotonic() + wait
+    while time.monotonic() < deadline:
+        time.sleep(0.05)
+        entries = cache.get_many([cache_key, lock_key])
+        if cache_key in entries:
+            return entries[cache_key]['value']
+        if lock_key not in entries:
+            # released without an entry: the rebuild failed (e.g. the product does not exist), do not wait for it
+            break
+    else:
+        # the lock holder is too slow, do not wait any longer
+        logger.warning(f'Gave up waiting for cache rebuild: {cache_key}')
+    # rebuild here (or raise its error) and store the result so the next readers are served instead of waiting too
+    value = rebuild()
+    set_rebuildable(cache_key, value, min_timeout, max_timeout)
+    return value
+
+
+async def aget_or_rebuild(cache_key, arebuild, min_timeout=CACHE_MIN_TIMEOUT, max_timeout=CACHE_MAX_TIMEOUT, wait=CACHE_REBUILD_WAIT):
+    '''
+    Async version of get_or_rebuild(), arebuild is a coroutine function
+    '''
+    entry = await l1_cache.aget(cache_key)
+    if entry is not None and not _needs_rebuild(entry, time.time()):
+        return entry['value']
+
+    lock_key = f'{cache_key}_rebuild_lock'
+    token = uuid.uuid4().hex
+    if await cache.aadd(lock_key, token, timeout=CACHE_REBUILD_LOCK_TIMEOUT):
+        try:
+            value = await arebuild()
+            await aset_rebuildable(cache_key, value, min_timeout, max_timeout)
+        finally:
+            await _arelease_lock(lock_key, token)
+        return value
+
+    if entry is not None:
+        return entry['value']
+
+    deadline = time.monotonic() + wait
+    while time.monotonic() < deadline:
+        await asyncio.sleep(0.05)
+        entries = await cache.aget_many([cache_key, lock_key])
+        if cache_key in entries:
+            return entries[cache_key]['value']
+        if lock_key not in entries:
+            break
+    else:
+        logger.warning(f'Gave up waiting for cache rebuild: {cache_key}')
+    value = await arebuild()
+    await aset_rebuildable(cache_key, value, min_timeout, max_timeout)
+    return value
+
+
+def mark_stale(cache_key):
+    # expire the entry now but keep serving it while it is rebuilt
+    entry = cache.get(cache_key)
+    l1_cache.delete(cache_key)
+    if entry is not None:
+        entry = dict(entry, fresh_until=0, expires_at=0)
+        l1_cache.set(cache_key, entry, timeout=CACHE_STALE_TIMEOUT)
+
+
+def get_versions(version_keys):
+    '''
+    Current values of version keys (generation counters, product versions) in one cache lookup.
+    A change sets a new version from the current time (ns), a missing (or expired, after CACHE_VERSION_TIMEOUT)
+    key starts again from it, so a version is also the time of the last change (for Last-Modified)
+    '''
+    versions = l1_cache.get_many(version_keys)
+    for version_key in version_keys:
+        if version_key not in versions:
+            # add() keeps concurrent readers on one value
+            version = time.time_ns()
+            l1_cache.add(version_key, version, timeout=CACHE_VERSION_TIMEOUT)
+            versions[version_key] = l1_cache.get(version_key, version)
+    return [versions[version_key] for version_key in version_keys]
+
+
+async def aget_versions(version_keys):
+    versions = await l1_cache.aget_many(version_keys)
+    for version_key in version_keys:
+        if version_key not in versions:
+            version = time.time_ns()
+            await l1_cache.aadd(version_key, version, timeout=CACHE_VERSION_TIMEOUT)
+            versions[version_key] = await l1_cache.aget(version_key, version)
+    return [versions[version_key] for version_key in version_keys]
+
+
+def _next_version(version, now):
+    # strictly increasing (concurrent bumps in the same ns still differ) without running ahead of the clock;
+    # changes within one second share a Last-Modified second, the strong ETag tells them apart
+    return now if version is None else max(now, version + 1)
+
+
+def bump_versions(version_keys):
+    # every worker sees the new versions on its next sync (one broadcast for all keys)
+    if not version_keys:
+        return
+    versions = l1_cache.shared_cache.get_many(version_keys)
+    now = time.time_ns()
+    l1_cache.publish_many({version_key: _next_version(versions.get(version_key), now) for version_key in version_keys},
+                          timeout=CACHE_VERSION_TIMEOUT)
@@ -0,0 +1,33 @@
+# Generated by Django 5.1.4 on 2026-10-17 19:02
+
+import django.utils.timezone
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('coupon', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.AlterModelOptions(
+            name='coupon',
+            options={'ordering': ['-created_at']},
+        ),
+        migrations.AddField(
+            model_name='coupon',
+            name='active',
+            field=models.BooleanField(default=True),
+        ),
+        migrations.AddField(
+            model_name='coupon',
+            name='created_at',
+            field=models.DateTimeField(auto_now_add=True, default=django.utils.timezone.now),
+            preserve_default=False,
+        ),
+        migrations.AddConstraint(
+            model_name='coupon',
+            constraint=models.CheckConstraint(condition=models.Q(('discount_rate__gte', 0.0), ('discount_rate__lte', 1.0)), name='coupon_discount_rate_range'),
+        ),
+    ]
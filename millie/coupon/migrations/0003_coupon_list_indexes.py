@@ -0,0 +1,29 @@
+# Generated by Django 5.1.4 on 2026-10-17 19:35
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('coupon', '0002_alter_coupon_options_coupon_active_coupon_created_at_and_more'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='coupon',
+            index=models.Index(fields=['active', 'created_at'], name='coupon_coup_active_93af8b_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='coupon',
+            index=models.Index(fields=['active', 'code'], name='coupon_coup_active_9330b0_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='coupon',
+            index=models.Index(fields=['active'], name='coupon_coup_active_6c03ed_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='coupon',
+            index=models.Index(fields=['created_at'], name='coupon_coup_created_a2d5fa_idx'),
+        ),
+    ]
@@ -0,0 +1,45 @@
+# Generated by Django 5.1.4 on 2026-10-17 20:32
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('coupon', '0003_coupon_list_indexes'),
+    ]
+
+    operations = [
+        migrations.RemoveIndex(
+            model_name='coupon',
+            name='coupon_coup_active_93af8b_idx',
+        ),
+        migrations.RemoveIndex(
+            model_name='coupon',
+            name='coupon_coup_active_9330b0_idx',
+        ),
+        migrations.RemoveIndex(
+            model_name='coupon',
+            name='coupon_coup_active_6c03ed_idx',
+        ),
+        migrations.RemoveIndex(
+            model_name='coupon',
+            name='coupon_coup_created_a2d5fa_idx',
+        ),
+        migrations.AddIndex(
+            model_name='coupon',
+            index=models.Index(fields=['active', 'created_at', 'id'], name='coupon_coup_active_c8dfb4_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='coupon',
+            index=models.Index(fields=['active', 'code', 'id'], name='coupon_coup_active_a37a3d_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='coupon',
+            index=models.Index(fields=['active', 'id'], name='coupon_coup_active_e5fe44_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='coupon',
+            index=models.Index(fields=['created_at', 'id'], name='coupon_coup_created_e940ae_idx'),
+        ),
+    ]
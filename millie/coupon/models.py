@@ -9,6 +9,14 @@ class Coupon(models.Model):
 
     class Meta:
         ordering = ['-created_at']     # default ordering
+        # active coupons (default listing) with each ordering, and every coupon by created_at (code is unique already);
+        # id last: the tie-breaker of every list and cursor order
+        indexes = [
+            models.Index(fields=['active', 'created_at', 'id']),
+            models.Index(fields=['active', 'code', 'id']),
+            models.Index(fields=['active', 'id']),
+            models.Index(fields=['created_at', 'id']),
+        ]
         constraints = [
             CheckConstraint(
                 check=Q(discount_rate__gte=0.0) & Q(discount_rate__lte=1.0),
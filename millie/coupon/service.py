@@ -1,17 +1,25 @@
+import asyncio
 from math import ceil
 from .models import Coupon
-from .serializers import CouponSerializer
+from .serializers import COUPON_VALUES, compact_coupons
+from ..cache import get_versions, aget_versions, bump_versions
+from ..db_router import read_from_replica
+from ..pagination import paginate_by_cursor
 from ..settings import PAGE_SIZE
 
+COUPON_LIST_GENERATION_KEY = 'coupon_list_generation'
+
 
 class CouponService:
-    def get_active_coupons(self, include_inactive=0, page=1, page_size=PAGE_SIZE, order_by=None, asc=0):
+    def _get_coupon_queryset(self, include_inactive=0):
         # lazy-query
         if include_inactive == 1:
             coupons = Coupon.objects.all()
         else:
             coupons = Coupon.objects.filter(active=True)
+        return coupons
 
+    def _order_coupons(self, coupons, order_by=None, asc=0):
         if ((order_by is not None and order_by != 'created_at') or
                 (asc is not None and asc > 0)):
             order_field = order_by or 'created_at'
@@ -19,21 +27,81 @@ class CouponService:
             if ascending == 0:
                 order_field = '-' + order_field
             coupons = coupons.order_by(order_field)
+        return coupons
+
+    def get_coupon_list_versions(self):
+        # validator of the coupon lists, bumped by any coupon change
+        return get_versions([COUPON_LIST_GENERATION_KEY])
+
+    def invalidate_coupon_list_cache(self):
+        bump_versions([COUPON_LIST_GENERATION_KEY])
+
+    @read_from_replica
+    def get_active_coupons(self, include_inactive=0, page=1, page_size=PAGE_SIZE, order_by=None, asc=0):
+        coupons = self._get_coupon_queryset(include_inactive)
+        coupons = self._order_coupons(coupons, order_by, asc)
 
         # implement pagination
         total_count = coupons.count()
         start = (page - 1) * page_size
         end = start + page_size
         total_pages = ceil(total_count / page_size)
-        coupons = coupons[start:end]
+        coupons = coupons.values(*COUPON_VALUES)[start:end]
 
-        serializer = CouponSerializer(coupons, many=True)
         coupons_data = {
             'total_count': total_count,
             'total_pages': total_pages,
             'current_page': page,
             'page_size': page_size,
-            'coupons': serializer.data
+            'coupons': compact_coupons(coupons)
+        }
+
+        return coupons_data
+
+    @read_from_replica
+    def get_active_coupons_by_cursor(self, include_inactive=0, cursor=None, page_size=PAGE_SIZE, order_by=None, asc=0, with_count=0):
+        coupons = self._get_coupon_queryset(include_inactive)
+
+        # seek on (order_by, id) so deep pages cost the same as the first one
+        coupons_page, next_cursor, prev_cursor = paginate_by_cursor(
+            coupons.values(*COUPON_VALUES), order_field=order_by or 'created_at', ascending=asc, cursor=cursor, page_size=page_size
+        )
+
+        coupons_data = {
+            'next_cursor': next_cursor,
+            'prev_cursor': prev_cursor,
+            'page_size': page_size,
+            'coupons': compact_coupons(coupons_page)
+        }
+        # COUNT scans the whole filtered set, so only run it on demand
+        if with_count == 1:
+            coupons_data['total_count'] = coupons.count()
+
+        return coupons_data
+
+    async def aget_coupon_list_versions(self):
+        return await aget_versions([COUPON_LIST_GENERATION_KEY])
+
+    @read_from_replica
+    async def aget_active_coupons(self, include_inactive=0, page=1, page_size=PAGE_SIZE, order_by=None, asc=0):
+        # async version of get_active_coupons() for the async view
+        coupons = self._order_coupons(self._get_coupon_queryset(include_inactive), order_by, asc)
+
+        start = (page - 1) * page_size
+        end = start + page_size
+        page_rows = coupons.values(*COUPON_VALUES)[start:end]
+
+        async def fetch_rows():
+            return [row async for row in page_rows]
+
+        # count and page queries are awaited together
+        total_count, rows = await asyncio.gather(coupons.acount(), fetch_rows())
+        coupons_data = {
+            'total_count': total_count,
+            'total_pages': ceil(total_count / page_size),
+            'current_page': page,
+            'page_size': page_size,
+            'coupons': compact_coupons(rows)
         }
 
-        return coupons_data
\ No newline at end of file
+        return coupons_data
@@ -1,6 +1,7 @@
 from django.urls import path
 from . import views
+from ..settings import ASYNC_VIEWS
 
 urlpatterns = [
-    path('all/', views.get_active_coupons, name='get_active_coupons'),
+    path('all/', views.aget_active_coupons if ASYNC_VIEWS else views.get_active_coupons, name='get_active_coupons'),
 ]
\ No newline at end of file
@@ -1,10 +1,26 @@
+from asgiref.sync import sync_to_async
+from django.views.decorators.http import require_GET
 from rest_framework.decorators import api_view
 from rest_framework.response import Response
 from rest_framework import status
 from .service import CouponService
+from ..errors import *
+from ..http import conditional, json_response
 from ..settings import PAGE_SIZE
 
 ORDER_FIELDS = ['code', 'active', 'created_at']
+
+
+def _coupon_list_versions(request):
+    # versions of the responses for conditional GET (see millie.http.conditional)
+    return CouponService().get_coupon_list_versions()
+
+
+async def _acoupon_list_versions(request):
+    return await CouponService().aget_coupon_list_versions()
+
+
+@conditional(_coupon_list_versions)
 @api_view(['GET'])
 def get_active_coupons(request):
     '''
@@ -15,6 +31,8 @@ def get_active_coupons(request):
         page_size (optional): page size for pagination
         asc (optional): sort ascending (0 or 1)
         order_by (optional): sort field (default sorting is by 'created_at')
+        cursor (optional): switch to cursor(keyset) pagination, empty value for the first page
+        with_count (optional): include total_count in cursor pagination (0 or 1)
     :return: JSON response with list of coupons
     :example:
         GET /coupon/?page=1&page_size=5&asc=1&order_by=code
@@ -31,19 +49,81 @@ def get_active_coupons(request):
                 }
             ]
         }
+        GET /coupon/all/?page_size=5&order_by=code&cursor=eyJvIjoi...
+        Response: {
+            'next_cursor': 'eyJvIjoi...',
+            'prev_cursor': None,
+            'page_size': 5,
+            'coupons': [...]
+        }
     '''
     try:
-        include_inactive = min(int(request.query_params.get('include_inactive', 0)), 1)  # include_inactive should be only 0 or 1
-        asc = min(int(request.query_params.get('asc', 0)), 1)   # asc should be only 0 or 1
-        page = int(request.query_params.get('page', 1))
-        page_size = min(int(request.query_params.get('page_size', PAGE_SIZE)), PAGE_SIZE) # page_size cannot be larger than PAGE_SIZE
+        params = _parse_coupon_list_params(request.query_params)
+    except ValueError as e:
+        return Response({'error': str(e)}, status=status.HTTP_400_BAD_REQUEST)
+    cursor = params.pop('cursor')
+    with_count = params.pop('with_count')
+
+    coupon_service = CouponService()
+    try:
+        if cursor is not None:
+            params.pop('page')
+            result = coupon_service.get_active_coupons_by_cursor(cursor=cursor, with_count=with_count, **params)
+        else:
+            result = coupon_service.get_active_coupons(**params)
+        return Response(result)
+    except InvalidCursor:
+        return Response({'error': InvalidCursor.default_detail}, status=InvalidCursor.status_code)
+
+
+def _parse_coupon_list_params(query_params):
+    # raises ValueError with the error message for the response
+    try:
+        include_inactive = min(int(query_params.get('include_inactive', 0)), 1)  # include_inactive should be only 0 or 1
+        asc = min(int(query_params.get('asc', 0)), 1)   # asc should be only 0 or 1
+        page = int(query_params.get('page', 1))
+        page_size = min(int(query_params.get('page_size', PAGE_SIZE)), PAGE_SIZE) # page_size cannot be larger than PAGE_SIZE
+        with_count = min(int(query_params.get('with_count', 0)), 1)   # with_count should be only 0 or 1
     except ValueError:
-        return Response({'error': 'Invalid query param'}, status=status.HTTP_400_BAD_REQUEST)
-    order_by = request.query_params.get('order_by', None)
+        raise ValueError('Invalid query param')
+    order_by = query_params.get('order_by', None)
     if order_by is not None:
         if order_by not in ORDER_FIELDS:
-            return Response({'error': 'Invalid order_by query'}, status=status.HTTP_400_BAD_REQUEST)
+            raise ValueError('Invalid order_by query')
+
+    return {
+        'include_inactive': include_inactive,
+        'page': page,
+        'page_size': page_size,
+        'order_by': order_by,
+        'asc': asc,
+        'cursor': query_params.get('cursor', None),
+        'with_count': with_count,
+    }
+
+
+# async version of the view above (routed instead of it when ASYNC_VIEWS is on, e.g. under ASGI)
+
+@conditional(_acoupon_list_versions)
+@require_GET
+async def aget_active_coupons(request):
+    '''
+    Async version of get_active_coupons (same params and response)
+    '''
+    try:
+        params = _parse_coupon_list_params(request.GET)
+    except ValueError as e:
+        return json_response({'error': str(e)}, status=status.HTTP_400_BAD_REQUEST)
+    cursor = params.pop('cursor')
+    with_count = params.pop('with_count')
 
     coupon_service = CouponService()
-    result = coupon_service.get_active_coupons(include_inactive=include_inactive, page=page, page_size=page_size, order_by=order_by, asc=asc)
-    return Response(result)
\ No newline at end of file
+    try:
+        if cursor is not None:
+            params.pop('page')
+            result = await sync_to_async(coupon_service.get_active_coupons_by_cursor)(cursor=cursor, with_count=with_count, **params)
+        else:
+            result = await coupon_service.aget_active_coupons(**params)
+        return json_response(result)
+    except InvalidCursor:
+        return json_response({'error': InvalidCursor.default_detail}, status=InvalidCursor.status_code)
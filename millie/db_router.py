@@ -0,0 +1,221 @@
+import contextlib
+import contextvars
+import functools
+import itertools
+import threading
+import time
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.core.exceptions import ImproperlyConfigured
+from django.db import DatabaseError, connections
+from .settings import (DATABASE_REPLICAS, REPLICA_CHECK_INTERVAL, REPLICA_MAX_LAG, REPLICA_PIN_SECONDS,
+                       REPLICA_SELECTION)
+import logging
+
+logger = logging.getLogger(__name__)
+
+SELECTIONS = ('round_robin', 'least_latency')
+PIN_COOKIE = 'db_pin'
+# weight of the newest probe in the latency average
+LATENCY_WEIGHT = 0.3
+# an idle primary sends no WAL, so the replay timestamp only means lag while received WAL is still being replayed
+POSTGRES_LAG_SQL = '''
+    SELECT CASE WHEN NOT pg_is_in_recovery() OR pg_last_wal_receive_lsn() = pg_last_wal_replay_lsn() THEN 0
+                ELSE EXTRACT(EPOCH FROM now() - pg_last_xact_replay_timestamp()) END
+'''
+
+# True inside the read-only service methods, the only reads sent to replicas
+_replica_reads = contextvars.ContextVar('replica_reads', default=False)
+# reads go to the primary until then (time.monotonic()), set by every write for read-your-writes
+_pinned_until = contextvars.ContextVar('replica_pinned_until', default=0.0)
+
+
+def read_from_replica(func):
+    # decorator for read-only service methods (sync or async), their queries may be served by a replica
+    if iscoroutinefunction(func):
+        @functools.wraps(func)
+        async def async_wrapper(*args, **kwargs):
+            token = _replica_reads.set(True)
+            try:
+                return await func(*args, **kwargs)
+            finally:
+                _replica_reads.reset(token)
+        return async_wrapper
+
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        token = _replica_reads.set(True)
+        try:
+            return func(*args, **kwargs)
+        finally:
+            _replica_reads.reset(token)
+    return wrapper
+
+
+@contextlib.contextmanager
+def read_from_primary():
+    # for reads kept until an explicit invalidation (e.g. the coupon index), a lagging replica would make them stale for good
+    token = _replica_reads.set(False)
+    try:
+        yield
+    finally:
+        _replica_reads.reset(token)
+
+
+def pin_to_primary(seconds=REPLICA_PIN_SECONDS):
+    _pinned_until.set(time.monotonic() + seconds)
+
+
+def is_pinned():
+    return time.monotonic() < _pinned_until.get()
+
+
+class ReplicaPool(object):
+    '''
+    Picks the replica for a read: round robin or lowest probe latency, among the replicas whose last check
+    succeeded with lag <= max_lag (none healthy: the primary). Checked at most once per check_interval,
+    by the request that finds the check due (the others keep using the last result meanwhile)
+    '''
+    def __init__(self, aliases=DATABASE_REPLICAS, selection=REPLICA_SELECTION, max_lag=REPLICA_MAX_LAG,
+                 check_interval=REPLICA_CHECK_INTERVAL):
+        if selection not in SELECTIONS:
+            raise ImproperlyConfigured(f'REPLICA_SELECTION must be one of {SELECTIONS}, not {selection!r}')
+        self.aliases = list(aliases)
+        self.selection = selection
+        self.max_lag = max_lag
+        self.check_interval = check_interval
+        self._lock = threading.Lock()
+        self._counter = itertools.count()
+        self._latency = {}   # alias -> average probe time (seconds)
+        self._healthy = []
+        self._checked_at = None
+
+    def choose(self):
+        # replica alias for the next read, None for the primary
+        if not self.aliases:
+            return None
+        self._check_if_due()
+        healthy = self._healthy
+        if not healthy:
+            return None
+        if self.selection == 'least_latency':
+            return min(healthy, key=self._latency.__getitem__)
+        return healthy[next(self._counter) % len(healthy)]
+
+    def _check_if_due(self):
+        now = time.monotonic()
+        if self._checked_at is not None and now - self._checked_at < self.check_interval:
+            return
+        if not self._lock.acquire(blocking=False):
+            return
+        try:
+            self.check()
+        finally:
+            self._lock.release()
+
+    def check(self):
+        # probe every replica: latency of the lag query, unreachable or lagging ones are skipped until the next check
+        self._checked_at = time.monotonic()
+        healthy = []
+        for alias in self.aliases:
+            start = time.perf_counter()
+            try:
+                lag = self._measure_lag(alias)
+            except DatabaseError as e:
+                logger.warning(f'Replica {alias} is unreachable, reading from the others: {e}')
+                continue
+            latency = time.perf_counter() - start
+            previous = self._latency.get(alias)
+            self._latency[alias] = latency if previous is None else previous * (1 - LATENCY_WEIGHT) + latency * LATENCY_WEIGHT
+            if lag > self.max_lag:
+                logger.warning(f'Replica {alias} lags {lag:.1f}s behind the primary, reading from the others')
+                continue
+            healthy.append(alias)
+        self._healthy = healthy
+        return healthy
+
+    def _measure_lag(self, alias):
+        # seconds the replica is behind the primary
+        connection = connections[alias]
+        with connection.cursor() as cursor:
+            if connection.vendor == 'postgresql':
+                cursor.execute(POSTGRES_LAG_SQL)
+            else:
+                # stand-in replicas (e.g. SQLite files) are not replicated, so they never lag
+                cursor.execute('SELECT 0')
+            return float(cursor.fetchone()[0] or 0)
+
+
+replica_pool = ReplicaPool()
+
+
+class ReplicaRouter(object):
+    '''
+    Reads of the read-only service methods go to a replica, everything else (and every read for
+    REPLICA_PIN_SECONDS after a write) to the primary; replicas get their schema by replication
+    '''
+    def db_for_read(self, model, **hints):
+        if not _replica_reads.get():
+            return None
+        if is_pinned():
+            return 'default'
+        instance = hints.get('instance')
+        if instance is not None and instance._state.db:
+            # related objects are read where the instance came from
+            return instance._state.db
+        return replica_pool.choose() or 'default'
+
+    def db_for_write(self, model, **hints):
+        pin_to_primary()
+        return 'default'
+
+    def allow_relation(self, obj1, obj2, **hints):
+        # every database holds the same data
+        return True
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        return db not in replica_pool.aliases
+
+
+class ReplicaPinningMiddleware(object):
+    '''
+    Read-your-writes across requests: a request that wrote sets a short-lived cookie,
+    the client's next requests read from the primary until it expires
+    '''
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.async_mode = iscoroutinefunction(get_response)
+        if self.async_mode:
+            markcoroutinefunction(self)
+
+    def _pin_from_cookie(self, request):
+        return time.monotonic() + REPLICA_PIN_SECONDS if PIN_COOKIE in request.COOKIES else 0.0
+
+    def _finish(self, response, wrote):
+        if wrote:
+            response.set_cookie(PIN_COOKIE, '1', max_age=REPLICA_PIN_SECONDS, httponly=True, samesite='Lax')
+        return response
+
+    def __call__(self, request):
+        if self.async_mode:
+            return self.__acall__(request)
+        pinned_until = self._pin_from_cookie(request)
+        token = _pinned_until.set(pinned_until)
+        try:
+            response = self.get_response(request)
+            wrote = _pinned_until.get() > pinned_until
+        finally:
+            _pinned_until.reset(token)
+        return self._finish(response, wrote)
+
+    async def __acall__(self, request):
+        pinned_until = self._pin_from_cookie(request)
+        token = _pinned_until.set(pinned_until)
+        try:
+            response = await self.get_response(request)
+            wrote = _pinned_until.get() > pinned_until
+        finally:
+            _pinned_until.reset(token)
+        return self._finish(response, wrote)
@@ -12,3 +12,13 @@ class CategoryDoesNotExist(Exception):
     status_code = 404
     default_detail = 'category not found'
     default_code = "category_not_found"
+
+class InvalidCursor(Exception):
+    status_code = 400
+    default_detail = 'invalid cursor'
+    default_code = "invalid_cursor"
+
+class InvalidDiscountRate(Exception):
+    status_code = 400
+    default_detail = 'discount rate must be between 0 and 1'
+    default_code = "invalid_discount_rate"
@@ -0,0 +1,29 @@
+from django.db import connections, DEFAULT_DB_ALIAS
+
+
+def explain_query_plan(sql, params=None, using=DEFAULT_DB_ALIAS):
+    # plan lines of a query: EXPLAIN QUERY PLAN details on SQLite, EXPLAIN text elsewhere (e.g. PostgreSQL)
+    connection = connections[using]
+    with connection.cursor() as cursor:
+        if connection.vendor == 'sqlite':
+            cursor.execute(f'EXPLAIN QUERY PLAN {sql}', params)
+            return [row[3] for row in cursor.fetchall()]
+        cursor.execute(f'EXPLAIN {sql}', params)
+        return [row[0] for row in cursor.fetchall()]
+
+
+def plan_problems(plan):
+    '''
+    Steps of a plan that read a whole table or sort a whole result set
+    (e.g. 'SCAN product_product', 'USE TEMP B-TREE FOR ORDER BY', 'Seq Scan on product_product')
+    '''
+    problems = set()
+    for line in plan:
+        step = line.strip().lstrip('->').strip()
+        if step.startswith('SCAN ') and ' USING ' not in step and step != 'SCAN CONSTANT ROW':
+            problems.add(step)
+        elif step.startswith('USE TEMP B-TREE'):
+            problems.add(step)
+        elif step.startswith('Seq Scan on '):
+            problems.add(step.split('  ')[0])
+    return problems
@@ -0,0 +1,20 @@
+import pytz
+
+KST = pytz.timezone('Asia/Seoul')
+
+
+# apply commas to price (e.g. 500,000원)
+def format_price(price):
+    return f'{price:,}원'
+
+
+# change float to percent format (e.g. 10.0%)
+def format_rate(rate):
+    return f'{round(rate * 100, 2)}%'
+
+
+# change UTC to KST (e.g. 2024년 12월 12일 22시 40분 00초)
+def format_kst(value):
+    kst_time = value.astimezone(KST)
+    return (f'{kst_time.year}년 {kst_time.month:02d}월 {kst_time.day:02d}일 '
+            f'{kst_time.hour:02d}시 {kst_time.minute:02d}분 {kst_time.second:02d}초')
@@ -0,0 +1,158 @@
+import heapq
+import threading
+import time
+from django.core.cache import cache
+from django.http import HttpResponseForbidden, JsonResponse
+from .metrics import metrics_allowed
+from .settings import HOT_KEYS_CAPACITY, HOT_KEYS_FLUSH_INTERVAL, HOT_KEYS_HALF_LIFE, HOT_KEYS_HOT_SIZE, HOT_KEYS_TTL_FACTOR
+import logging
+
+logger = logging.getLogger(__name__)
+
+# decayed top-K of every worker, merged in the shared cache
+SHARED_KEY = 'hot_keys'
+
+
+class SpaceSaving(object):
+    '''
+    Space-saving top-K: at most `capacity` counters, an untracked key takes over the smallest one
+    (and its count), so counts are upper bounds and every key read more than total/capacity times is kept.
+    The smallest counter is found with a lazy min-heap of (count, key): entries outdated by later adds are
+    skipped when popped, and the heap is rebuilt from the counts once it holds too many of them
+    '''
+    def __init__(self, capacity):
+        self.capacity = capacity
+        self.counts = {}
+        self._heap = []
+
+    def add(self, key, count=1):
+        counts = self.counts
+        if key in counts:
+            counts[key] += count
+        elif len(counts) < self.capacity:
+            counts[key] = count
+        else:
+            counts[key] = counts.pop(self._pop_min()) + count
+        heapq.heappush(self._heap, (counts[key], key))
+        if len(self._heap) > 4 * self.capacity:
+            self._heap = [(count, key) for key, count in counts.items()]
+            heapq.heapify(self._heap)
+
+    def _pop_min(self):
+        heap, counts = self._heap, self.counts
+        while True:
+            count, key = heapq.heappop(heap)
+            if counts.get(key) == count:
+                return key
+
+    def __len__(self):
+        return len(self.counts)
+
+
+class HotKeyTracker(object):
+    '''
+    Reads of the ProductService cache keys, counted per worker in a space-saving top-K and merged every
+    flush_interval (by the request that finds the flush due) into a shared top-K whose counts halve every half_life.
+    The hot_size most read keys are hot: their cache entries live ttl_factor times longer, so cold ones expire first
+    '''
+    def __init__(self, capacity=HOT_KEYS_CAPACITY, hot_size=HOT_KEYS_HOT_SIZE, flush_interval=HOT_KEYS_FLUSH_INTERVAL,
+                 half_life=HOT_KEYS_HALF_LIFE, ttl_factor=HOT_KEYS_TTL_FACTOR):
+        self.capacity = capacity
+        self.hot_size = hot_size
+        self.flush_interval = flush_interval
+        self.half_life = half_life
+        self.ttl_factor = ttl_factor
+        self._lock = threading.Lock()
+        self._local = SpaceSaving(capacity)
+        self._hot = frozenset()
+        self._flushed_at = time.monotonic()
+
+    def record(self, key):
+        with self._lock:
+            self._local.add(key)
+
+    def is_hot(self, key):
+        return key in self._hot
+
+    def timeout_factor(self, key):
+        # multiplier of the cache timeouts of key
+        return self.ttl_factor if key in self._hot else 1
+
+    def _flush_due(self):
+        now = time.monotonic()
+        with self._lock:
+            if now - self._flushed_at < self.flush_interval:
+                return False
+            self._flushed_at = now
+            return True
+
+    def _take_local(self):
+        with self._lock:
+            local, self._local = self._local, SpaceSaving(self.capacity)
+        return local
+
+    def _merge(self, shared, local):
+        # decay the shared counts to now, add this worker's reads and keep the top `capacity`
+        now = time.time()
+        counts = {}
+        if shared:
+            decay = 0.5 ** (max(now - shared['at'], 0) / self.half_life)
+            counts = {key: count * decay for key, count in shared['counts'].items()}
+        for key, count in local.counts.items():
+            counts[key] = counts.get(key, 0) + count
+        top = heapq.nlargest(self.capacity, counts.items(), key=lambda item: item[1])
+        self._hot = frozenset(key for key, _ in top[:self.hot_size])
+        return {'at': now, 'counts': dict(top)}
+
+    def flush(self):
+        # read-modify-write of the shared top-K: a concurrent flush of another worker may be lost (counts are approximate)
+        merged = self._merge(cache.get(SHARED_KEY), self._take_local())
+        cache.set(SHARED_KEY, merged, timeout=None)
+
+    async def aflush(self):
+        merged = self._merge(await cache.aget(SHARED_KEY), self._take_local())
+        await cache.aset(SHARED_KEY, merged, timeout=None)
+
+    def flush_if_due(self):
+        if self._flush_due():
+            self.flush()
+
+    async def aflush_if_due(self):
+        if self._flush_due():
+            await self.aflush()
+
+    def top(self, limit=None):
+        # [(key, decayed count)] of the shared top-K, most read first (as of the last flush of any worker)
+        shared = cache.get(SHARED_KEY)
+        if not shared:
+            return []
+        decay = 0.5 ** (max(time.time() - shared['at'], 0) / self.half_life)
+        top = sorted(shared['counts'].items(), key=lambda item: item[1], reverse=True)[:limit]
+        return [(key, count * decay) for key, count in top]
+
+    def clear(self):
+        with self._lock:
+            self._local = SpaceSaving(self.capacity)
+            self._flushed_at = time.monotonic()
+        self._hot = frozenset()
+        cache.delete(SHARED_KEY)
+
+
+hot_key_tracker = HotKeyTracker()
+
+
+def hot_keys_view(request):
+    # internal endpoint (same access as /metrics): the shared top-K, ?limit= keys (default hot_size)
+    if not metrics_allowed(request):
+        return HttpResponseForbidden()
+    try:
+        limit = int(request.GET.get('limit', hot_key_tracker.hot_size))
+    except ValueError:
+        limit = hot_key_tracker.hot_size
+    top = hot_key_tracker.top(max(limit, 0))
+    return JsonResponse({
+        'hot_size': hot_key_tracker.hot_size,
+        'ttl_factor': hot_key_tracker.ttl_factor,
+        'keys': [{'key': key, 'count': round(count, 2), 'hot': position < hot_key_tracker.hot_size}
+                 for position, (key, count) in enumerate(top)],
+    })
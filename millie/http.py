@@ -0,0 +1,123 @@
+import functools
+import hashlib
+import re
+import time
+from asgiref.sync import iscoroutinefunction, sync_to_async
+from django.core.handlers.asgi import ASGIRequest
+from django.http import HttpResponse, StreamingHttpResponse
+from django.utils.cache import get_conditional_response, patch_cache_control, patch_vary_headers
+from django.utils.http import http_date
+from django.utils.text import compress_sequence
+from rest_framework.renderers import JSONRenderer
+from .metrics import measure_serialization
+
+
+@measure_serialization
+def render_json(data):
+    return JSONRenderer().render(data)
+
+
+def json_response(data, status=200):
+    # plain django response rendered like DRF's Response, for views outside of @api_view (e.g. async views)
+    return HttpResponse(render_json(data), content_type='application/json', status=status)
+
+
+_accepts_gzip = re.compile(r'\bgzip\b')
+_END = object()
+
+
+async def aiter_in_thread(iterator):
+    '''
+    Async iteration of a sync iterator (e.g. one reading the DB): every next() runs in the sync thread,
+    one chunk at a time (ASGI would otherwise list() a sync streaming_content, the whole download in memory)
+    '''
+    next_chunk = sync_to_async(next)
+    try:
+        while (chunk := await next_chunk(iterator, _END)) is not _END:
+            yield chunk
+    finally:
+        if hasattr(iterator, 'close'):
+            # e.g. the client went away: release the DB cursor
+            await sync_to_async(iterator.close)()
+
+
+def download_response(request, content, content_type, filename):
+    # streamed file download (content: iterator of bytes), gzip compressed on the fly when the client accepts it
+    gzipped = bool(_accepts_gzip.search(request.META.get('HTTP_ACCEPT_ENCODING', '')))
+    if gzipped:
+        content = compress_sequence(content)
+    if isinstance(request, ASGIRequest):
+        content = aiter_in_thread(iter(content))
+    response = StreamingHttpResponse(content, content_type=content_type)
+    if gzipped:
+        response.headers['Content-Encoding'] = 'gzip'
+    patch_vary_headers(response, ('Accept-Encoding',))
+    response.headers['Content-Disposition'] = f'attachment; filename="{filename}"'
+    return response
+
+
+def _validators(request, versions):
+    # strong ETag: the same URL (and Accept) with the same versions is rendered to the same bytes
+    digest = hashlib.blake2b(f'{request.get_full_path()}|{request.META.get("HTTP_ACCEPT", "")}|{versions}'.encode(),
+                             digest_size=16)
+    # versions are the times (ns) of the last changes; never later than Date (RFC 9110 8.8.2.1)
+    return f'"{digest.hexdigest()}"', min(max(versions) // 10**9, int(time.time()))
+
+
+def _set_validators(response, etag, last_modified):
+    response.headers['ETag'] = etag
+    response.headers['Last-Modified'] = http_date(last_modified)
+    # stored copies must be revalidated, which is cheap
+    patch_cache_control(response, no_cache=True)
+    return response
+
+
+def _conditional_response(request, versions):
+    # (304/412 response with the validators, None) or (None, validators of the response to build)
+    if versions is None:
+        return None, None
+    etag, last_modified = _validators(request, versions)
+    # a Last-Modified of the current second is weak (RFC 9110 8.8.2.2): a change later in the same second keeps it,
+    # so If-Modified-Since only counts once that second is over (If-None-Match always does)
+    trusted_last_modified = last_modified if last_modified < int(time.time()) else None
+    response = get_conditional_response(request, etag=etag, last_modified=trusted_last_modified)
+    if response is not None:
+        return _set_validators(response, etag, last_modified), None
+    return None, (etag, last_modified)
+
+
+def conditional(get_versions):
+    '''
+    Conditional GET: get_versions(request, *args, **kwargs) returns the versions the response depends on
+    (one cache lookup, None to skip), a matching If-None-Match / If-Modified-Since gets 304 before the view
+    runs any query or serializer. 200 responses get a strong ETag and Last-Modified.
+    get_versions is a coroutine function for async views
+    '''
+    def decorator(view):
+        if iscoroutinefunction(view):
+            @functools.wraps(view)
+            async def async_wrapper(request, *args, **kwargs):
+                if request.method not in ('GET', 'HEAD'):
+                    return await view(request, *args, **kwargs)
+                not_modified, validators = _conditional_response(request, await get_versions(request, *args, **kwargs))
+                if not_modified is not None:
+                    return not_modified
+                response = await view(request, *args, **kwargs)
+                if validators is not None and response.status_code == 200:
+                    _set_validators(response, *validators)
+                return response
+            return async_wrapper
+
+        @functools.wraps(view)
+        def wrapper(request, *args, **kwargs):
+            if request.method not in ('GET', 'HEAD'):
+                return view(request, *args, **kwargs)
+            not_modified, validators = _conditional_response(request, get_versions(request, *args, **kwargs))
+            if not_modified is not None:
+                return not_modified
+            response = view(request, *args, **kwargs)
+            if validators is not None and response.status_code == 200:
+                _set_validators(response, *validators)
+            return response
+        return wrapper
+    return decorator
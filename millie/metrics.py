@@ -0,0 +1,224 @@
+import contextvars
+import functools
+import hmac
+import threading
+import time
+from collections import defaultdict, deque
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.db import connections
+from django.db.backends.signals import connection_created
+from django.http import HttpResponse, HttpResponseForbidden
+from .settings import METRICS_ALLOWED_IPS, METRICS_TOKEN, METRICS_WINDOW
+import logging
+
+logger = logging.getLogger(__name__)
+
+# metrics of the request being handled (copied into the threads of sync_to_async, so async views are counted too)
+_current_request = contextvars.ContextVar('request_metrics', default=None)
+
+QUANTILES = (0.5, 0.95, 0.99)
+
+# set by reverse proxies: REMOTE_ADDR is then the proxy, not the client
+PROXY_HEADERS = ('HTTP_X_FORWARDED_FOR', 'HTTP_FORWARDED', 'HTTP_X_REAL_IP')
+
+
+class RequestMetrics(object):
+    __slots__ = ('start', 'db_queries', 'db_time', 'cache_hits', 'cache_misses', 'serialization_time', '_render_start')
+
+    def __init__(self):
+        self.start = time.perf_counter()
+        self.db_queries = 0
+        self.db_time = 0.0
+        self.cache_hits = 0
+        self.cache_misses = 0
+        self.serialization_time = 0.0
+        self._render_start = None
+
+    def server_timing(self, duration):
+        # Server-Timing header, durations in milliseconds
+        return ', '.join([
+            f'app;dur={duration * 1000:.2f}',
+            f'db;dur={self.db_time * 1000:.2f};desc="{self.db_queries} queries"',
+            f'cache;desc="{self.cache_hits} hits, {self.cache_misses} misses"',
+            f'serialize;dur={self.serialization_time * 1000:.2f}',
+        ])
+
+
+def record_cache_access(hits, misses):
+    # called by L1Cache lookups
+    request_metrics = _current_request.get()
+    if request_metrics is not None:
+        request_metrics.cache_hits += hits
+        request_metrics.cache_misses += misses
+
+
+def measure_serialization(func):
+    # decorator for the functions turning rows into response data
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        request_metrics = _current_request.get()
+        if request_metrics is None:
+            return func(*args, **kwargs)
+        start = time.perf_counter()
+        try:
+            return func(*args, **kwargs)
+        finally:
+            request_metrics.serialization_time += time.perf_counter() - start
+    return wrapper
+
+
+def _record_query(execute, sql, params, many, context):
+    request_metrics = _current_request.get()
+    if request_metrics is None:
+        return execute(sql, params, many, context)
+    start = time.perf_counter()
+    try:
+        return execute(sql, params, many, context)
+    finally:
+        request_metrics.db_queries += 1
+        request_metrics.db_time += time.perf_counter() - start
+
+
+def _install_query_recorder(connection, **kwargs):
+    if _record_query not in connection.execute_wrappers:
+        connection.execute_wrappers.append(_record_query)
+
+
+class Summary(object):
+    '''
+    count/sum of every observation, quantiles over the last `window` observations
+    '''
+    def __init__(self, window=METRICS_WINDOW):
+        self.count = 0
+        self.sum = 0.0
+        self.samples = deque(maxlen=window)
+
+    def observe(self, value):
+        self.count += 1
+        self.sum += value
+        self.samples.append(value)
+
+    def quantiles(self):
+        samples = sorted(self.samples)
+        if not samples:
+            return {quantile: 0.0 for quantile in QUANTILES}
+        return {quantile: samples[min(int(quantile * len(samples)), len(samples) - 1)] for quantile in QUANTILES}
+
+
+class MetricsRegistry(object):
+    # per-process stats by view name
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.clear()
+
+    def clear(self):
+        self.durations = defaultdict(Summary)
+        self.db_queries = defaultdict(Summary)
+        self.counters = defaultdict(float)  # (metric name, view) -> total
+
+    def observe(self, view, request_metrics, duration):
+        with self._lock:
+            self.durations[view].observe(duration)
+            self.db_queries[view].observe(request_metrics.db_queries)
+            self.counters[('millie_db_duration_seconds_total', view)] += request_metrics.db_time
+            self.counters[('millie_cache_hits_total', view)] += request_metrics.cache_hits
+            self.counters[('millie_cache_misses_total', view)] += request_metrics.cache_misses
+            self.counters[('millie_serialization_seconds_total', view)] += request_metrics.serialization_time
+
+    def render(self):
+        # Prometheus text exposition format
+        lines = []
+        with self._lock:
+            for name, summaries, help_text in (
+                ('millie_request_duration_seconds', self.durations, 'Request wall time by view'),
+                ('millie_db_queries', self.db_queries, 'DB queries per request by view'),
+            ):
+                lines += [f'# HELP {name} {help_text}', f'# TYPE {name} summary']
+                for view, summary in sorted(summaries.items()):
+                    for quantile, value in summary.quantiles().items():
+                        lines.append(f'{name}{{view="{view}",quantile="{quantile}"}} {value}')
+                    lines.append(f'{name}_sum{{view="{view}"}} {summary.sum}')
+                    lines.append(f'{name}_count{{view="{view}"}} {summary.count}')
+            for name in sorted({name for name, _ in self.counters}):
+                lines.append(f'# TYPE {name} counter')
+                for (counter_name, view), value in sorted(self.counters.items()):
+                    if counter_name == name:
+                        lines.append(f'{name}{{view="{view}"}} {value}')
+        return '\n'.join(lines) + '\n'
+
+
+metrics_registry = MetricsRegistry()
+
+
+class MetricsMiddleware(object):
+    '''
+    Records wall time, DB queries/time, cache hits/misses and serialization time of every request,
+    adds a Server-Timing header and keeps per-view stats for the /metrics endpoint
+    '''
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.async_mode = iscoroutinefunction(get_response)
+        if self.async_mode:
+            markcoroutinefunction(self)
+        # count queries on every connection, including the ones opened later (e.g. per thread)
+        for connection in connections.all():
+            _install_query_recorder(connection)
+        connection_created.connect(_install_query_recorder, weak=False, dispatch_uid='millie_metrics_query_recorder')
+
+    def __call__(self, request):
+        if self.async_mode:
+            return self.__acall__(request)
+        request_metrics = RequestMetrics()
+        token = _current_request.set(request_metrics)
+        try:
+            response = self.get_response(request)
+        finally:
+            _current_request.reset(token)
+        return self._finish(request, response, request_metrics)
+
+    async def __acall__(self, request):
+        request_metrics = RequestMetrics()
+        token = _current_request.set(request_metrics)
+        try:
+            response = await self.get_response(request)
+        finally:
+            _current_request.reset(token)
+        return self._finish(request, response, request_metrics)
+
+    def process_template_response(self, request, response):
+        # DRF responses are rendered right after this hook, time it as serialization
+        request_metrics = _current_request.get()
+        if request_metrics is not None:
+            request_metrics._render_start = time.perf_counter()
+            response.add_post_render_callback(lambda rendered: self._rendered(request_metrics))
+        return response
+
+    def _rendered(self, request_metrics):
+        request_metrics.serialization_time += time.perf_counter() - request_metrics._render_start
+
+    def _finish(self, request, response, request_metrics):
+        duration = time.perf_counter() - request_metrics.start
+        response['Server-Timing'] = request_metrics.server_timing(duration)
+        resolver_match = getattr(request, 'resolver_match', None)
+        if resolver_match is not None and resolver_match.view_name != 'metrics':
+            metrics_registry.observe(resolver_match.view_name, request_metrics, duration)
+        return response
+
+
+def metrics_allowed(request):
+    # the bearer token when one is configured, otherwise only direct (not proxied) clients of METRICS_ALLOWED_IPS
+    if METRICS_TOKEN:
+        return hmac.compare_digest(request.headers.get('Authorization', ''), f'Bearer {METRICS_TOKEN}')
+    if any(header in request.META for header in PROXY_HEADERS):
+        return False
+    return request.META.get('REMOTE_ADDR') in METRICS_ALLOWED_IPS
+
+
+def metrics_view(request):
+    # internal scrape endpoint
+    if not metrics_allowed(request):
+        return HttpResponseForbidden()
+    return HttpResponse(metrics_registry.render(), content_type='text/plain; version=0.0.4; charset=utf-8')
@@ -0,0 +1,76 @@
+import base64
+import binascii
+import json
+from datetime import datetime
+from django.core.exceptions import FieldDoesNotExist, ValidationError
+from django.db.models import Q
+from .errors import *
+from .settings import PAGE_SIZE
+import logging
+
+logger = logging.getLogger(__name__)
+
+
+# cursor = urlsafe base64 of {'o': order key, 'v': sort value, 'id': pk, 'r': 1 if it points backwards}
+def encode_cursor(obj, order_field, order_key, reverse=False):
+    # obj is a model instance or a .values() row
+    if isinstance(obj, dict):
+        value, pk = obj[order_field], obj['id']
+    else:
+        value, pk = getattr(obj, order_field), obj.pk
+    if isinstance(value, datetime):
+        value = value.isoformat()
+    position = {'o': order_key, 'v': value, 'id': pk, 'r': int(reverse)}
+    return base64.urlsafe_b64encode(json.dumps(position, separators=(',', ':')).encode()).decode()
+
+
+def decode_cursor(cursor, queryset, order_field, order_key):
+    try:
+        position = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+        # cursor is only valid for the ordering it was issued for
+        if position['o'] != order_key:
+            raise ValueError
+        value = position['v']
+        if value is not None:
+            # order_field is a model field or an annotation (e.g. final_price)
+            annotation = queryset.query.annotations.get(order_field)
+            field = annotation.output_field if annotation is not None else queryset.model._meta.get_field(order_field)
+            value = field.to_python(value)
+        return value, int(position['id']), bool(position['r'])
+    except (binascii.Error, UnicodeError, ValueError, TypeError, KeyError, FieldDoesNotExist, ValidationError):
+        logger.error(f'Failed to decode cursor: {cursor}')
+        raise InvalidCursor
+
+
+def paginate_by_cursor(queryset, order_field='created_at', ascending=0, cursor=None, page_size=PAGE_SIZE):
+    '''
+    Keyset pagination: seek on (order_field, pk) instead of OFFSET, so every page costs the same
+    :return: (rows of the page, next_cursor, prev_cursor)
+    '''
+    order_key = order_field if ascending else '-' + order_field
+    backwards = False
+    descending = not ascending
+    if cursor:
+        value, pk, backwards = decode_cursor(cursor, queryset, order_field, order_key)
+        # walking backwards scans the opposite direction, then flips the page back
+        descending = descending != backwards
+        lookup = 'lt' if descending else 'gt'
+        queryset = queryset.filter(
+            Q(**{f'{order_field}__{lookup}': value}) | Q(**{order_field: value, f'pk__{lookup}': pk})
+        )
+
+    prefix = '-' if descending else ''
+    queryset = queryset.order_by(prefix + order_field, prefix + 'pk')
+    # fetch one more row to know whether another page exists
+    rows = list(queryset[:page_size + 1])
+    has_more = len(rows) > page_size
+    rows = rows[:page_size]
+    if backwards:
+        rows.reverse()
+        has_next, has_prev = True, has_more
+    else:
+        has_next, has_prev = has_more, bool(cursor)
+
+    next_cursor = encode_cursor(rows[-1], order_field, order_key) if rows and has_next else None
+    prev_cursor = encode_cursor(rows[0], order_field, order_key, reverse=True) if rows and has_prev else None
+    return rows, next_cursor, prev_cursor
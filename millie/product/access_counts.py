@@ -0,0 +1,73 @@
+import threading
+import time
+from collections import Counter, defaultdict
+from django.db import DEFAULT_DB_ALIAS, DatabaseError, transaction
+from django.db.models import F
+from .models import Product, ProductAccessCount
+from ..settings import ACCESS_COUNT_FLUSH_INTERVAL
+import logging
+
+logger = logging.getLogger(__name__)
+
+
+class ProductAccessCounter(object):
+    '''
+    Detail views per product, counted in memory and added to ProductAccessCount at most once per
+    flush_interval by the request that finds the flush due (so they survive restarts and add up across workers)
+    '''
+    def __init__(self, flush_interval=ACCESS_COUNT_FLUSH_INTERVAL):
+        self.flush_interval = flush_interval
+        self._lock = threading.Lock()
+        self._counts = Counter()
+        self._flushed_at = time.monotonic()
+
+    def record(self, product_id):
+        with self._lock:
+            self._counts[product_id] += 1
+
+    def flush_due(self):
+        now = time.monotonic()
+        with self._lock:
+            if now - self._flushed_at < self.flush_interval or not self._counts:
+                return False
+            self._flushed_at = now
+            return True
+
+    def flush(self):
+        # returns the number of products written; on a DB error the counts are kept for the next flush
+        with self._lock:
+            counts, self._counts = self._counts, Counter()
+        if not counts:
+            return 0
+        # one UPDATE per distinct increment (mostly 1, 2, 3...) instead of one per product
+        product_ids_by_delta = defaultdict(list)
+        for product_id, delta in counts.items():
+            product_ids_by_delta[delta].append(product_id)
+        try:
+            # explicit database: bookkeeping writes should not pin the request to the primary (db_router)
+            with transaction.atomic(using=DEFAULT_DB_ALIAS):
+                existing = Product.objects.using(DEFAULT_DB_ALIAS).filter(id__in=list(counts)).values_list('id', flat=True)
+                # zero rows first, so concurrent flushes of other workers only ever increment
+                ProductAccessCount.objects.using(DEFAULT_DB_ALIAS).bulk_create(
+                    [ProductAccessCount(product_id=product_id, count=0) for product_id in existing], ignore_conflicts=True
+                )
+                for delta, product_ids in product_ids_by_delta.items():
+                    ProductAccessCount.objects.using(DEFAULT_DB_ALIAS).filter(product_id__in=product_ids).update(count=F('count') + delta)
+        except DatabaseError as e:
+            logger.warning(f'Failed to flush product access counts, retrying on the next flush: {e}')
+            with self._lock:
+                self._counts.update(counts)
+            return 0
+        return len(counts)
+
+    def top_product_ids(self, limit):
+        # most viewed products first (flushed counts only)
+        return list(ProductAccessCount.objects.order_by('-count').values_list('product_id', flat=True)[:limit])
+
+    def clear(self):
+        with self._lock:
+            self._counts = Counter()
+            self._flushed_at = time.monotonic()
+
+
+product_access_counter = ProductAccessCounter()
@@ -0,0 +1,181 @@
+import heapq
+import threading
+import time
+from bisect import bisect_left, insort
+from collections import Counter
+from django.core.cache import cache
+from .models import Product
+from ..settings import AUTOCOMPLETE_POPULAR_SIZE, AUTOCOMPLETE_POPULARITY_INTERVAL, AUTOCOMPLETE_SYNC_INTERVAL
+import logging
+
+logger = logging.getLogger(__name__)
+
+# change journal in the shared cache: every product change gets a sequence number,
+# so other workers re-read only the changed products instead of rebuilding
+CHANGE_SEQ_KEY = 'autocomplete_change_seq'
+CHANGE_TIMEOUT = 60 * 60
+# reload from the DB instead when a worker is further behind than this
+MAX_CHANGES = 1000
+# detail views of the most viewed products, merged by every worker ({product_id: count})
+POPULARITY_KEY = 'autocomplete_popularity'
+
+
+def normalize(name):
+    return name.strip().casefold()
+
+
+class ProductAutocomplete(object):
+    '''
+    Per-worker prefix index of product names: a sorted array of (normalized name, product_id)
+    searched with bisect, ranked by popularity: detail views of the popular_size most viewed products,
+    shared through the cache every popularity_interval (plus this worker's views not shared yet)
+    '''
+    def __init__(self, sync_interval=AUTOCOMPLETE_SYNC_INTERVAL, popularity_interval=AUTOCOMPLETE_POPULARITY_INTERVAL,
+                 popular_size=AUTOCOMPLETE_POPULAR_SIZE):
+        self.sync_interval = sync_interval
+        self.popularity_interval = popularity_interval
+        self.popular_size = popular_size
+        self._lock = threading.Lock()
+        self._keys = None   # sorted [(normalized name, product_id)], None until loaded
+        self._names = {}    # product_id -> (normalized name, name)
+        self._seq = None
+        self._synced_at = 0
+        self._popularity = {}       # shared counts as of the last sync
+        self._views = Counter()     # views of this worker not shared yet
+        self._popularity_synced_at = None
+
+    def _load(self):
+        keys, names = [], {}
+        for product_id, name in Product.objects.order_by().values_list('id', 'name').iterator(chunk_size=10000):
+            names[product_id] = (normalize(name), name)
+            keys.append((names[product_id][0], product_id))
+        keys.sort()
+        with self._lock:
+            self._keys, self._names = keys, names
+
+    def _ensure_loaded(self):
+        now = time.monotonic()
+        if self._keys is not None and now - self._synced_at < self.sync_interval:
+            return
+        self._synced_at = now
+        seq = cache.get(CHANGE_SEQ_KEY)
+        if seq is None:
+            # no change since the cache started: seed the sequence (from the current time, so a lost one never
+            # matches an old value) instead of reloading on every sync
+            cache.add(CHANGE_SEQ_KEY, time.time_ns(), timeout=None)
+            seq = cache.get(CHANGE_SEQ_KEY)
+        if self._keys is None or self._seq is None or not 0 <= seq - self._seq <= MAX_CHANGES:
+            self._load()
+        elif seq > self._seq:
+            changes = cache.get_many([f'autocomplete_change_{i}' for i in range(self._seq + 1, seq + 1)])
+            if len(changes) < seq - self._seq:
+                # part of the journal is gone, start over
+                self._load()
+            else:
+                self._apply(set(changes.values()))
+        self._seq = seq
+
+    def _apply(self, product_ids):
+        names = dict(Product.objects.filter(id__in=product_ids).values_list('id', 'name'))
+        for product_id in product_ids:
+            if product_id in names:
+                self._put(product_id, names[product_id])
+            else:
+                self._remove(product_id)
+
+    def _put(self, product_id, name):
+        with self._lock:
+            if self._keys is None:
+                return
+            self._remove_locked(product_id)
+            self._names[product_id] = (normalize(name), name)
+            insort(self._keys, (self._names[product_id][0], product_id))
+
+    def _remove(self, product_id):
+        with self._lock:
+            if self._keys is not None:
+                self._remove_locked(product_id)
+
+    def _remove_locked(self, product_id):
+        if product_id in self._names:
+            key = (self._names.pop(product_id)[0], product_id)
+            index = bisect_left(self._keys, key)
+            if index < len(self._keys) and self._keys[index] == key:
+                del self._keys[index]
+
+    def _publish(self, product_id):
+        try:
+            seq = cache.incr(CHANGE_SEQ_KEY)
+        except ValueError:
+            # start from current time so a lost sequence never goes backwards
+            cache.add(CHANGE_SEQ_KEY, time.time_ns(), timeout=None)
+            seq = cache.incr(CHANGE_SEQ_KEY)
+        cache.set(f'autocomplete_change_{seq}', product_id, timeout=CHANGE_TIMEOUT)
+
+    def update(self, product_id, name):
+        self._put(product_id, name)
+        self._publish(product_id)
+
+    def remove(self, product_id):
+        self._remove(product_id)
+        self._publish(product_id)
+
+    def record_view(self, product_id):
+        with self._lock:
+            self._views[product_id] += 1
+
+    def popularity_sync_due(self):
+        now = time.monotonic()
+        with self._lock:
+            if self._popularity_synced_at is not None and now - self._popularity_synced_at < self.popularity_interval:
+                return False
+            self._popularity_synced_at = now
+            return True
+
+    def sync_popularity(self):
+        # adds this worker's views to the shared counts and reads back the other workers' ones.
+        # read-modify-write: a concurrent sync of another worker may be lost (the ranking is approximate)
+        with self._lock:
+            views, self._views = self._views, Counter()
+        popularity = cache.get(POPULARITY_KEY) or {}
+        if views:
+            counts = Counter(popularity)
+            counts.update(views)
+            popularity = dict(heapq.nlargest(self.popular_size, counts.items(), key=lambda item: item[1]))
+            cache.set(POPULARITY_KEY, popularity, timeout=None)
+        with self._lock:
+            self._popularity = popularity
+
+    def search(self, prefix, limit=10):
+        self._ensure_loaded()
+        if self.popularity_sync_due():
+            self.sync_popularity()
+        prefix = normalize(prefix)
+        with self._lock:
+            # viewed products first, most viewed first: at most popular_size (+ views not shared yet) are checked
+            counts = Counter(self._popularity)
+            counts.update(self._views)
+            popular = heapq.nsmallest(limit, (
+                (-count, self._names[product_id][0], product_id) for product_id, count in counts.items()
+                if product_id in self._names and self._names[product_id][0].startswith(prefix)
+            ))
+            product_ids = [product_id for _, _, product_id in popular]
+            # then alphabetical from the bisect position, stopping once limit is reached
+            index = bisect_left(self._keys, (prefix,))
+            while len(product_ids) < limit and index < len(self._keys) and self._keys[index][0].startswith(prefix):
+                product_id = self._keys[index][1]
+                if product_id not in counts:
+                    product_ids.append(product_id)
+                index += 1
+            return [{'id': product_id, 'name': self._names[product_id][1]} for product_id in product_ids]
+
+    def clear(self):
+        with self._lock:
+            self._keys, self._names = None, {}
+            self._popularity, self._views = {}, Counter()
+            self._popularity_synced_at = None
+        self._seq = None
+        cache.delete(POPULARITY_KEY)
+
+
+product_autocomplete = ProductAutocomplete()
@@ -0,0 +1,80 @@
+from django.db import transaction
+from django.db.models import F, FloatField, IntegerField, Value
+from django.db.models.functions import Cast, Floor
+from .models import Product, ProductCoupon
+from .service import ProductService
+from ..coupon.models import Coupon
+from ..errors import *
+from ..formats import format_rate
+from ..settings import BULK_CHUNK_SIZE
+import logging
+
+logger = logging.getLogger(__name__)
+
+
+class ProductBulkService(object):
+    '''
+    Campaign sized changes (e.g. a coupon for a whole category) as set-based queries:
+    no save() or signal per row, caches are invalidated once per chunk
+    '''
+    def _get_product_queryset(self, category_id=None, product_ids=None):
+        products = Product.objects.order_by()
+        if category_id is not None:
+            products = products.filter(category_id=category_id)
+        if product_ids is not None:
+            products = products.filter(id__in=product_ids)
+        return products
+
+    def _chunks(self, items, chunk_size):
+        for start in range(0, len(items), chunk_size):
+            yield items[start:start + chunk_size]
+
+    def assign_coupon(self, coupon_code, category_id=None, product_ids=None, chunk_size=BULK_CHUNK_SIZE):
+        # map a coupon to every selected product, existing mappings are kept as they are
+        try:
+            coupon = Coupon.objects.get(code=coupon_code)
+        except Coupon.DoesNotExist:
+            logger.error(f'Failed to find coupon object with coupon_code: {coupon_code}')
+            raise CouponDoesNotExist
+
+        # selection and both counts in the same transaction as the inserts,
+        # so the returned number is not skewed by products or mappings changed in between
+        mappings = ProductCoupon.objects.filter(coupon=coupon)
+        with transaction.atomic():
+            selected_ids = list(self._get_product_queryset(category_id, product_ids).values_list('id', flat=True))
+            mapped_before = mappings.count()
+            for chunk in self._chunks(selected_ids, chunk_size):
+                ProductCoupon.objects.bulk_create(
+                    [ProductCoupon(product_id=product_id, coupon=coupon) for product_id in chunk],
+                    ignore_conflicts=True,
+                )
+            assigned = mappings.count() - mapped_before
+
+        ProductService().invalidate_product_coupon_cache()
+        return assigned
+
+    def update_discount_rate(self, discount_rate, category_id=None, product_ids=None, chunk_size=BULK_CHUNK_SIZE):
+        # set discount_rate of every selected product, display fields are updated in the same query
+        if not 0.0 <= discount_rate <= 1.0:
+            raise InvalidDiscountRate
+        products = self._get_product_queryset(category_id, product_ids)
+
+        # price * (1 - discount_rate) in double precision then floored, same as int() in calculate_final_price
+        # (prices are not negative; CAST alone rounds on PostgreSQL)
+        base_final_price = Cast(Floor(Cast(F('price'), FloatField()) * Value(1 - discount_rate)), IntegerField())
+        updated = 0
+        with transaction.atomic():
+            category_ids = set(products.values_list('category_id', flat=True).distinct())
+            selected_ids = list(products.values_list('id', flat=True))
+            for chunk in self._chunks(selected_ids, chunk_size):
+                updated += Product.objects.filter(id__in=chunk).update(
+                    discount_rate=discount_rate,
+                    discount_rate_display=format_rate(discount_rate),
+                    base_final_price=base_final_price,
+                )
+
+        product_service = ProductService()
+        for chunk in self._chunks(selected_ids, chunk_size):
+            product_service.invalidate_product_caches(chunk)
+        product_service.invalidate_product_list_cache(category_ids)
+        return updated
@@ -0,0 +1,112 @@
+import threading
+import time
+from collections import defaultdict
+from asgiref.sync import sync_to_async
+from .models import ProductCoupon
+from ..cache import get_versions, aget_versions, bump_versions
+from ..coupon.models import Coupon
+from ..coupon.serializers import COUPON_VALUES, compact_coupons
+from ..db_router import read_from_primary
+from ..settings import COUPON_INDEX_SYNC_INTERVAL
+import logging
+
+logger = logging.getLogger(__name__)
+
+GENERATION_KEY = 'coupon_index_generation'
+
+
+class CouponIndex(object):
+    '''
+    Per-worker map of the active coupons of every coupon applicable product:
+    {product_id: frozenset of codes} plus one {code: coupon} table, so coupon lookups need no query.
+    Loaded lazily, any Coupon/ProductCoupon/coupon_applicable change bumps a shared generation
+    and every worker reloads on its next lookup (within sync_interval)
+    '''
+    def __init__(self, sync_interval=COUPON_INDEX_SYNC_INTERVAL):
+        self.sync_interval = sync_interval
+        self._lock = threading.Lock()
+        self._product_codes = None  # None until loaded
+        self._coupons = {}          # code -> compact coupon, newest first (default Coupon ordering)
+        self._order = {}            # code -> position in _coupons
+        self._generation = None
+        self._synced_at = 0
+
+    def _load(self, generation):
+        # kept until the next generation, so never loaded from a lagging replica
+        with read_from_primary():
+            rows = Coupon.objects.filter(active=True).order_by('-created_at', '-id').values(*COUPON_VALUES)
+            coupons = {coupon['code']: coupon for coupon in compact_coupons(rows)}
+            product_codes = defaultdict(set)
+            mappings = ProductCoupon.objects.filter(coupon__active=True, product__coupon_applicable=True).order_by()
+            for product_id, code in mappings.values_list('product_id', 'coupon__code').iterator(chunk_size=10000):
+                product_codes[product_id].add(code)
+        with self._lock:
+            # codes of every product share the string objects of the coupon table
+            self._product_codes = {
+                product_id: frozenset(coupons[code]['code'] for code in codes if code in coupons)
+                for product_id, codes in product_codes.items()
+            }
+            self._coupons = coupons
+            self._order = {code: position for position, code in enumerate(coupons)}
+            self._generation = generation
+
+    def _needs_load(self):
+        now = time.monotonic()
+        if self._product_codes is not None and now - self._synced_at < self.sync_interval:
+            return False
+        self._synced_at = now
+        return True
+
+    def ensure_loaded(self):
+        if self._needs_load():
+            generation = get_versions([GENERATION_KEY])[0]
+            if self._product_codes is None or generation != self._generation:
+                self._load(generation)
+
+    async def aensure_loaded(self):
+        if self._needs_load():
+            generation = (await aget_versions([GENERATION_KEY]))[0]
+            if self._product_codes is None or generation != self._generation:
+                await sync_to_async(self._load)(generation)
+
+    def _get_coupon_rate(self, product_id, coupon_code):
+        with self._lock:
+            if coupon_code in self._product_codes.get(product_id, ()):
+                return self._coupons[coupon_code]['discount_rate']
+        return None
+
+    def _get_coupons(self, product_id):
+        with self._lock:
+            codes = self._product_codes.get(product_id, ())
+            return [self._coupons[code] for code in sorted(codes, key=self._order.__getitem__)]
+
+    def get_coupon_rate(self, product_id, coupon_code):
+        # discount_rate of an active coupon applicable to the product, None otherwise
+        self.ensure_loaded()
+        return self._get_coupon_rate(product_id, coupon_code)
+
+    def get_coupons(self, product_id):
+        # active coupons applicable to the product (compact coupon dicts)
+        self.ensure_loaded()
+        return self._get_coupons(product_id)
+
+    async def aget_coupon_rate(self, product_id, coupon_code):
+        await self.aensure_loaded()
+        return self._get_coupon_rate(product_id, coupon_code)
+
+    async def aget_coupons(self, product_id):
+        await self.aensure_loaded()
+        return self._get_coupons(product_id)
+
+    def invalidate(self):
+        # this worker checks the generation on its next lookup, the others within sync_interval
+        self._synced_at = 0
+        bump_versions([GENERATION_KEY])
+
+    def clear(self):
+        with self._lock:
+            self._product_codes, self._coupons, self._order = None, {}, {}
+        self._generation = None
+
+
+coupon_index = CouponIndex()
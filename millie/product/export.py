@@ -0,0 +1,37 @@
+import csv
+import io
+import json
+
+CSV_COLUMNS = ['id', 'category_id', 'category_name', 'name', 'price', 'description', 'discount_rate', 'coupon_applicable',
+               'created_at', 'final_price']
+
+
+def ndjson_stream(chunks):
+    # one JSON object per line, one bytes string per chunk of products
+    for products in chunks:
+        yield ''.join(json.dumps(product, ensure_ascii=False, separators=(',', ':')) + '\n' for product in products).encode()
+
+
+def csv_stream(chunks):
+    # header, then the rows of every chunk of products (category flattened)
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(CSV_COLUMNS)
+    yield buffer.getvalue().encode()
+    for products in chunks:
+        buffer.seek(0)
+        buffer.truncate()
+        writer.writerows(
+            [product['id'], product['category']['id'], product['category']['name'], product['name'], product['price'],
+             product['description'], product['discount_rate'], product['coupon_applicable'], product['created_at'],
+             product['final_price']]
+            for product in products
+        )
+        yield buffer.getvalue().encode()
+
+
+# format -> (content type, file extension, encoder)
+EXPORT_FORMATS = {
+    'ndjson': ('application/x-ndjson', 'ndjson', ndjson_stream),
+    'csv': ('text/csv; charset=utf-8', 'csv', csv_stream),
+}
@@ -0,0 +1,120 @@
+import json
+import random
+import tempfile
+import threading
+import time
+from datetime import datetime, timezone as dt_timezone
+from django.core.management.base import BaseCommand
+from django.db import DatabaseError, close_old_connections, connection, connections, transaction
+from django.db.models import F
+from .benchmark_endpoints import seed_catalog
+from ...models import Product
+from ...serializers import PRODUCT_VALUES
+from ....settings import DB_PROFILE, PAGE_SIZE
+
+
+class Command(BaseCommand):
+    help = ('Measure throughput of the configured database profile (MILLIE_DB) at increasing worker counts: '
+            'every worker thread runs list page/detail reads and product writes straight on the ORM, '
+            'ending each one like a request does (connections are reused, pooled or closed as configured)')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--workers', type=int, nargs='+', default=[1, 2, 4, 8, 16])
+        parser.add_argument('--seconds', type=float, default=5, help='run time per worker count')
+        parser.add_argument('--products', type=int, default=10000)
+        parser.add_argument('--write-ratio', type=float, default=0.1, help='share of operations that write (0 ~ 1)')
+        parser.add_argument('--output', default='benchmark_db.json')
+        parser.add_argument('--seed', type=int, default=0)
+
+    def handle(self, *args, **options):
+        random.seed(options['seed'])
+        settings_dict = connection.settings_dict
+        results = {'meta': self._meta(settings_dict, options), 'runs': []}
+
+        # a file (not the in-memory test database) so SQLite locking and WAL behave as in production
+        with tempfile.TemporaryDirectory() as directory:
+            if connection.vendor == 'sqlite':
+                settings_dict['TEST']['NAME'] = f'{directory}/benchmark.sqlite3'
+            old_name = connection.creation.create_test_db(verbosity=0, autoclobber=True)
+            try:
+                product_ids = seed_catalog(options['products'], category_count=50, coupon_count=100)
+                for workers in options['workers']:
+                    results['runs'].append(self._run(workers, product_ids, options['seconds'], options['write_ratio']))
+                    run = results['runs'][-1]
+                    self.stdout.write(f'{workers:>3} workers  {run["ops_per_second"]:>9.1f} ops/s  p50 {run["p50_ms"]:>7.2f}ms  '
+                                      f'p99 {run["p99_ms"]:>7.2f}ms  errors {run["errors"]}')
+            finally:
+                connection.creation.destroy_test_db(old_name, verbosity=0)
+                settings_dict['TEST']['NAME'] = None
+
+        with open(options['output'], 'w') as f:
+            json.dump(results, f, ensure_ascii=False, indent=2)
+        self.stdout.write(self.style.SUCCESS(f'Wrote {options["output"]}'))
+
+    def _meta(self, settings_dict, options):
+        return {
+            'created_at': datetime.now(dt_timezone.utc).isoformat(),
+            'profile': DB_PROFILE,
+            'database': connection.vendor,
+            'conn_max_age': settings_dict['CONN_MAX_AGE'],
+            'options': {key: value for key, value in settings_dict['OPTIONS'].items() if key != 'password'},
+            'products': options['products'],
+            'write_ratio': options['write_ratio'],
+        }
+
+    def _run(self, workers, product_ids, seconds, write_ratio):
+        deadline = time.perf_counter() + seconds
+        latencies, errors = [], []
+        lock = threading.Lock()
+
+        def work(worker_seed):
+            rng = random.Random(worker_seed)
+            worker_latencies, worker_errors = [], 0
+            try:
+                while time.perf_counter() < deadline:
+                    start = time.perf_counter()
+                    try:
+                        self._operation(rng, product_ids, write_ratio)
+                    except DatabaseError:
+                        # e.g. 'database is locked' after busy_timeout, or no pooled connection within the timeout
+                        worker_errors += 1
+                    finally:
+                        # what request_finished does: keep, return to the pool or close the connection
+                        close_old_connections()
+                    worker_latencies.append(time.perf_counter() - start)
+            finally:
+                connections.close_all()
+                with lock:
+                    latencies.extend(worker_latencies)
+                    errors.append(worker_errors)
+
+        threads = [threading.Thread(target=work, args=(worker,)) for worker in range(workers)]
+        start = time.perf_counter()
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        elapsed = time.perf_counter() - start
+
+        latencies.sort()
+        percentile = lambda quantile: latencies[min(int(quantile * len(latencies)), len(latencies) - 1)] * 1000 if latencies else 0.0
+        return {
+            'workers': workers,
+            'operations': len(latencies),
+            'errors': sum(errors),
+            'ops_per_second': round(len(latencies) / elapsed, 1),
+            'p50_ms': round(percentile(0.5), 3),
+            'p99_ms': round(percentile(0.99), 3),
+        }
+
+    def _operation(self, rng, product_ids, write_ratio):
+        choice = rng.random()
+        if choice < write_ratio:
+            # row write without changing the data (still takes the write lock and commits)
+            with transaction.atomic():
+                Product.objects.filter(pk=rng.choice(product_ids)).update(discount_rate=F('discount_rate'))
+        elif choice < (1 + write_ratio) / 2:
+            offset = rng.randrange(max(len(product_ids) - PAGE_SIZE, 1))
+            list(Product.objects.order_by('-created_at').values(*PRODUCT_VALUES)[offset:offset + PAGE_SIZE])
+        else:
+            Product.objects.select_related('category').get(pk=rng.choice(product_ids))
@@ -0,0 +1,192 @@
+import json
+import os
+import platform
+import random
+import re
+import subprocess
+import time
+from datetime import datetime, timezone as dt_timezone
+import django
+from django.core.management import call_command
+from django.core.management.base import BaseCommand
+from django.db import connection
+from django.conf import settings
+from django.test import Client
+from django.test.utils import override_settings
+from ...autocomplete import product_autocomplete
+from ...coupon_index import coupon_index
+from ...models import Category, Product, ProductCoupon
+from ...views import ORDER_FIELDS
+from ....cache import l1_cache
+from ....coupon.models import Coupon
+from ....coupon.views import ORDER_FIELDS as COUPON_ORDER_FIELDS
+from ....settings import PAGE_SIZE, BATCH_SIZE
+
+QUERIES_PATTERN = re.compile(r'desc="(\d+) queries"')
+WORDS = ['smart', 'phone', 'book', 'coffee', 'apple', 'desk', 'lamp', 'shoe', 'watch', 'bag', '사과', '노트북', '커피', '책상']
+
+
+def seed_catalog(product_count, category_count, coupon_count, chunk_size=10000):
+    # random catalog written with bulk_create (uses the random module state), returns the product ids
+    categories = Category.objects.bulk_create([Category(name=f'Category {i}') for i in range(category_count)])
+    coupons = Coupon.objects.bulk_create([
+        Coupon(code=f'BENCH{i}', discount_rate=round(random.uniform(0.05, 0.5), 2), active=i % 10 != 0)
+        for i in range(coupon_count)
+    ])
+    for start in range(0, product_count, chunk_size):
+        products = []
+        for i in range(start, min(start + chunk_size, product_count)):
+            product = Product(name=f'{random.choice(WORDS)} {random.choice(WORDS)} {i}',
+                              description=' '.join(random.choices(WORDS, k=8)),
+                              price=random.randint(100, 2000000), category=random.choice(categories),
+                              discount_rate=round(random.choice([0, 0, 0.05, 0.1, 0.3]), 2),
+                              coupon_applicable=random.random() < 0.5)
+            product.update_display_fields()
+            products.append(product)
+        products = Product.objects.bulk_create(products)
+        ProductCoupon.objects.bulk_create([
+            ProductCoupon(product_id=product.id, coupon=coupon)
+            for product in products if product.coupon_applicable
+            for coupon in random.sample(coupons, min(2, len(coupons)))
+        ], ignore_conflicts=True)
+
+    # bulk_create skips save() and signals
+    with open(os.devnull, 'w') as devnull:
+        for command in ('rebuild_product_display_fields', 'rebuild_product_counts', 'rebuild_search_index'):
+            call_command(command, stdout=devnull)
+    return list(Product.objects.order_by('id').values_list('id', flat=True))
+
+
+class Command(BaseCommand):
+    help = ('Seed catalogs of the given sizes into a fresh test database and measure latency/throughput '
+            'of every endpoint (cold and warm cache), results are written as JSON to compare commits')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--products', type=int, nargs='+', default=[10000], help='catalog sizes, e.g. 10000 100000 1000000')
+        parser.add_argument('--categories', type=int, default=50)
+        parser.add_argument('--coupons', type=int, default=100)
+        parser.add_argument('--requests', type=int, default=20, help='timed requests per case and cache state')
+        parser.add_argument('--output', default='benchmark.json')
+        parser.add_argument('--seed', type=int, default=0)
+        parser.add_argument('--current-db', action='store_true',
+                            help='seed into the current database instead of creating a test database (it should be empty)')
+
+    def handle(self, *args, **options):
+        random.seed(options['seed'])
+        results = {'meta': self._meta(options), 'catalogs': []}
+        for product_count in options['products']:
+            self.stdout.write(f'catalog of {product_count} products')
+            if options['current_db']:
+                results['catalogs'].append(self._run_catalog(product_count, options))
+                continue
+            old_name = connection.creation.create_test_db(verbosity=0, autoclobber=True)
+            try:
+                results['catalogs'].append(self._run_catalog(product_count, options))
+            finally:
+                connection.creation.destroy_test_db(old_name, verbosity=0)
+
+        with open(options['output'], 'w') as f:
+            json.dump(results, f, ensure_ascii=False, indent=2)
+        self.stdout.write(self.style.SUCCESS(f'Wrote {options["output"]}'))
+
+    def _meta(self, options):
+        try:
+            commit = subprocess.run(['git', 'rev-parse', 'HEAD'], cwd=settings.BASE_DIR, capture_output=True,
+                                    text=True, check=True).stdout.strip()
+        except (OSError, subprocess.CalledProcessError):
+            commit = None
+        return {
+            'commit': commit,
+            'created_at': datetime.now(dt_timezone.utc).isoformat(),
+            'python': platform.python_version(),
+            'django': django.get_version(),
+            'database': connection.vendor,
+            'requests': options['requests'],
+        }
+
+    def _run_catalog(self, product_count, options):
+        start = time.perf_counter()
+        product_ids = seed_catalog(product_count, options['categories'], options['coupons'])
+        seed_time = time.perf_counter() - start
+        cases = []
+        # DEBUG would keep every query in memory and skew the timings
+        with override_settings(DEBUG=False, ALLOWED_HOSTS=[*settings.ALLOWED_HOSTS, 'testserver']):
+            for name, url in self._cases(product_ids):
+                for cache_state in ('cold', 'warm'):
+                    cases.append(self._measure(name, url, cache_state, options['requests']))
+                    self.stdout.write(f'  {name:<40} {cache_state:<4} p50 {cases[-1]["p50_ms"]:>8.2f}ms  '
+                                      f'p99 {cases[-1]["p99_ms"]:>8.2f}ms  queries {cases[-1]["queries"]}')
+        return {'products': product_count, 'categories': options['categories'], 'coupons': options['coupons'],
+                'seed_seconds': round(seed_time, 2), 'cases': cases}
+
+    def _cases(self, product_ids):
+        product_id = product_ids[len(product_ids) // 2]
+        last_page = max(len(product_ids) // PAGE_SIZE, 1)
+        category = Category.objects.order_by('id').first()
+        coupon = Coupon.objects.filter(active=True, productcoupon__product__coupon_applicable=True).first()
+        applicable_id = ProductCoupon.objects.filter(coupon=coupon, product__coupon_applicable=True).values_list('product_id', flat=True).first()
+        batch_ids = ','.join(str(product_id) for product_id in random.sample(product_ids, min(BATCH_SIZE, len(product_ids))))
+
+        cases = [
+            ('product list', '/product/'),
+            ('product list deep page', f'/product/?page={last_page}'),
+            ('product list category', f'/product/?category_id={category.id}'),
+            ('product list cursor', '/product/?cursor='),
+            ('product list price range', '/product/?min_price=10000&max_price=50000'),
+            ('product list coupon price', f'/product/?coupon_code={coupon.code}&order_by=final_price&asc=1'),
+        ]
+        for order_field in ORDER_FIELDS:
+            for asc in (0, 1):
+                cases.append((f'product list order {order_field} asc={asc}', f'/product/?order_by={order_field}&asc={asc}'))
+        cases += [
+            ('product batch', f'/product/batch/?ids={batch_ids}'),
+            ('product search', '/product/search/?q=smart phone'),
+            ('product autocomplete', '/product/autocomplete/?prefix=sm'),
+            ('product detail', f'/product/{product_id}/'),
+            ('product detail coupon', f'/product/{applicable_id}/?coupon_code={coupon.code}'),
+            ('product coupons', f'/product/{applicable_id}/coupons/'),
+            ('coupon list', '/coupon/all/?include_inactive=1'),
+        ]
+        for order_field in COUPON_ORDER_FIELDS:
+            cases.append((f'coupon list order {order_field}', f'/coupon/all/?order_by={order_field}'))
+        cases.append(('metrics', '/metrics'))
+        return cases
+
+    def _clear_caches(self):
+        l1_cache.clear()
+        product_autocomplete.clear()
+        coupon_index.clear()
+
+    def _measure(self, name, url, cache_state, requests):
+        client = Client()
+        if cache_state == 'warm':
+            self._clear_caches()
+            client.get(url)
+        latencies, queries = [], []
+        status_code = None
+        for _ in range(requests):
+            if cache_state == 'cold':
+                self._clear_caches()
+            start = time.perf_counter()
+            response = client.get(url)
+            latencies.append(time.perf_counter() - start)
+            status_code = response.status_code
+            match = QUERIES_PATTERN.search(response.get('Server-Timing', ''))
+            if match:
+                queries.append(int(match.group(1)))
+
+        latencies.sort()
+        percentile = lambda quantile: latencies[min(int(quantile * len(latencies)), len(latencies) - 1)] * 1000
+        return {
+            'name': name,
+            'url': url,
+            'cache': cache_state,
+            'status': status_code,
+            'requests': requests,
+            'mean_ms': round(sum(latencies) / len(latencies) * 1000, 3),
+            'p50_ms': round(percentile(0.5), 3),
+            'p95_ms': round(percentile(0.95), 3),
+            'p99_ms': round(percentile(0.99), 3),
+            'rps': round(len(latencies) / sum(latencies), 1),
+            'queries': max(queries) if queries else None,
+        }
@@ -0,0 +1,64 @@
+import random
+import time
+from datetime import timedelta
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+from ...models import Category, Product
+from ...serializers import ProductSerializer, PRODUCT_VALUES, compact_products
+from ....coupon.models import Coupon
+from ....coupon.serializers import CouponSerializer, COUPON_VALUES, compact_coupons
+
+
+class Command(BaseCommand):
+    help = 'Compare rows/sec of the DRF serializers and the compact list serialization (in memory, no DB)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--rows', type=int, default=10000, help='number of rows to serialize')
+        parser.add_argument('--repeat', type=int, default=3, help='best of N runs')
+
+    def handle(self, *args, **options):
+        rows, repeat = options['rows'], options['repeat']
+        now = timezone.now()
+        categories = [Category(id=i, name=f'Category {i}') for i in range(1, 21)]
+        category_names = {category.id: category.name for category in categories}
+        products = [
+            Product(id=i, name=f'Product {i}', description='description ' * 10, price=random.randint(100, 10 ** 7),
+                    category=random.choice(categories), discount_rate=round(random.random(), 2),
+                    coupon_applicable=bool(i % 2), created_at=now - timedelta(seconds=i))
+            for i in range(1, rows + 1)
+        ]
+        for product in products:
+            product.update_display_fields()
+        product_rows = [{field: getattr(product, field) for field in PRODUCT_VALUES} for product in products]
+        coupons = [
+            Coupon(id=i, code=f'C{i}', discount_rate=round(random.random(), 2), active=bool(i % 2),
+                   created_at=now - timedelta(seconds=i))
+            for i in range(1, rows + 1)
+        ]
+        coupon_rows = [{field: getattr(coupon, field) for field in COUPON_VALUES} for coupon in coupons]
+
+        self._compare('product',
+                      lambda: ProductSerializer(products, many=True).data,
+                      lambda: compact_products(product_rows, category_names), rows, repeat)
+        self._compare('coupon',
+                      lambda: CouponSerializer(coupons, many=True).data,
+                      lambda: compact_coupons(coupon_rows), rows, repeat)
+
+    def _compare(self, name, serializer_path, compact_path, rows, repeat):
+        if list(serializer_path()) != compact_path():
+            self.stderr.write(self.style.ERROR(f'{name}: compact output differs from the serializer'))
+            return
+        serializer_time = self._best_of(serializer_path, repeat)
+        compact_time = self._best_of(compact_path, repeat)
+        self.stdout.write(
+            f'{name:<8} serializer: {rows / serializer_time:>12,.0f} rows/sec   '
+            f'compact: {rows / compact_time:>12,.0f} rows/sec   ({serializer_time / compact_time:.1f}x)'
+        )
+
+    def _best_of(self, func, repeat):
+        elapsed = []
+        for _ in range(repeat):
+            start = time.perf_counter()
+            func()
+            elapsed.append(time.perf_counter() - start)
+        return min(elapsed)
@@ -0,0 +1,36 @@
+from django.core.management.base import BaseCommand, CommandError
+from ...bulk import ProductBulkService
+from ....errors import *
+
+
+class Command(BaseCommand):
+    help = 'Assign a coupon to or set the discount rate of many products at once (no per-row save or signal)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--assign-coupon', metavar='COUPON_CODE', help='map this coupon to the selected products')
+        parser.add_argument('--discount-rate', type=float, help='set discount_rate of the selected products (0 ~ 1)')
+        parser.add_argument('--category-id', type=int, help='select products of a category (default: all products)')
+        parser.add_argument('--product-ids', help='select comma separated product ids')
+        parser.add_argument('--chunk-size', type=int, default=1000, help='rows per INSERT/UPDATE')
+
+    def handle(self, *args, **options):
+        if options['assign_coupon'] is None and options['discount_rate'] is None:
+            raise CommandError('--assign-coupon or --discount-rate is required')
+        product_ids = None
+        if options['product_ids']:
+            try:
+                product_ids = [int(product_id) for product_id in options['product_ids'].split(',')]
+            except ValueError:
+                raise CommandError('--product-ids must be comma separated integers')
+        selection = {'category_id': options['category_id'], 'product_ids': product_ids, 'chunk_size': options['chunk_size']}
+
+        bulk_service = ProductBulkService()
+        try:
+            if options['assign_coupon'] is not None:
+                created = bulk_service.assign_coupon(options['assign_coupon'], **selection)
+                self.stdout.write(self.style.SUCCESS(f'Mapped coupon {options["assign_coupon"]} to {created} more products'))
+            if options['discount_rate'] is not None:
+                updated = bulk_service.update_discount_rate(options['discount_rate'], **selection)
+                self.stdout.write(self.style.SUCCESS(f'Set discount rate of {updated} products'))
+        except (CouponDoesNotExist, InvalidDiscountRate) as e:
+            raise CommandError(e.default_detail)
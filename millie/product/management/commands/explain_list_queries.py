@@ -0,0 +1,78 @@
+from django.core.management.base import BaseCommand, CommandError
+from ...models import Category
+from ...service import ProductService
+from ...serializers import PRODUCT_VALUES
+from ...views import ORDER_FIELDS
+from ....coupon.models import Coupon
+from ....coupon.serializers import COUPON_VALUES
+from ....coupon.service import CouponService
+from ....coupon.views import ORDER_FIELDS as COUPON_ORDER_FIELDS
+from ....explain import explain_query_plan, plan_problems
+from ....settings import PAGE_SIZE
+
+
+class Command(BaseCommand):
+    help = ('EXPLAIN the page query of every list filter/sort combination (offset and cursor pagination) '
+            'and report the ones reading a whole table or sorting in memory')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--fail-on-problems', action='store_true', help='exit with an error if any plan has a problem')
+        parser.add_argument('--verbose-plans', action='store_true', help='print the plan of every query, not only the problematic ones')
+
+    def handle(self, *args, **options):
+        problem_count = 0
+        cases = list(self._product_cases()) + list(self._coupon_cases())
+        for name, queryset in cases:
+            plan = explain_query_plan(*queryset.query.sql_with_params(), using=queryset.db)
+            problems = plan_problems(plan)
+            if problems:
+                problem_count += 1
+                self.stdout.write(self.style.WARNING(f'{name}: {", ".join(sorted(problems))}'))
+            else:
+                self.stdout.write(f'{name}: OK')
+            if problems or options['verbose_plans']:
+                for line in plan:
+                    self.stdout.write(f'    {line}')
+
+        summary = f'{problem_count} of {len(cases)} list queries need a full scan or an in-memory sort'
+        if problem_count and options['fail_on_problems']:
+            raise CommandError(summary)
+        self.stdout.write(self.style.SUCCESS(summary))
+
+    def _product_cases(self):
+        product_service = ProductService()
+        category = Category.objects.order_by('id').values_list('id', flat=True).first() or 1
+        coupon = Coupon.objects.filter(active=True).values_list('id', 'discount_rate').first() or (1, 0.1)
+        filters = [
+            ('all', {}),
+            ('category', {'category_id': category}),
+            ('price range', {'min_price': 1000, 'max_price': 500000}),
+            ('coupon price', {'coupon': coupon}),
+        ]
+        for filter_name, filter_kwargs in filters:
+            products = product_service._get_product_queryset(filter_kwargs.get('category_id'))
+            products = product_service._annotate_final_price(products, filter_kwargs.get('coupon'),
+                                                             filter_kwargs.get('min_price'), filter_kwargs.get('max_price'))
+            products = products.values(*PRODUCT_VALUES, 'final_price')
+            for order_field in ORDER_FIELDS:
+                for asc in (0, 1):
+                    name = f'product {filter_name} order_by={order_field} asc={asc}'
+                    ordered = product_service._order_products(products, order_field, asc)
+                    yield f'{name} page', ordered[:PAGE_SIZE]
+                    yield f'{name} cursor', self._cursor_order(products, order_field, asc)[:PAGE_SIZE + 1]
+
+    def _coupon_cases(self):
+        coupon_service = CouponService()
+        for include_inactive in (0, 1):
+            coupons = coupon_service._get_coupon_queryset(include_inactive).values(*COUPON_VALUES)
+            for order_field in COUPON_ORDER_FIELDS:
+                for asc in (0, 1):
+                    name = f'coupon include_inactive={include_inactive} order_by={order_field} asc={asc}'
+                    ordered = coupon_service._order_coupons(coupons, order_field, asc)
+                    yield f'{name} page', ordered[:PAGE_SIZE]
+                    yield f'{name} cursor', self._cursor_order(coupons, order_field, asc)[:PAGE_SIZE + 1]
+
+    def _cursor_order(self, queryset, order_field, asc):
+        # same ordering as paginate_by_cursor
+        prefix = '' if asc else '-'
+        return queryset.order_by(prefix + order_field, prefix + 'pk')
@@ -0,0 +1,13 @@
+from django.core.management.base import BaseCommand
+from ...service import ProductService
+
+
+class Command(BaseCommand):
+    help = 'Rebuild cached product counts per category (fixes drift from bulk writes)'
+
+    def handle(self, *args, **options):
+        product_service = ProductService()
+        category_counts = product_service.rebuild_product_counts()
+        self.stdout.write(self.style.SUCCESS(
+            f'Rebuilt product counts: {sum(category_counts.values())} products in {len(category_counts)} categories'
+        ))
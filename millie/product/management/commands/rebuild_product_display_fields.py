@@ -0,0 +1,14 @@
+from django.core.management.base import BaseCommand
+from ...service import ProductService
+
+
+class Command(BaseCommand):
+    help = 'Recompute precomputed display fields of products (fixes rows written by bulk_create or queryset.update)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--chunk-size', type=int, default=1000, help='rows per bulk_update')
+
+    def handle(self, *args, **options):
+        product_service = ProductService()
+        updated = product_service.rebuild_product_display_fields(chunk_size=options['chunk_size'])
+        self.stdout.write(self.style.SUCCESS(f'Rebuilt display fields of {updated} products'))
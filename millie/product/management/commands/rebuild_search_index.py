@@ -0,0 +1,14 @@
+from django.core.management.base import BaseCommand
+from ...service import ProductService
+
+
+class Command(BaseCommand):
+    help = 'Rebuild the product search index (fixes products written by bulk_create or queryset.update)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--chunk-size', type=int, default=1000, help='products read per query')
+
+    def handle(self, *args, **options):
+        product_service = ProductService()
+        indexed = product_service.rebuild_search_index(chunk_size=options['chunk_size'])
+        self.stdout.write(self.style.SUCCESS(f'Indexed {indexed} products'))
@@ -0,0 +1,23 @@
+from django.core.management.base import BaseCommand
+from ...warmup import CacheWarmer
+from ....settings import WARMUP_CHUNK_SIZE, WARMUP_LIST_PAGES, WARMUP_TIME_BUDGET, WARMUP_TOP_PRODUCTS
+
+
+class Command(BaseCommand):
+    help = ('Preload the shared cache: details of the most viewed products and the first list pages of every category, '
+            'within a time budget (per-worker caches are warmed at startup with MILLIE_WARMUP=1)')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--budget', type=float, default=WARMUP_TIME_BUDGET, help='seconds')
+        parser.add_argument('--top-products', type=int, default=WARMUP_TOP_PRODUCTS)
+        parser.add_argument('--list-pages', type=int, default=WARMUP_LIST_PAGES)
+        parser.add_argument('--chunk-size', type=int, default=WARMUP_CHUNK_SIZE)
+
+    def handle(self, *args, **options):
+        stats = CacheWarmer(budget=options['budget'], top_products=options['top_products'],
+                            list_pages=options['list_pages'], chunk_size=options['chunk_size']).warm()
+        summary = f'Warmed {stats["products"]} product details and {stats["list_pages"]} list pages in {stats["seconds"]}s'
+        if stats['complete']:
+            self.stdout.write(self.style.SUCCESS(summary))
+        else:
+            self.stdout.write(self.style.WARNING(f'{summary}, stopped at the time budget'))
@@ -0,0 +1,59 @@
+# Generated by Django 5.1.4 on 2026-10-17 19:02
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('coupon', '0002_alter_coupon_options_coupon_active_coupon_created_at_and_more'),
+        ('product', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ProductCoupon',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+            ],
+        ),
+        migrations.RenameIndex(
+            model_name='product',
+            new_name='product_pro_created_7f3829_idx',
+            old_name='product_pro_uploade_22bc3d_idx',
+        ),
+        migrations.RenameIndex(
+            model_name='product',
+            new_name='product_pro_created_c61d36_idx',
+            old_name='product_pro_uploade_7e3d69_idx',
+        ),
+        migrations.AlterField(
+            model_name='product',
+            name='coupon_applicable',
+            field=models.BooleanField(default=False),
+        ),
+        migrations.AddField(
+            model_name='productcoupon',
+            name='coupon',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='coupon.coupon'),
+        ),
+        migrations.AddField(
+            model_name='productcoupon',
+            name='product',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='product.product'),
+        ),
+        migrations.AddField(
+            model_name='product',
+            name='coupons',
+            field=models.ManyToManyField(blank=True, related_name='products', through='product.ProductCoupon', to='coupon.coupon'),
+        ),
+        migrations.AddConstraint(
+            model_name='product',
+            constraint=models.CheckConstraint(condition=models.Q(('discount_rate__gte', 0.0), ('discount_rate__lte', 1.0)), name='product_discount_rate_range'),
+        ),
+        migrations.AlterUniqueTogether(
+            name='productcoupon',
+            unique_together={('product', 'coupon')},
+        ),
+    ]
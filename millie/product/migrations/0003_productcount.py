@@ -0,0 +1,22 @@
+# Generated by Django 5.1.4 on 2026-10-17 19:04
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('product', '0002_productcoupon_and_more'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ProductCount',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('count', models.IntegerField(default=0)),
+                ('category', models.OneToOneField(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='product_count', to='product.category')),
+            ],
+        ),
+    ]
@@ -0,0 +1,46 @@
+# Generated by Django 5.1.4 on 2026-10-17 19:14
+
+from django.db import migrations, models
+from millie.formats import format_price, format_rate, format_kst
+
+
+def fill_display_fields(apps, schema_editor):
+    Product = apps.get_model('product', 'Product')
+    products = list(Product.objects.all())
+    for product in products:
+        product.price_display = format_price(product.price)
+        product.discount_rate_display = format_rate(product.discount_rate)
+        product.created_at_display = format_kst(product.created_at)
+        product.base_final_price = int(product.price * (1 - product.discount_rate))
+    Product.objects.bulk_update(products, ['price_display', 'discount_rate_display', 'created_at_display', 'base_final_price'], batch_size=1000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('product', '0003_productcount'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='product',
+            name='base_final_price',
+            field=models.IntegerField(default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name='product',
+            name='created_at_display',
+            field=models.CharField(default='', editable=False, max_length=50),
+        ),
+        migrations.AddField(
+            model_name='product',
+            name='discount_rate_display',
+            field=models.CharField(default='', editable=False, max_length=20),
+        ),
+        migrations.AddField(
+            model_name='product',
+            name='price_display',
+            field=models.CharField(default='', editable=False, max_length=50),
+        ),
+        migrations.RunPython(fill_display_fields, migrations.RunPython.noop),
+    ]
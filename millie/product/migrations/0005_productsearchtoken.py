@@ -0,0 +1,39 @@
+# Generated by Django 5.1.4 on 2026-10-17 19:18
+
+import django.db.models.deletion
+from django.db import migrations, models
+from millie.product.search import build_search_tokens
+
+
+def build_search_index(apps, schema_editor):
+    Product = apps.get_model('product', 'Product')
+    ProductSearchToken = apps.get_model('product', 'ProductSearchToken')
+    for product in Product.objects.only('id', 'name', 'description').iterator(chunk_size=1000):
+        ProductSearchToken.objects.bulk_create([
+            ProductSearchToken(product_id=product.id, token=token, weight=weight)
+            for token, weight in build_search_tokens(product.name, product.description).items()
+        ])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('product', '0004_product_display_fields'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ProductSearchToken',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('token', models.CharField(max_length=20)),
+                ('weight', models.IntegerField()),
+                ('product', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='search_tokens', to='product.product')),
+            ],
+            options={
+                'indexes': [models.Index(fields=['token', 'product'], name='product_pro_token_4ee12c_idx')],
+                'unique_together': {('product', 'token')},
+            },
+        ),
+        migrations.RunPython(build_search_index, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,54 @@
+# Generated by Django 5.1.4 on 2026-10-17 19:35
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('coupon', '0003_coupon_list_indexes'),
+        ('product', '0005_productsearchtoken'),
+    ]
+
+    operations = [
+        migrations.RemoveIndex(
+            model_name='product',
+            name='product_pro_created_7f3829_idx',
+        ),
+        migrations.RemoveIndex(
+            model_name='product',
+            name='product_pro_created_c61d36_idx',
+        ),
+        migrations.AddIndex(
+            model_name='product',
+            index=models.Index(fields=['created_at'], name='product_pro_created_57e07a_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='product',
+            index=models.Index(fields=['name'], name='product_pro_name_b60cd1_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='product',
+            index=models.Index(fields=['coupon_applicable'], name='product_pro_coupon__b3f8a7_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='product',
+            index=models.Index(fields=['base_final_price'], name='product_pro_base_fi_0564ca_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='product',
+            index=models.Index(fields=['category', 'created_at'], name='product_pro_categor_e002b0_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='product',
+            index=models.Index(fields=['category', 'name'], name='product_pro_categor_abc2b1_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='product',
+            index=models.Index(fields=['category', 'coupon_applicable'], name='product_pro_categor_3537b3_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='product',
+            index=models.Index(fields=['category', 'base_final_price'], name='product_pro_categor_e5aeb4_idx'),
+        ),
+    ]
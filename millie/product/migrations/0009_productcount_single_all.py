@@ -0,0 +1,28 @@
+# Generated by Django 5.1.4 on 2026-10-17 20:31
+
+import django.db.models.functions.comparison
+from django.db import migrations, models
+
+
+def merge_all_counts(apps, schema_editor):
+    # duplicated 'all' rows cannot be trusted: replace them with one counted row
+    ProductCount = apps.get_model('product', 'ProductCount')
+    Product = apps.get_model('product', 'Product')
+    if ProductCount.objects.filter(category__isnull=True).count() > 1:
+        ProductCount.objects.filter(category__isnull=True).delete()
+        ProductCount.objects.create(category=None, count=Product.objects.count())
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('product', '0008_product_created_at_default'),
+    ]
+
+    operations = [
+        migrations.RunPython(merge_all_counts, migrations.RunPython.noop),
+        migrations.AddConstraint(
+            model_name='productcount',
+            constraint=models.UniqueConstraint(django.db.models.functions.comparison.Coalesce('category', models.Value(0)), condition=models.Q(('category__isnull', True)), name='product_count_single_all'),
+        ),
+    ]
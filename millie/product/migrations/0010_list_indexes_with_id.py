@@ -0,0 +1,78 @@
+# Generated by Django 5.1.4 on 2026-10-17 20:32
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('coupon', '0004_list_indexes_with_id'),
+        ('product', '0009_productcount_single_all'),
+    ]
+
+    operations = [
+        migrations.RemoveIndex(
+            model_name='product',
+            name='product_pro_created_57e07a_idx',
+        ),
+        migrations.RemoveIndex(
+            model_name='product',
+            name='product_pro_name_b60cd1_idx',
+        ),
+        migrations.RemoveIndex(
+            model_name='product',
+            name='product_pro_coupon__b3f8a7_idx',
+        ),
+        migrations.RemoveIndex(
+            model_name='product',
+            name='product_pro_base_fi_0564ca_idx',
+        ),
+        migrations.RemoveIndex(
+            model_name='product',
+            name='product_pro_categor_e002b0_idx',
+        ),
+        migrations.RemoveIndex(
+            model_name='product',
+            name='product_pro_categor_abc2b1_idx',
+        ),
+        migrations.RemoveIndex(
+            model_name='product',
+            name='product_pro_categor_3537b3_idx',
+        ),
+        migrations.RemoveIndex(
+            model_name='product',
+            name='product_pro_categor_e5aeb4_idx',
+        ),
+        migrations.AddIndex(
+            model_name='product',
+            index=models.Index(fields=['created_at', 'id'], name='product_pro_created_fbec9b_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='product',
+            index=models.Index(fields=['name', 'id'], name='product_pro_name_315b8f_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='product',
+            index=models.Index(fields=['coupon_applicable', 'id'], name='product_pro_coupon__c2b328_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='product',
+            index=models.Index(fields=['base_final_price', 'id'], name='product_pro_base_fi_0f1848_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='product',
+            index=models.Index(fields=['category', 'created_at', 'id'], name='product_pro_categor_c60319_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='product',
+            index=models.Index(fields=['category', 'name', 'id'], name='product_pro_categor_7b3ed8_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='product',
+            index=models.Index(fields=['category', 'coupon_applicable', 'id'], name='product_pro_categor_d2e2a7_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='product',
+            index=models.Index(fields=['category', 'base_final_price', 'id'], name='product_pro_categor_2e9114_idx'),
+        ),
+    ]
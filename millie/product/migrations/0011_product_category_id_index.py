@@ -0,0 +1,18 @@
+# Generated by Django 5.1.4 on 2026-10-17 20:48
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('coupon', '0004_list_indexes_with_id'),
+        ('product', '0010_list_indexes_with_id'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='product',
+            index=models.Index(fields=['category', 'id'], name='product_pro_categor_f7f99b_idx'),
+        ),
+    ]
@@ -1,7 +1,10 @@
 from django.db import models
-from django.db.models import CheckConstraint, Q
+from django.utils import timezone
+from django.db.models import CheckConstraint, Q, UniqueConstraint, Value
+from django.db.models.functions import Coalesce
 from ..coupon.models import Coupon
 from ..errors import *
+from ..formats import format_price, format_rate, format_kst
 import logging
 
 logger = logging.getLogger(__name__)
@@ -23,13 +26,30 @@ class Product(models.Model):
     # Many-to-Many Relationship with Coupon
     coupons = models.ManyToManyField('coupon.Coupon', related_name="products", through="ProductCoupon", blank=True)
 
-    created_at = models.DateTimeField(auto_now_add=True)
+    # set when the instance is made (not by the INSERT like auto_now_add), so its display value is saved with the row
+    created_at = models.DateTimeField(default=timezone.now, editable=False)
+
+    # display values computed when the row is written, so reads skip formatting
+    price_display = models.CharField(max_length=50, default='', editable=False)
+    discount_rate_display = models.CharField(max_length=20, default='', editable=False)
+    created_at_display = models.CharField(max_length=50, default='', editable=False)
+    base_final_price = models.IntegerField(default=0, editable=False)    # final price without coupon
 
     class Meta:
         ordering = ['-created_at']     # default ordering
+        # one index per filter + sort pair the list views accept (SQLite and PostgreSQL read them backwards for desc);
+        # id is listed explicitly as the last column (the tie-breaker of every list and cursor order), since only
+        # SQLite appends the rowid to its indexes: pages sorted by (sort field, id) seek without a sort on PostgreSQL too
         indexes = [
-            models.Index(fields=['created_at', 'name']),  # for pure search by name
-            models.Index(fields=['created_at', 'category', 'name']),  # for category filtering, including name search option
+            models.Index(fields=['created_at', 'id']),  # default ordering
+            models.Index(fields=['name', 'id']),
+            models.Index(fields=['coupon_applicable', 'id']),
+            models.Index(fields=['base_final_price', 'id']),  # order_by=final_price and min_price/max_price without coupon
+            models.Index(fields=['category', 'id']),  # order_by=category_id (the FK's own index is (category) only)
+            models.Index(fields=['category', 'created_at', 'id']),  # category filtering with each ordering
+            models.Index(fields=['category', 'name', 'id']),
+            models.Index(fields=['category', 'coupon_applicable', 'id']),
+            models.Index(fields=['category', 'base_final_price', 'id']),
         ]
         constraints = [
             CheckConstraint(
@@ -41,12 +61,41 @@ class Product(models.Model):
     def __str__(self):
         return self.name
 
+    def save(self, *args, **kwargs):
+        self.update_display_fields()
+        if kwargs.get('update_fields') is not None:
+            kwargs['update_fields'] = set(kwargs['update_fields']) | {'price_display', 'discount_rate_display', 'base_final_price'}
+        # one statement in autocommit: post_save receivers (cache invalidation) run after the row is committed
+        super().save(*args, **kwargs)
+
+    def update_display_fields(self):
+        # also needed before bulk_create(), which skips save()
+        self.price_display = format_price(self.price)
+        self.discount_rate_display = format_rate(self.discount_rate)
+        self.base_final_price = self.get_final_price()
+        if self.created_at:
+            self.created_at_display = format_kst(self.created_at)
+
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        # remember loaded values to move product counts / refresh the coupon index when they change
+        instance._loaded_category_id = instance.__dict__.get('category_id')
+        instance._loaded_coupon_applicable = instance.__dict__.get('coupon_applicable')
+        return instance
+
     def get_final_price(self, coupon=None):
-        total_discount_rate = self.discount_rate
-        if coupon and self.coupon_applicable:
-            total_discount_rate += coupon.discount_rate
+        return self.calculate_final_price(self.price, self.discount_rate, self.coupon_applicable,
+                                          coupon.discount_rate if coupon else None)
+
+    @staticmethod
+    def calculate_final_price(price, discount_rate, coupon_applicable=False, coupon_discount_rate=None):
+        # same rule as get_final_price, usable on cached values without a model instance
+        total_discount_rate = discount_rate
+        if coupon_discount_rate is not None and coupon_applicable:
+            total_discount_rate += coupon_discount_rate
             total_discount_rate = min(total_discount_rate, 1) # max discount_rate is 1
-        final_price = self.price * (1 - total_discount_rate)
+        final_price = price * (1 - total_discount_rate)
         return int(final_price)
 
 class ProductCoupon(models.Model):
@@ -59,3 +108,48 @@ class ProductCoupon(models.Model):
     def __str__(self):
         return f"{self.product.name} - {self.coupon.code}"
 
+
+class ProductCount(models.Model):
+    # number of products per category (category=None holds the count of all products)
+    category = models.OneToOneField(Category, null=True, blank=True, on_delete=models.CASCADE, related_name='product_count')
+    count = models.IntegerField(default=0)
+
+    class Meta:
+        constraints = [
+            # NULLs are distinct in a unique index, so the OneToOneField alone allows several 'all' rows
+            UniqueConstraint(Coalesce('category', Value(0)), condition=Q(category__isnull=True),
+                             name='product_count_single_all'),
+        ]
+
+    def __str__(self):
+        return f"{self.category or 'all'} - {self.count}"
+
+
+class ProductSearchToken(models.Model):
+    # inverted index for product search: n-gram token -> products (see search.py)
+    product = models.ForeignKey(Product, on_delete=models.CASCADE, related_name='search_tokens')
+    token = models.CharField(max_length=20)
+    weight = models.IntegerField()
+
+    class Meta:
+        unique_together = ('product', 'token')
+        indexes = [
+            models.Index(fields=['token', 'product']),  # token lookup, covering product_id
+        ]
+
+    def __str__(self):
+        return f"{self.token} - {self.product_id}"
+
+
+class ProductAccessCount(models.Model):
+    # detail views per product, ranks the hot products preloaded by the cache warm-up (see access_counts.py)
+    product = models.OneToOneField(Product, on_delete=models.CASCADE, related_name='access_count')
+    count = models.BigIntegerField(default=0)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['count']),  # top-N by count
+        ]
+
+    def __str__(self):
+        return f"{self.product_id} - {self.count}"
@@ -0,0 +1,28 @@
+import re
+from collections import Counter
+
+WORD_PATTERN = re.compile(r'\w+')
+NGRAM_SIZE = 2  # bigrams work for Korean words without a morphological analyzer
+NAME_WEIGHT = 3
+DESCRIPTION_WEIGHT = 1
+
+
+def tokenize(text):
+    # lowercase words split into character n-grams (short words are kept whole)
+    tokens = []
+    for word in WORD_PATTERN.findall(text.lower()):
+        if len(word) <= NGRAM_SIZE:
+            tokens.append(word)
+        else:
+            tokens.extend(word[i:i + NGRAM_SIZE] for i in range(len(word) - NGRAM_SIZE + 1))
+    return tokens
+
+
+def build_search_tokens(name, description):
+    # {token: weight}, a token in the name counts more than one in the description
+    weights = Counter()
+    for token in tokenize(name):
+        weights[token] += NAME_WEIGHT
+    for token in tokenize(description):
+        weights[token] += DESCRIPTION_WEIGHT
+    return weights
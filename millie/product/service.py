@@ -1,21 +1,35 @@
+import asyncio
+from contextlib import nullcontext
+from itertools import islice
 from math import ceil
-from django.core.cache import cache
-from .models import Product, Category
-from .serializers import ProductSerializer
+from asgiref.sync import sync_to_async
+from django.db import DEFAULT_DB_ALIAS, router, transaction
+from django.db.models import Case, Count, Exists, F, FloatField, IntegerField, OuterRef, Q, Sum, Value, When
+from django.db.models.functions import Cast, Floor, Least
+from .models import Product, Category, ProductCoupon, ProductCount, ProductSearchToken
+from .access_counts import product_access_counter
+from .autocomplete import product_autocomplete
+from .coupon_index import coupon_index, GENERATION_KEY as COUPON_INDEX_GENERATION_KEY
+from .search import build_search_tokens, tokenize
+from .serializers import PRODUCT_VALUES, compact_products
 from ..coupon.models import Coupon
-from ..coupon.serializers import CouponSerializer
+from ..cache import (l1_cache, get_or_rebuild, aget_or_rebuild, mark_stale, get_many_rebuildable, set_many_rebuildable,
+                     get_versions, aget_versions, bump_versions)
+from ..db_router import read_from_primary, read_from_replica
+from ..hot_keys import hot_key_tracker
 from ..errors import *
-from ..settings import CACHE_MAX_TIMEOUT, PAGE_SIZE
+from ..pagination import paginate_by_cursor
+from ..settings import CACHE_MAX_TIMEOUT, CACHE_MIN_TIMEOUT, CACHE_STALE_WHILE_REVALIDATE, EXPORT_CHUNK_SIZE, PAGE_SIZE
 import logging
 
 logger = logging.getLogger(__name__)
 
 
 class ProductService(object):
-    def get_products(self,category_id=None, page=1, page_size=PAGE_SIZE, order_by=None, asc=0):
+    def _get_product_queryset(self, category_id=None):
         # select_related() preferred for 1:1 or Many:1
         products = Product.objects.all().select_related('category') # lazy-query
-        if category_id:
+        if category_id not in (None, ''):
             try:
                 category_id = int(category_id)
             except ValueError:
@@ -23,70 +37,564 @@ class ProductService(object):
                 raise TypeError
             # select_related() preferred for 1:1 or Many:1
             products = Product.objects.filter(category_id=category_id).select_related('category')
+        return products
+
+    def _get_generation(self, generation_key):
+        # generations version cached values; bumping one makes every key built on it unreachable
+        # (restarted from the current time, so a lost generation never re-validates old entries)
+        return get_versions([generation_key])[0]
+
+    def _list_scope(self, category_id):
+        # 'all' for the unfiltered listing only: category_id=0 is a category of its own (an empty one)
+        return 'all' if category_id is None else category_id
+
+    def _get_product_list_key(self, category_id, page, page_size, order_by, asc, min_price=None, max_price=None):
+        # unversioned key of a list page (tracked as a hot key across generations)
+        return f'product_list_{self._list_scope(category_id)}_{page}_{page_size}_{order_by}_{asc}_{min_price}_{max_price}'
+
+    def _get_product_list_cache_key(self, category_id, list_key):
+        # list pages are versioned by a generation counter per category (and one for the unfiltered listing)
+        generation = self._get_generation(f'product_list_generation_{self._list_scope(category_id)}')
+        return f'{list_key}_{generation}'
+
+    def _track(self, key):
+        # hot-key tracking of a cache read, returns the multiplier of its cache timeouts (hot keys live longer)
+        hot_key_tracker.record(key)
+        hot_key_tracker.flush_if_due()
+        return hot_key_tracker.timeout_factor(key)
 
+    def invalidate_product_list_cache(self, category_ids):
+        # bump generations of the given categories and the unfiltered listing; old pages just expire
+        bump_versions([f'product_list_generation_{self._list_scope(category_id)}' for category_id in set(category_ids) | {None}])
+
+    def _get_category_names(self, category_ids=()):
+        # {category_id: name} for the compact serializer; categories are few and rarely change
+        category_names = l1_cache.get('category_names')
+        if category_names is None or any(category_id not in category_names for category_id in category_ids):
+            with read_from_primary():
+                category_names = dict(Category.objects.values_list('id', 'name'))
+            l1_cache.set('category_names', category_names, timeout=CACHE_MAX_TIMEOUT)
+        return category_names
+
+    def invalidate_category_names(self):
+        l1_cache.delete('category_names')
+
+    def _order_products(self, products, order_by=None, asc=0):
         if (order_by is not None and order_by != 'created_at') or (asc is not None and asc > 0):
             order_field = order_by or 'created_at'
             ascending = asc or 0
             if ascending == 0:
                 order_field = '-' + order_field
             products = products.order_by(order_field)
+        return products
+
+    def _get_coupon_for_price(self, coupon_code):
+        # (id, discount_rate) of the active coupon applied to list prices
+        coupon = Coupon.objects.filter(code=coupon_code, active=True).values_list('id', 'discount_rate').first()
+        if coupon is None:
+            logger.error(f'Failed to find coupon object with coupon_code: {coupon_code}')
+            raise CouponDoesNotExist
+        return coupon
+
+    def _annotate_final_price(self, products, coupon=None, min_price=None, max_price=None):
+        '''
+        final_price computed by the DB so pages can be filtered and sorted by it
+        (same double arithmetic and truncation as Product.calculate_final_price, prices are not negative)
+        '''
+        final_price = F('base_final_price')
+        if coupon is not None:
+            coupon_id, coupon_discount_rate = coupon
+            # only products mapped to the coupon get it, like the product detail
+            coupon_mapped = Exists(ProductCoupon.objects.filter(product_id=OuterRef('pk'), coupon_id=coupon_id))
+            total_discount_rate = Least(F('discount_rate') + Value(coupon_discount_rate), Value(1.0)) # max discount_rate is 1
+            coupon_price = Cast(Floor(Cast(F('price'), FloatField()) * (Value(1.0) - total_discount_rate)), IntegerField())
+            final_price = Case(When(Q(coupon_applicable=True) & coupon_mapped, then=coupon_price),
+                               default=F('base_final_price'), output_field=IntegerField())
+        products = products.annotate(final_price=final_price)
+        if min_price is not None:
+            products = products.filter(final_price__gte=min_price)
+        if max_price is not None:
+            products = products.filter(final_price__lte=max_price)
+        return products
+
+    def _compact_product_rows(self, rows, category_names):
+        # list items also carry final_price (annotated, or the stored price without coupon)
+        products = compact_products(rows, category_names)
+        for product, row in zip(products, rows):
+            product['final_price'] = row.get('final_price', row['base_final_price'])
+        return products
+
+    @read_from_replica
+    def get_products(self,category_id=None, page=1, page_size=PAGE_SIZE, order_by=None, asc=0,
+                     coupon_code=None, min_price=None, max_price=None, track=True):
+        products = self._get_product_queryset(category_id)
+        category_id = int(category_id) if category_id not in (None, '') else None
+
+        # pages priced with a coupon also depend on its mappings, which do not bump list generations
+        cache_key = None
+        if not coupon_code:
+            list_key = self._get_product_list_key(category_id, page, page_size, order_by, asc, min_price, max_price)
+            # track=False: reads that are not client demand (cache warm-up) are not counted as hot
+            timeout_factor = self._track(list_key) if track else hot_key_tracker.timeout_factor(list_key)
+            cache_key = self._get_product_list_cache_key(category_id, list_key)
+            products_data = l1_cache.get(cache_key)
+            if products_data is not None:
+                return products_data
+
+        # a page stored in the shared cache is read from the primary: cached from a lagging replica, it would stay
+        # stale under the new generation (and its ETag) until it expires
+        with read_from_primary() if cache_key is not None else nullcontext():
+            coupon = self._get_coupon_for_price(coupon_code) if coupon_code else None
+            products = self._annotate_final_price(products, coupon, min_price, max_price)
+            products = self._order_products(products, order_by, asc)
+
+            # implement pagination
+            if min_price is None and max_price is None:
+                total_count = self.get_product_count(category_id)
+            else:
+                total_count = products.count()
+            start = (page - 1) * page_size
+            end = start + page_size
+            total_pages = ceil(total_count / page_size)
+            rows = list(products.values(*PRODUCT_VALUES, 'final_price')[start:end])
+
+            products_data = {
+                'total_count': total_count,
+                'total_pages': total_pages,
+                'current_page': page,
+                'page_size': page_size,
+                'products': self._compact_product_rows(rows, self._get_category_names(row['category_id'] for row in rows))
+            }
+        if cache_key is not None:
+            l1_cache.set(cache_key, products_data, timeout=CACHE_MAX_TIMEOUT * timeout_factor)
+
+        return products_data
+
+    @read_from_replica
+    def get_products_by_cursor(self, category_id=None, cursor=None, page_size=PAGE_SIZE, order_by=None, asc=0, with_count=0,
+                               coupon_code=None, min_price=None, max_price=None):
+        products = self._get_product_queryset(category_id)
+        coupon = self._get_coupon_for_price(coupon_code) if coupon_code else None
+        products = self._annotate_final_price(products, coupon, min_price, max_price)
+
+        # seek on (order_by, id) so deep pages cost the same as the first one
+        rows, next_cursor, prev_cursor = paginate_by_cursor(
+            products.values(*PRODUCT_VALUES, 'final_price'), order_field=order_by or 'created_at', ascending=asc, cursor=cursor, page_size=page_size
+        )
+
+        products_data = {
+            'next_cursor': next_cursor,
+            'prev_cursor': prev_cursor,
+            'page_size': page_size,
+            'products': self._compact_product_rows(rows, self._get_category_names(row['category_id'] for row in rows))
+        }
+        # COUNT scans the whole filtered set, so only run it on demand
+        if with_count == 1:
+            if min_price is None and max_price is None:
+                products_data['total_count'] = self.get_product_count(int(category_id) if category_id not in (None, '') else None)
+            else:
+                products_data['total_count'] = products.count()
+
+        return products_data
+
+    @read_from_replica
+    def export_products(self, category_id=None, chunk_size=EXPORT_CHUNK_SIZE):
+        # lists of list items (with final_price) in id order, chunk_size rows per fetch, for streaming the whole catalog;
+        # the database is chosen now, the rows are read while the response streams (outside of this call)
+        products = self._get_product_queryset(category_id).using(router.db_for_read(Product))
+        rows = products.order_by('id').values(*PRODUCT_VALUES).iterator(chunk_size=chunk_size)
+        return self._export_chunks(rows, chunk_size)
+
+    def _export_chunks(self, rows, chunk_size):
+        while chunk := list(islice(rows, chunk_size)):
+            yield self._compact_product_rows(chunk, self._get_category_names(row['category_id'] for row in chunk))
+
+    def _build_product_base(self, product_id):
+        try:
+            # from the primary, like every read stored in the shared cache (see get_products)
+            with read_from_primary():
+                # select_related() preferred for 1:1 or Many:1
+                product = Product.objects.select_related('category').get(id=product_id)
+        except Product.DoesNotExist:
+            logger.error(f'Failed to get product object with product_id: {product_id}')
+            raise ProductDoesNotExist
+        return self._serialize_product_base(product)
+
+    def _serialize_product_base(self, product):
+        row = {field: getattr(product, field) for field in PRODUCT_VALUES}
+        return {
+            'product': compact_products([row], {product.category_id: product.category.name})[0],
+            'price': product.price,
+            'discount_rate': product.discount_rate,
+            'coupon_applicable': product.coupon_applicable,
+            'base_final_price': product.base_final_price,
+        }
+
+    def _get_product_base(self, product_id):
+        # tier 1: serialized product with the raw price fields, shared by every coupon
+        # only one worker rebuilds a missing/expiring entry, the others get the stale one or wait for it
+        cache_key = f'product_detail_{product_id}'
+        timeout_factor = self._track(cache_key)
+        return get_or_rebuild(cache_key, lambda: self._build_product_base(product_id),
+                              CACHE_MIN_TIMEOUT * timeout_factor, CACHE_MAX_TIMEOUT * timeout_factor)
+
+    def _apply_coupon(self, product_base, get_coupon_rate, coupon_code=None):
+        coupon_discount_rate = None
+        if coupon_code and product_base['coupon_applicable']:
+            # coupon rate is only looked up when a coupon is actually applied
+            coupon_discount_rate = get_coupon_rate()
+            if coupon_discount_rate is None:
+                logger.error(f'Failed to find coupon object with coupon_code: {coupon_code}')
+                raise CouponDoesNotExist
+
+        # final_price depends on the coupon, so it is computed per request and never cached
+        product_detail = dict(product_base['product'])
+        if coupon_discount_rate is None:
+            product_detail['final_price'] = product_base['base_final_price']
+        else:
+            product_detail['final_price'] = Product.calculate_final_price(
+                product_base['price'], product_base['discount_rate'], product_base['coupon_applicable'], coupon_discount_rate
+            )
+        return product_detail
+
+    def _record_view(self, product_id):
+        # autocomplete ranking (shared through the cache), and the persisted access counts ranking the cache warm-up
+        product_autocomplete.record_view(product_id)
+        product_access_counter.record(product_id)
+
+    @read_from_replica
+    def get_product_detail(self, product_id, coupon_code=None):
+        product_base = self._get_product_base(product_id)
+        self._record_view(product_id)
+        if product_access_counter.flush_due():
+            product_access_counter.flush()
+        if product_autocomplete.popularity_sync_due():
+            product_autocomplete.sync_popularity()
+        return self._apply_coupon(product_base, lambda: coupon_index.get_coupon_rate(product_id, coupon_code), coupon_code)
+
+    @read_from_replica
+    def get_product_details(self, product_ids, coupon_code=None, track=True):
+        # detail of several products in O(1) cache/DB round trips, in the requested order
+        unique_ids = list(dict.fromkeys(product_ids))
+        cache_keys = {product_id: f'product_detail_{product_id}' for product_id in unique_ids}
+        if track:
+            for cache_key in cache_keys.values():
+                hot_key_tracker.record(cache_key)
+            hot_key_tracker.flush_if_due()
+        cached = get_many_rebuildable(cache_keys.values())
+        product_bases = {product_id: cached[cache_key] for product_id, cache_key in cache_keys.items() if cache_key in cached}
+
+        misses = [product_id for product_id in unique_ids if product_id not in product_bases]
+        if misses:
+            # select_related() preferred for 1:1 or Many:1
+            products = Product.objects.select_related('category').filter(id__in=misses).order_by()
+            with read_from_primary():
+                rebuilt = {product.id: self._serialize_product_base(product) for product in products}
+            # one write per timeout: hot products are cached longer
+            by_factor = {}
+            for product_id, product_base in rebuilt.items():
+                by_factor.setdefault(hot_key_tracker.timeout_factor(cache_keys[product_id]), {})[cache_keys[product_id]] = product_base
+            for timeout_factor, data in by_factor.items():
+                set_many_rebuildable(data, CACHE_MIN_TIMEOUT * timeout_factor, CACHE_MAX_TIMEOUT * timeout_factor)
+            product_bases.update(rebuilt)
+
+        product_details = []
+        for product_id in product_ids:
+            if product_id not in product_bases:
+                product_details.append({'id': product_id, 'error': ProductDoesNotExist.default_detail})
+                continue
+            try:
+                product_details.append(self._apply_coupon(product_bases[product_id],
+                                                          lambda: coupon_index.get_coupon_rate(product_id, coupon_code), coupon_code))
+            except CouponDoesNotExist:
+                product_details.append({'id': product_id, 'error': CouponDoesNotExist.default_detail})
+        return product_details
+
+    def invalidate_product_cache(self, product_id):
+        # also bumps the product version (ETag of its detail and coupons)
+        if CACHE_STALE_WHILE_REVALIDATE:
+            mark_stale(f'product_detail_{product_id}')
+        else:
+            l1_cache.delete(f'product_detail_{product_id}')
+        bump_versions([f'product_version_{product_id}'])
+
+    def invalidate_product_caches(self, product_ids):
+        # invalidate_product_cache() of many products with one delete and one version bump
+        product_ids = list(product_ids)
+        l1_cache.delete_many([f'product_detail_{product_id}' for product_id in product_ids])
+        bump_versions([f'product_version_{product_id}' for product_id in product_ids])
+
+    def invalidate_category_cache(self, category_id):
+        # category name is embedded in list pages and in the detail of every product in it
+        self.invalidate_product_list_cache([category_id])
+        self.invalidate_product_caches(Product.objects.filter(category_id=category_id).values_list('id', flat=True))
+
+    def get_product_versions(self, product_id, with_coupons=False):
+        # validators of the product detail/coupons: its version, and the coupon index generation if coupons are involved
+        return get_versions(self._product_version_keys(product_id, with_coupons))
+
+    def get_product_list_versions(self, category_id=None, with_coupons=False):
+        # validators of list pages: the generation their cache keys are built on (+ coupon index generation for coupon prices)
+        return get_versions(self._product_list_version_keys(category_id, with_coupons))
+
+    def _product_version_keys(self, product_id, with_coupons):
+        return [f'product_version_{product_id}'] + ([COUPON_INDEX_GENERATION_KEY] if with_coupons else [])
+
+    def _product_list_version_keys(self, category_id, with_coupons):
+        return [f'product_list_generation_{self._list_scope(category_id)}'] + ([COUPON_INDEX_GENERATION_KEY] if with_coupons else [])
+
+    def invalidate_product_coupon_cache(self):
+        # coupons, mappings or coupon_applicable changed: every worker reloads its coupon index
+        coupon_index.invalidate()
+
+    def get_product_count(self, category_id=None):
+        # read the maintained count instead of scanning the filtered products
+        product_count = ProductCount.objects.filter(category_id=category_id).values_list('count', flat=True).first()
+        if product_count is None:
+            # not stored yet: count once and keep it (empty categories are not stored);
+            # on the primary explicitly: a replica may lag, and the write should not pin the request (db_router)
+            products = Product.objects.using(DEFAULT_DB_ALIAS)
+            products = products.all() if category_id is None else products.filter(category_id=category_id)
+            product_count = products.count()
+            if category_id is None or product_count > 0:
+                product_count = ProductCount.objects.using(DEFAULT_DB_ALIAS).get_or_create(
+                    category_id=category_id, defaults={'count': product_count})[0].count
+        return product_count
+
+    def update_product_count(self, category_id, delta, update_all=True):
+        # update the category count (and the count of all products)
+        for count_category_id in ((category_id, None) if update_all else (category_id,)):
+            updated = ProductCount.objects.filter(category_id=count_category_id).update(count=F('count') + delta)
+            if not updated:
+                # the product table already reflects this change, so counting seeds the right value
+                self.get_product_count(count_category_id)
+
+    def search_products(self, query, category_id=None, page=1, page_size=PAGE_SIZE):
+        # every query token must match; products are ranked by the summed token weights
+        tokens = set(tokenize(query))
+        matches = ProductSearchToken.objects.filter(token__in=tokens)
+        if category_id:
+            try:
+                category_id = int(category_id)
+            except ValueError:
+                logger.error(f'Failed to search products by category_id: {category_id}')
+                raise TypeError
+            matches = matches.filter(product__category_id=category_id)
+        ranked = (matches.values('product_id')
+                  .annotate(matched=Count('token'), score=Sum('weight'))
+                  .filter(matched=len(tokens))
+                  .order_by('-score', '-product_id'))
 
         # implement pagination
-        total_count = products.count()
+        total_count = ranked.count() if tokens else 0
         start = (page - 1) * page_size
         end = start + page_size
         total_pages = ceil(total_count / page_size)
-        products = products[start:end]
+        product_ids = [match['product_id'] for match in ranked[start:end]] if tokens else []
+        rows = {row['id']: row for row in Product.objects.filter(id__in=product_ids).values(*PRODUCT_VALUES)}
+        rows = [rows[product_id] for product_id in product_ids if product_id in rows]
 
-        serializer = ProductSerializer(products, many=True)
         products_data = {
             'total_count': total_count,
             'total_pages': total_pages,
             'current_page': page,
             'page_size': page_size,
-            'products': serializer.data
+            'products': self._compact_product_rows(rows, self._get_category_names(row['category_id'] for row in rows))
         }
 
         return products_data
 
-    def get_product_detail(self, product_id, coupon_code=None):
-        cache_key = f'product_detail_{product_id}'
-        product_detail = cache.get(cache_key)
-        if not product_detail:
-            try:
-                # select_related() preferred for 1:1 or Many:1
-                product = Product.objects.select_related('category').get(id=product_id)
-            except Product.DoesNotExist:
-                logger.error(f'Failed to get product object with product_id: {product_id}')
-                raise ProductDoesNotExist
-
-            coupon = None
-            if coupon_code and product.coupon_applicable:
-                coupon = product.coupons.filter(code=coupon_code, active=True).first()
-                if not coupon:
-                    logger.error(f'Failed to find coupon object with coupon_code: {coupon_code}')
-                    raise CouponDoesNotExist
-
-            final_price = product.get_final_price(coupon)
-            product_detail = ProductSerializer(product).data
-            product_detail['final_price'] = final_price
-            cache.set(cache_key, product_detail, timeout=CACHE_MAX_TIMEOUT)
+    def autocomplete_products(self, prefix, limit=10):
+        # product names starting with prefix, most viewed first (served from memory)
+        return product_autocomplete.search(prefix, limit)
 
-        return product_detail
+    def update_autocomplete(self, product, deleted=False):
+        if deleted:
+            product_autocomplete.remove(product.id)
+        else:
+            product_autocomplete.update(product.id, product.name)
 
-    def invalidate_product_cache(self, product_id):
-        cache.delete(f'product_detail_{product_id}')
+    def index_product(self, product):
+        # replace the search tokens of a product
+        with transaction.atomic():
+            ProductSearchToken.objects.filter(product_id=product.id).delete()
+            ProductSearchToken.objects.bulk_create([
+                ProductSearchToken(product_id=product.id, token=token, weight=weight)
+                for token, weight in build_search_tokens(product.name, product.description).items()
+            ])
+
+    def rebuild_search_index(self, chunk_size=1000):
+        # reindex every product (e.g. after bulk_create, which skips signals)
+        indexed, search_tokens = 0, []
+        with transaction.atomic():
+            ProductSearchToken.objects.all().delete()
+            for product in Product.objects.order_by().only('id', 'name', 'description').iterator(chunk_size=chunk_size):
+                search_tokens.extend(
+                    ProductSearchToken(product_id=product.id, token=token, weight=weight)
+                    for token, weight in build_search_tokens(product.name, product.description).items()
+                )
+                indexed += 1
+                if indexed % chunk_size == 0:
+                    ProductSearchToken.objects.bulk_create(search_tokens)
+                    search_tokens = []
+            ProductSearchToken.objects.bulk_create(search_tokens)
+        return indexed
+
+    def rebuild_product_display_fields(self, chunk_size=1000):
+        # recompute display fields of rows written without save() (e.g. bulk_create or queryset.update)
+        display_fields = ['price_display', 'discount_rate_display', 'created_at_display', 'base_final_price']
+        products = Product.objects.order_by('pk').only('id', 'category_id', 'price', 'discount_rate', 'coupon_applicable', 'created_at', *display_fields)
+        updated, chunk, category_ids = 0, [], set()
+        for product in products.iterator(chunk_size=chunk_size):
+            product.update_display_fields()
+            chunk.append(product)
+            category_ids.add(product.category_id)
+            if len(chunk) == chunk_size:
+                updated += self._save_display_fields(chunk, display_fields)
+                chunk = []
+        if chunk:
+            updated += self._save_display_fields(chunk, display_fields)
+        self.invalidate_product_list_cache(category_ids)
+        return updated
+
+    def _save_display_fields(self, products, display_fields):
+        Product.objects.bulk_update(products, display_fields)
+        self.invalidate_product_caches(product.id for product in products)
+        return len(products)
+
+    def rebuild_product_counts(self):
+        # recount every category from scratch to fix drift (e.g. after bulk_create or queryset.update)
+        category_counts = dict(Product.objects.order_by().values_list('category_id').annotate(count=Count('id')))
+        product_counts = [ProductCount(category_id=category_id, count=count) for category_id, count in category_counts.items()]
+        product_counts.append(ProductCount(category=None, count=sum(category_counts.values())))
+        with transaction.atomic():
+            ProductCount.objects.all().delete()
+            ProductCount.objects.bulk_create(product_counts)
+        return category_counts
 
+    @read_from_replica
     def get_available_coupons(self, product_id):
+        # product must exist (cached tier 1), its active coupons come from the in-memory index
+        # (empty when the product is not coupon_applicable)
+        self._get_product_base(product_id)
+        return coupon_index.get_coupons(product_id)
+
+    # async versions of the read paths for the async views (Django async ORM and async cache API)
+
+    async def _aget_generation(self, generation_key):
+        return (await aget_versions([generation_key]))[0]
+
+    async def _atrack(self, key):
+        hot_key_tracker.record(key)
+        await hot_key_tracker.aflush_if_due()
+        return hot_key_tracker.timeout_factor(key)
+
+    async def _aget_product_base(self, product_id):
+        cache_key = f'product_detail_{product_id}'
+        timeout_factor = await self._atrack(cache_key)
+        return await aget_or_rebuild(cache_key, lambda: self._abuild_product_base(product_id),
+                                     CACHE_MIN_TIMEOUT * timeout_factor, CACHE_MAX_TIMEOUT * timeout_factor)
+
+    async def aget_product_versions(self, product_id, with_coupons=False):
+        return await aget_versions(self._product_version_keys(product_id, with_coupons))
+
+    async def aget_product_list_versions(self, category_id=None, with_coupons=False):
+        return await aget_versions(self._product_list_version_keys(category_id, with_coupons))
+
+    async def _aget_category_names(self, category_ids=()):
+        category_names = await l1_cache.aget('category_names')
+        if category_names is None or any(category_id not in category_names for category_id in category_ids):
+            with read_from_primary():
+                category_names = {category_id: name async for category_id, name in Category.objects.values_list('id', 'name')}
+            await l1_cache.aset('category_names', category_names, timeout=CACHE_MAX_TIMEOUT)
+        return category_names
+
+    async def aget_product_count(self, category_id=None):
+        product_count = await ProductCount.objects.filter(category_id=category_id).values_list('count', flat=True).afirst()
+        if product_count is None:
+            products = Product.objects.using(DEFAULT_DB_ALIAS)
+            products = products.all() if category_id is None else products.filter(category_id=category_id)
+            product_count = await products.acount()
+            if category_id is None or product_count > 0:
+                product_count = (await ProductCount.objects.using(DEFAULT_DB_ALIAS).aget_or_create(
+                    category_id=category_id, defaults={'count': product_count}))[0].count
+        return product_count
+
+    async def _aget_coupon_for_price(self, coupon_code):
+        coupon = await Coupon.objects.filter(code=coupon_code, active=True).values_list('id', 'discount_rate').afirst()
+        if coupon is None:
+            logger.error(f'Failed to find coupon object with coupon_code: {coupon_code}')
+            raise CouponDoesNotExist
+        return coupon
+
+    @read_from_replica
+    async def aget_products(self, category_id=None, page=1, page_size=PAGE_SIZE, order_by=None, asc=0,
+                            coupon_code=None, min_price=None, max_price=None):
+        products = self._get_product_queryset(category_id)
+        category_id = int(category_id) if category_id not in (None, '') else None
+
+        cache_key = None
+        if not coupon_code:
+            list_key = self._get_product_list_key(category_id, page, page_size, order_by, asc, min_price, max_price)
+            timeout_factor = await self._atrack(list_key)
+            generation = await self._aget_generation(f'product_list_generation_{self._list_scope(category_id)}')
+            cache_key = f'{list_key}_{generation}'
+            products_data = await l1_cache.aget(cache_key)
+            if products_data is not None:
+                return products_data
+
+        with read_from_primary() if cache_key is not None else nullcontext():
+            coupon = await self._aget_coupon_for_price(coupon_code) if coupon_code else None
+            products = self._annotate_final_price(products, coupon, min_price, max_price)
+            products = self._order_products(products, order_by, asc)
+            start = (page - 1) * page_size
+            end = start + page_size
+            page_rows = products.values(*PRODUCT_VALUES, 'final_price')[start:end]
+
+            async def fetch_rows():
+                return [row async for row in page_rows]
+
+            if min_price is None and max_price is None:
+                count = self.aget_product_count(category_id)
+            else:
+                count = products.acount()
+            # count and page queries are awaited together
+            total_count, rows = await asyncio.gather(count, fetch_rows())
+            products_data = {
+                'total_count': total_count,
+                'total_pages': ceil(total_count / page_size),
+                'current_page': page,
+                'page_size': page_size,
+                'products': self._compact_product_rows(rows, await self._aget_category_names(row['category_id'] for row in rows))
+            }
+        if cache_key is not None:
+            await l1_cache.aset(cache_key, products_data, timeout=CACHE_MAX_TIMEOUT * timeout_factor)
+
+        return products_data
+
+    async def _abuild_product_base(self, product_id):
         try:
-            # prefetch_related() preferred for Many:Many or 1:Many
-            product = Product.objects.prefetch_related('coupons').get(id=product_id)
+            with read_from_primary():
+                product = await Product.objects.select_related('category').aget(id=product_id)
         except Product.DoesNotExist:
+            logger.error(f'Failed to get product object with product_id: {product_id}')
             raise ProductDoesNotExist
+        return self._serialize_product_base(product)
 
-        if not product.coupon_applicable:
-            return []
+    @read_from_replica
+    async def aget_product_detail(self, product_id, coupon_code=None):
+        product_base = await self._aget_product_base(product_id)
+        self._record_view(product_id)
+        if product_access_counter.flush_due():
+            await sync_to_async(product_access_counter.flush)()
+        if product_autocomplete.popularity_sync_due():
+            await sync_to_async(product_autocomplete.sync_popularity)()
+        coupon_discount_rate = None
+        if coupon_code and product_base['coupon_applicable']:
+            coupon_discount_rate = await coupon_index.aget_coupon_rate(product_id, coupon_code)
+        return self._apply_coupon(product_base, lambda: coupon_discount_rate, coupon_code)
 
-        available_coupons = product.coupons.filter(active=True)
-        coupons_data = CouponSerializer(available_coupons, many=True).data
-        return coupons_data
+    @read_from_replica
+    async def aget_available_coupons(self, product_id):
+        await self._aget_product_base(product_id)
+        return await coupon_index.aget_coupons(product_id)
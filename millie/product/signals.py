@@ -1,11 +1,78 @@
-from django.db.models.signals import post_save, post_delete
+from django.db.models.signals import post_save, post_delete, m2m_changed
 from django.dispatch import receiver
-from .models import Product
+from .models import Product, Category, ProductCoupon
+from ..coupon.models import Coupon
+from ..coupon.service import CouponService
 from .service import ProductService
 
+# receivers run in definition order: counts are updated before cached pages are invalidated
+
 @receiver(post_save, sender=Product)
+def handle_product_count_on_save(sender, instance, created, **kwargs):
+    product_service = ProductService()
+    loaded_category_id = getattr(instance, '_loaded_category_id', instance.category_id)
+    if created:
+        product_service.update_product_count(instance.category_id, 1)
+    elif loaded_category_id != instance.category_id:
+        # product moved to another category
+        product_service.update_product_count(loaded_category_id, -1, update_all=False)
+        product_service.update_product_count(instance.category_id, 1, update_all=False)
+
 @receiver(post_delete, sender=Product)
-def handle_product_cache_invalidation(sender, instance, **kwargs):
+def handle_product_count_on_delete(sender, instance, **kwargs):
+    product_service = ProductService()
+    product_service.update_product_count(instance.category_id, -1)
+
+@receiver(post_save, sender=Product)
+def handle_product_search_index(sender, instance, **kwargs):
+    # tokens of deleted products go away with the CASCADE
+    product_service = ProductService()
+    product_service.index_product(instance)
+
+@receiver(post_save, sender=Product)
+@receiver(post_delete, sender=Product)
+def handle_product_cache_invalidation(sender, instance, signal, **kwargs):
     if sender == Product:
         product_service = ProductService()
         product_service.invalidate_product_cache(instance.id)
+        product_service.update_autocomplete(instance, deleted=signal is post_delete)
+        loaded_coupon_applicable = getattr(instance, '_loaded_coupon_applicable', instance.coupon_applicable)
+        if loaded_coupon_applicable != instance.coupon_applicable:
+            # the coupon index only holds coupon applicable products
+            product_service.invalidate_product_coupon_cache()
+        # only pages of its own category (before and after a move) and the unfiltered listing
+        loaded_category_id = getattr(instance, '_loaded_category_id', instance.category_id)
+        product_service.invalidate_product_list_cache([instance.category_id, loaded_category_id])
+        instance._loaded_category_id = instance.category_id
+        instance._loaded_coupon_applicable = instance.coupon_applicable
+
+@receiver(post_save, sender=Category)
+@receiver(post_delete, sender=Category)
+def handle_category_cache_invalidation(sender, instance, created=False, **kwargs):
+    product_service = ProductService()
+    product_service.invalidate_category_names()
+    if not created:
+        product_service.invalidate_category_cache(instance.id)
+
+@receiver(post_save, sender=Coupon)
+@receiver(post_delete, sender=Coupon)
+def handle_coupon_cache_invalidation(sender, instance, **kwargs):
+    # a coupon can be mapped to any number of products
+    product_service = ProductService()
+    product_service.invalidate_product_coupon_cache()
+    coupon_service = CouponService()
+    coupon_service.invalidate_coupon_list_cache()
+
+@receiver(post_save, sender=ProductCoupon)
+@receiver(post_delete, sender=ProductCoupon)
+def handle_product_coupon_cache_invalidation(sender, instance, **kwargs):
+    product_service = ProductService()
+    product_service.invalidate_product_coupon_cache()
+
+@receiver(m2m_changed, sender=ProductCoupon)
+def handle_product_coupons_changed(sender, instance, action, reverse, pk_set, **kwargs):
+    # product.coupons.add()/remove()/clear() skip post_save/post_delete of ProductCoupon
+    if action not in ('post_add', 'post_remove', 'post_clear'):
+        return
+    product_service = ProductService()
+    product_service.invalidate_product_coupon_cache()
@@ -1,8 +1,13 @@
 from django.urls import path
 from . import views
+from ..settings import ASYNC_VIEWS
 
 urlpatterns = [
-    path('', views.get_products, name='get_products'),
-    path('<int:product_id>/', views.get_product_detail, name='get_product_detail'),
-    path('<int:product_id>/coupons/', views.get_available_coupons, name='get_available_coupons'),
+    path('', views.aget_products if ASYNC_VIEWS else views.get_products, name='get_products'),
+    path('batch/', views.get_product_details, name='get_product_details'),
+    path('search/', views.search_products, name='search_products'),
+    path('autocomplete/', views.autocomplete_products, name='autocomplete_products'),
+    path('export/', views.export_products, name='export_products'),
+    path('<int:product_id>/', views.aget_product_detail if ASYNC_VIEWS else views.get_product_detail, name='get_product_detail'),
+    path('<int:product_id>/coupons/', views.aget_available_coupons if ASYNC_VIEWS else views.get_available_coupons, name='get_available_coupons'),
 ]
\ No newline at end of file
@@ -1,12 +1,57 @@
+from asgiref.sync import sync_to_async
+from django.views.decorators.http import require_GET
 from rest_framework.decorators import api_view
 from rest_framework.response import Response
 from rest_framework import status
 from ..errors import *
+from ..http import conditional, download_response, json_response
+from .export import EXPORT_FORMATS
 from .service import ProductService
-from ..settings import PAGE_SIZE
+from ..settings import PAGE_SIZE, BATCH_SIZE, AUTOCOMPLETE_MAX_LIMIT
 
-ORDER_FIELDS = ['name', 'category_id', 'coupon_applicable', 'created_at']
+ORDER_FIELDS = ['name', 'category_id', 'coupon_applicable', 'created_at', 'final_price']
 
+
+# versions of the responses for conditional GET (cache lookups only, see millie.http.conditional)
+
+def _list_category_id(request):
+    category_id = request.GET.get('category_id')
+    return int(category_id) if category_id else None
+
+
+def _product_list_versions(request):
+    try:
+        category_id = _list_category_id(request)
+    except ValueError:
+        return None  # answered with 400
+    return ProductService().get_product_list_versions(category_id, with_coupons=bool(request.GET.get('coupon_code')))
+
+
+async def _aproduct_list_versions(request):
+    try:
+        category_id = _list_category_id(request)
+    except ValueError:
+        return None
+    return await ProductService().aget_product_list_versions(category_id, with_coupons=bool(request.GET.get('coupon_code')))
+
+
+def _product_versions(request, product_id):
+    return ProductService().get_product_versions(product_id, with_coupons=bool(request.GET.get('coupon_code')))
+
+
+async def _aproduct_versions(request, product_id):
+    return await ProductService().aget_product_versions(product_id, with_coupons=bool(request.GET.get('coupon_code')))
+
+
+def _product_coupons_versions(request, product_id):
+    return ProductService().get_product_versions(product_id, with_coupons=True)
+
+
+async def _aproduct_coupons_versions(request, product_id):
+    return await ProductService().aget_product_versions(product_id, with_coupons=True)
+
+
+@conditional(_product_list_versions)
 @api_view(['GET'])
 def get_products(request):
     '''
@@ -17,7 +62,11 @@ def get_products(request):
         page_size (optional): page size for pagination
         asc (optional): sort ascending (0 or 1)
         order_by (optional): sort field (default sorting is by 'created_at')
-    :return: JSON response with list of products
+        cursor (optional): switch to cursor(keyset) pagination, empty value for the first page
+        with_count (optional): include total_count in cursor pagination (0 or 1)
+        coupon_code (optional): coupon applied to final_price of the products it is mapped to
+        min_price, max_price (optional): filter by final_price (inclusive)
+    :return: JSON response with list of products (each with final_price)
     :example:
         GET /product/?category_id=2&page=1&page_size=5&asc=1&order_by=name
         Response: {
@@ -31,30 +80,139 @@ def get_products(request):
                     'name': 'Prod 1',
                     'description': 'Desc.....',
                     ...
+                    'final_price': 9000
                 }
             ]
         }
+        GET /product/?order_by=final_price&asc=1&coupon_code=c_1&max_price=10000
+        GET /product/?category_id=2&page_size=5&order_by=name&cursor=eyJvIjoi...
+        Response: {
+            'next_cursor': 'eyJvIjoi...',
+            'prev_cursor': 'eyJvIjoi...',
+            'page_size': 5,
+            'products': [...]
+        }
     '''
-    category_id = request.query_params.get('category_id', None)
     try:
-        asc = min(int(request.query_params.get('asc', 0)), 1)   # asc should be only 0 or 1
+        params = _parse_product_list_params(request.query_params)
+    except ValueError as e:
+        return Response({'error': str(e)}, status=status.HTTP_400_BAD_REQUEST)
+    cursor = params.pop('cursor')
+    with_count = params.pop('with_count')
+
+    try:
+        product_service = ProductService()
+        if cursor is not None:
+            params.pop('page')
+            result = product_service.get_products_by_cursor(cursor=cursor, with_count=with_count, **params)
+        else:
+            result = product_service.get_products(**params)
+        return Response(result)
+    except TypeError:
+        return Response({'error': 'category_id is not integer'}, status=status.HTTP_400_BAD_REQUEST)
+    except InvalidCursor:
+        return Response({'error': InvalidCursor.default_detail}, status=InvalidCursor.status_code)
+    except CouponDoesNotExist:
+        return Response({'error': CouponDoesNotExist.default_detail}, status=CouponDoesNotExist.status_code)
+
+
+def _parse_product_list_params(query_params):
+    # raises ValueError with the error message for the response
+    try:
+        asc = min(int(query_params.get('asc', 0)), 1)   # asc should be only 0 or 1
+        page = int(query_params.get('page', 1))
+        page_size = min(int(query_params.get('page_size', PAGE_SIZE)), PAGE_SIZE) # page_size cannot be larger than PAGE_SIZE
+        with_count = min(int(query_params.get('with_count', 0)), 1)   # with_count should be only 0 or 1
+        min_price = int(query_params['min_price']) if query_params.get('min_price') else None
+        max_price = int(query_params['max_price']) if query_params.get('max_price') else None
+    except ValueError:
+        raise ValueError('Invalid query param')
+    order_by = query_params.get('order_by', None)
+    if order_by is not None:
+        if order_by not in ORDER_FIELDS:
+            raise ValueError('Invalid order_by query')
+
+    return {
+        'category_id': query_params.get('category_id', None),
+        'page': page,
+        'page_size': page_size,
+        'order_by': order_by,
+        'asc': asc,
+        'cursor': query_params.get('cursor', None),
+        'with_count': with_count,
+        'coupon_code': query_params.get('coupon_code', None),
+        'min_price': min_price,
+        'max_price': max_price,
+    }
+
+
+@api_view(['GET'])
+def search_products(request):
+    '''
+    Full-text search of products by name and description, ranked by relevance
+    :param:
+        q : search words (every word must match, partial words and Korean are supported)
+        category_id (optional): category_id to filter products
+        page (optional): page number for pagination
+        page_size (optional): page size for pagination
+    :return: JSON response with list of products (same as get_products)
+    :example:
+        GET /product/search/?q=smart phone&category_id=2&page=1
+        Response: {
+            'total_count': 2,
+            'total_pages': 1,
+            'current_page': 1,
+            'page_size': 5,
+            'products': [...]
+        }
+    '''
+    query = request.query_params.get('q', '').strip()
+    if not query:
+        return Response({'error': 'q is required'}, status=status.HTTP_400_BAD_REQUEST)
+    try:
         page = int(request.query_params.get('page', 1))
         page_size = min(int(request.query_params.get('page_size', PAGE_SIZE)), PAGE_SIZE) # page_size cannot be larger than PAGE_SIZE
     except ValueError:
         return Response({'error': 'Invalid query param'}, status=status.HTTP_400_BAD_REQUEST)
-    order_by = request.query_params.get('order_by', None)
-    if order_by is not None:
-        if order_by not in ORDER_FIELDS:
-            return Response({'error': 'Invalid order_by query'}, status=status.HTTP_400_BAD_REQUEST)
+    category_id = request.query_params.get('category_id', None)
 
     try:
         product_service = ProductService()
-        result = product_service.get_products(category_id=category_id, page=page, page_size=page_size, order_by=order_by, asc=asc)
+        result = product_service.search_products(query, category_id=category_id, page=page, page_size=page_size)
         return Response(result)
     except TypeError:
         return Response({'error': 'category_id is not integer'}, status=status.HTTP_400_BAD_REQUEST)
 
 
+@api_view(['GET'])
+def autocomplete_products(request):
+    '''
+    Product names starting with a prefix, most viewed products first
+    :param:
+        prefix : beginning of the product name (case insensitive)
+        limit (optional): number of suggestions (default 10, at most AUTOCOMPLETE_MAX_LIMIT)
+    :return: JSON response with list of suggestions
+    :example:
+        GET /product/autocomplete/?prefix=sma&limit=2
+        Response: [
+            {'id': 3, 'name': 'Smart Phone'},
+            {'id': 7, 'name': 'Smart Watch'}
+        ]
+    '''
+    prefix = request.query_params.get('prefix', '').strip()
+    if not prefix:
+        return Response({'error': 'prefix is required'}, status=status.HTTP_400_BAD_REQUEST)
+    try:
+        limit = int(request.query_params.get('limit', 10))
+    except ValueError:
+        return Response({'error': 'Invalid query param'}, status=status.HTTP_400_BAD_REQUEST)
+    limit = max(1, min(limit, AUTOCOMPLETE_MAX_LIMIT))
+
+    product_service = ProductService()
+    return Response(product_service.autocomplete_products(prefix, limit))
+
+
+@conditional(_product_versions)
 @api_view(['GET'])
 def get_product_detail(request, product_id):
     """
@@ -85,6 +243,46 @@ def get_product_detail(request, product_id):
     except CouponDoesNotExist:
         return Response({'error': CouponDoesNotExist.default_detail}, status=CouponDoesNotExist.status_code)
 
+@api_view(['GET'])
+def get_product_details(request):
+    """
+    Retrieve detail info of several products at once (e.g. cart), in the requested order
+    :param:
+        ids : comma separated product_ids (up to BATCH_SIZE)
+        coupon_code (optional): coupon_code to apply
+    :return: JSON response with list of product data, or error per product
+    :example:
+        GET /product/batch/?ids=2,1,999&coupon_code=c_1
+        Response: [
+            {
+                'id': 2,
+                'name': 'Prod 2',
+                'final_price': 4500,
+                ...
+            },
+            {
+                'id': 1,
+                ...
+            },
+            {
+                'id': 999,
+                'error': 'product not found'
+            }
+        ]
+    """
+    try:
+        product_ids = [int(product_id) for product_id in request.query_params.get('ids', '').split(',')]
+    except ValueError:
+        return Response({'error': 'Invalid query param'}, status=status.HTTP_400_BAD_REQUEST)
+    if len(product_ids) > BATCH_SIZE:
+        return Response({'error': f'ids cannot be more than {BATCH_SIZE}'}, status=status.HTTP_400_BAD_REQUEST)
+    coupon_code = request.query_params.get('coupon_code', None)
+
+    product_service = ProductService()
+    result = product_service.get_product_details(product_ids=product_ids, coupon_code=coupon_code)
+    return Response(result)
+
+@conditional(_product_coupons_versions)
 @api_view(['GET'])
 def get_available_coupons(request, product_id):
     """
@@ -107,4 +305,98 @@ def get_available_coupons(request, product_id):
         result = product_service.get_available_coupons(product_id=product_id)
         return Response(result)
     except ProductDoesNotExist:
-        return Response({'error': ProductDoesNotExist.default_detail}, status=ProductDoesNotExist.status_code)
\ No newline at end of file
+        return Response({'error': ProductDoesNotExist.default_detail}, status=ProductDoesNotExist.status_code)
+
+
+@require_GET
+def export_products(request):
+    '''
+    Stream the whole catalog (or one category) in one response instead of walking the list pages,
+    in constant memory (EXPORT_CHUNK_SIZE rows at a time), gzip compressed when the client accepts it
+    :param:
+        format (optional): ndjson (default) or csv
+        category_id (optional): category_id to filter products
+    :return: products in the list item format (with final_price), in id order, as a file download
+    :example:
+        GET /product/export/?format=ndjson&category_id=2
+        Response:
+            {"id":3,"category":{"id":2,"name":"Book"},"name":"Bible",...,"final_price":4900}
+            {"id":8,...}
+        GET /product/export/?format=csv
+        Response:
+            id,category_id,category_name,name,price,description,discount_rate,coupon_applicable,created_at,final_price
+            1,1,Electronics,Smartphone,"500,000원",...
+    '''
+    export_format = request.GET.get('format', 'ndjson')
+    if export_format not in EXPORT_FORMATS:
+        return json_response({'error': 'Invalid format query'}, status=status.HTTP_400_BAD_REQUEST)
+    content_type, extension, encode = EXPORT_FORMATS[export_format]
+
+    try:
+        chunks = ProductService().export_products(category_id=request.GET.get('category_id', None))
+    except TypeError:
+        return json_response({'error': 'category_id is not integer'}, status=status.HTTP_400_BAD_REQUEST)
+    return download_response(request, encode(chunks), content_type, f'products.{extension}')
+
+
+# async versions of the views above (routed instead of them when ASYNC_VIEWS is on, e.g. under ASGI)
+
+@conditional(_aproduct_list_versions)
+@require_GET
+async def aget_products(request):
+    '''
+    Async version of get_products (same params and response)
+    '''
+    try:
+        params = _parse_product_list_params(request.GET)
+    except ValueError as e:
+        return json_response({'error': str(e)}, status=status.HTTP_400_BAD_REQUEST)
+    cursor = params.pop('cursor')
+    with_count = params.pop('with_count')
+
+    try:
+        product_service = ProductService()
+        if cursor is not None:
+            params.pop('page')
+            result = await sync_to_async(product_service.get_products_by_cursor)(cursor=cursor, with_count=with_count, **params)
+        else:
+            result = await product_service.aget_products(**params)
+        return json_response(result)
+    except TypeError:
+        return json_response({'error': 'category_id is not integer'}, status=status.HTTP_400_BAD_REQUEST)
+    except InvalidCursor:
+        return json_response({'error': InvalidCursor.default_detail}, status=InvalidCursor.status_code)
+    except CouponDoesNotExist:
+        return json_response({'error': CouponDoesNotExist.default_detail}, status=CouponDoesNotExist.status_code)
+
+
+@conditional(_aproduct_versions)
+@require_GET
+async def aget_product_detail(request, product_id):
+    """
+    Async version of get_product_detail (same params and response)
+    """
+    coupon_code = request.GET.get('coupon_code', None)
+
+    product_service = ProductService()
+    try:
+        result = await product_service.aget_product_detail(product_id=product_id, coupon_code=coupon_code)
+        return json_response(result)
+    except ProductDoesNotExist:
+        return json_response({'error': ProductDoesNotExist.default_detail}, status=ProductDoesNotExist.status_code)
+    except CouponDoesNotExist:
+        return json_response({'error': CouponDoesNotExist.default_detail}, status=CouponDoesNotExist.status_code)
+
+
+@conditional(_aproduct_coupons_versions)
+@require_GET
+async def aget_available_coupons(request, product_id):
+    """
+    Async version of get_available_coupons (same params and response)
+    """
+    product_service = ProductService()
+    try:
+        result = await product_service.aget_available_coupons(product_id=product_id)
+        return json_response(result)
+    except ProductDoesNotExist:
+        return json_response({'error': ProductDoesNotExist.default_detail}, status=ProductDoesNotExist.status_code)
@@ -0,0 +1,101 @@
+import threading
+import time
+from django.db import DatabaseError, connections
+from .access_counts import product_access_counter
+from .coupon_index import coupon_index
+from .models import Category
+from .service import ProductService
+from ..hot_keys import hot_key_tracker
+from ..settings import WARMUP_CHUNK_SIZE, WARMUP_LIST_PAGES, WARMUP_ON_STARTUP, WARMUP_TIME_BUDGET, WARMUP_TOP_PRODUCTS
+import logging
+
+logger = logging.getLogger(__name__)
+
+DETAIL_KEY_PREFIX = 'product_detail_'
+
+
+class CacheWarmer(object):
+    '''
+    Preloads what the first requests would otherwise miss: the coupon index (active coupons),
+    category names, details of the hot and most viewed products (WARMUP_CHUNK_SIZE per query) and the first
+    list pages of the unfiltered listing and of every category. Stops between steps once the time budget is spent.
+    Warmed reads are not tracked as hot keys (they would keep the warmed keys hot)
+    '''
+    def __init__(self, budget=WARMUP_TIME_BUDGET, top_products=WARMUP_TOP_PRODUCTS, list_pages=WARMUP_LIST_PAGES,
+                 chunk_size=WARMUP_CHUNK_SIZE):
+        self.budget = budget
+        self.top_products = top_products
+        self.list_pages = list_pages
+        self.chunk_size = chunk_size
+        self.product_service = ProductService()
+
+    def warm(self):
+        # returns what was loaded; complete is False when the budget ran out first
+        start = time.monotonic()
+        deadline = start + self.budget
+        stats = {'coupon_index': False, 'products': 0, 'list_pages': 0, 'complete': False}
+        for step in (self._warm_lookups, self._warm_products, self._warm_list_pages):
+            if not step(deadline, stats):
+                break
+        else:
+            stats['complete'] = True
+        stats['seconds'] = round(time.monotonic() - start, 3)
+        return stats
+
+    def _warm_lookups(self, deadline, stats):
+        if time.monotonic() >= deadline:
+            return False
+        coupon_index.ensure_loaded()
+        self.product_service._get_category_names()
+        stats['coupon_index'] = True
+        return True
+
+    def _warm_products(self, deadline, stats):
+        product_ids = self._hot_product_ids() if self.top_products > 0 else []
+        for start in range(0, len(product_ids), self.chunk_size):
+            if time.monotonic() >= deadline:
+                return False
+            chunk = product_ids[start:start + self.chunk_size]
+            self.product_service.get_product_details(chunk, track=False)
+            stats['products'] += len(chunk)
+        return True
+
+    def _hot_product_ids(self):
+        # recently hot (shared hot-key top-K) first, then the most viewed overall
+        product_ids = [int(key[len(DETAIL_KEY_PREFIX):]) for key, _ in hot_key_tracker.top() if key.startswith(DETAIL_KEY_PREFIX)]
+        product_ids += product_access_counter.top_product_ids(self.top_products)
+        return list(dict.fromkeys(product_ids))[:self.top_products]
+
+    def _warm_list_pages(self, deadline, stats):
+        category_ids = [None] + list(Category.objects.order_by('id').values_list('id', flat=True))
+        for category_id in category_ids:
+            for page in range(1, self.list_pages + 1):
+                if time.monotonic() >= deadline:
+                    return False
+                products_data = self.product_service.get_products(category_id=category_id, page=page, track=False)
+                stats['list_pages'] += 1
+                if page >= products_data['total_pages']:
+                    break
+        return True
+
+
+def start_background_warmup(**kwargs):
+    # warms this worker in a daemon thread, so startup is not blocked (and a failure only means a cold cache)
+    def run():
+        try:
+            stats = CacheWarmer(**kwargs).warm()
+            logger.info(f'Cache warm-up finished: {stats}')
+        except DatabaseError as e:
+            logger.warning(f'Cache warm-up failed, starting with a cold cache: {e}')
+        finally:
+            connections.close_all()
+
+    thread = threading.Thread(target=run, name='cache-warmup', daemon=True)
+    thread.start()
+    return thread
+
+
+def warm_on_startup():
+    # called by wsgi.py/asgi.py, so only server processes warm up (not migrate, test or the autoreloader parent)
+    if WARMUP_ON_STARTUP:
+        return start_background_warmup()
@@ -10,7 +10,9 @@ For the full list of settings and their values, see
 https://docs.djangoproject.com/en/5.1/ref/settings/
 """
 
+import os
 from pathlib import Path
+from django.core.exceptions import ImproperlyConfigured
 
 # Build paths inside the project like this: BASE_DIR / 'subdir'.
 BASE_DIR = Path(__file__).resolve().parent.parent
@@ -41,6 +43,8 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    'millie.metrics.MetricsMiddleware',
+    'millie.db_router.ReplicaPinningMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
@@ -71,16 +75,79 @@ TEMPLATES = [
 
 WSGI_APPLICATION = 'millie.wsgi.application'
 
+# route product/coupon read endpoints to their async views (for ASGI deployments)
+ASYNC_VIEWS = False
+
 
 # Database
 # https://docs.djangoproject.com/en/5.1/ref/settings/#databases
 
-DATABASES = {
-    'default': {
-        'ENGINE': 'django.db.backends.sqlite3',
-        'NAME': BASE_DIR / 'db.sqlite3',
+# profile chosen by MILLIE_DB: 'sqlite' (default, tuned for concurrent workers) or 'postgres' (production)
+DB_PROFILE = os.environ.get('MILLIE_DB', 'sqlite')
+# keep a worker's connection open between requests for this many seconds (0: reconnect on every request)
+DB_CONN_MAX_AGE = int(os.environ.get('MILLIE_DB_CONN_MAX_AGE', 60))
+# PostgreSQL connection pool per worker process (psycopg[pool]), DB_POOL_MAX_SIZE = 0 uses persistent connections instead
+DB_POOL_MIN_SIZE = int(os.environ.get('MILLIE_DB_POOL_MIN_SIZE', 2))
+DB_POOL_MAX_SIZE = int(os.environ.get('MILLIE_DB_POOL_MAX_SIZE', 10))
+DB_POOL_TIMEOUT = 10
+# SQLite: wait this long for the write lock instead of failing with 'database is locked', memory-map this much of the file
+SQLITE_BUSY_TIMEOUT_MS = 5000
+SQLITE_MMAP_SIZE = 256 * 1024 * 1024
+
+if DB_PROFILE == 'postgres':
+    DATABASES = {
+        'default': {
+            'ENGINE': 'django.db.backends.postgresql',
+            'NAME': os.environ.get('POSTGRES_DB', 'millie'),
+            'USER': os.environ.get('POSTGRES_USER', 'millie'),
+            'PASSWORD': os.environ.get('POSTGRES_PASSWORD', ''),
+            'HOST': os.environ.get('POSTGRES_HOST', 'localhost'),
+            'PORT': os.environ.get('POSTGRES_PORT', '5432'),
+            # pooled connections are returned to the pool after each request, so they cannot also be persistent
+            'CONN_MAX_AGE': 0 if DB_POOL_MAX_SIZE else DB_CONN_MAX_AGE,
+            'CONN_HEALTH_CHECKS': True,
+            'OPTIONS': {
+                'pool': {'min_size': DB_POOL_MIN_SIZE, 'max_size': DB_POOL_MAX_SIZE, 'timeout': DB_POOL_TIMEOUT},
+            } if DB_POOL_MAX_SIZE else {},
+        }
+    }
+elif DB_PROFILE == 'sqlite':
+    DATABASES = {
+        'default': {
+            'ENGINE': 'django.db.backends.sqlite3',
+            'NAME': os.environ.get('MILLIE_SQLITE_PATH', BASE_DIR / 'db.sqlite3'),
+            'CONN_MAX_AGE': DB_CONN_MAX_AGE,
+            'OPTIONS': {
+                # run on every new connection: WAL lets readers go on while one writer commits,
+                # synchronous=NORMAL syncs only at checkpoints (durable enough with WAL)
+                'init_command': (f'PRAGMA journal_mode=WAL; PRAGMA synchronous=NORMAL; '
+                                 f'PRAGMA mmap_size={SQLITE_MMAP_SIZE}; PRAGMA busy_timeout={SQLITE_BUSY_TIMEOUT_MS}'),
+                # take the write lock at BEGIN, so a transaction that reads then writes waits (busy_timeout) instead of failing
+                'transaction_mode': 'IMMEDIATE',
+            },
+        }
+    }
+else:
+    raise ImproperlyConfigured(f"MILLIE_DB must be 'sqlite' or 'postgres', not {DB_PROFILE!r}")
+
+# read replicas (millie/db_router.py): MILLIE_DB_REPLICAS = comma separated hosts (postgres) or database files (sqlite);
+# only the read-only product/coupon service methods read from them (test databases mirror the primary)
+DATABASE_REPLICAS = []
+for number, replica in enumerate(filter(None, os.environ.get('MILLIE_DB_REPLICAS', '').split(',')), 1):
+    DATABASE_REPLICAS.append(f'replica_{number}')
+    DATABASES[f'replica_{number}'] = {
+        **DATABASES['default'],
+        'HOST' if DB_PROFILE == 'postgres' else 'NAME': replica.strip(),
+        'TEST': {'MIRROR': 'default'},
     }
-}
+DATABASE_ROUTERS = ['millie.db_router.ReplicaRouter']
+# 'round_robin' or 'least_latency'
+REPLICA_SELECTION = os.environ.get('MILLIE_DB_REPLICA_SELECTION', 'round_robin')
+# replicas further behind the primary (seconds) are skipped, replication lag and health are checked this often
+REPLICA_MAX_LAG = 1.0
+REPLICA_CHECK_INTERVAL = 5
+# after a write the same request, and the client's requests for this long (cookie), read from the primary
+REPLICA_PIN_SECONDS = 5
 
 
 # Password validation
@@ -124,6 +191,65 @@ STATIC_URL = 'static/'
 
 DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
 
+# cached entries are fresh for CACHE_MIN_TIMEOUT, then expire early with growing probability until CACHE_MAX_TIMEOUT
 CACHE_MAX_TIMEOUT = 300
-CACHE_MIN_TIMEOUT = 300
-PAGE_SIZE = 5
\ No newline at end of file
+CACHE_MIN_TIMEOUT = 240
+# expired entries are kept this long to be served while a single worker rebuilds them
+CACHE_STALE_TIMEOUT = 60
+CACHE_REBUILD_LOCK_TIMEOUT = 10
+CACHE_REBUILD_WAIT = 1
+# serve the previous product detail after a save until it is rebuilt (instead of deleting it)
+CACHE_STALE_WHILE_REVALIDATE = False
+PAGE_SIZE = 5
+BATCH_SIZE = 50
+
+# per-worker L1 cache in front of the shared cache (millie/cache.py)
+L1_CACHE_MAX_SIZE = 1000
+L1_CACHE_TIMEOUT = 5
+L1_CACHE_SYNC_INTERVAL = 1
+
+# product name autocomplete is kept in memory per worker, changes of other workers are applied this often (seconds)
+AUTOCOMPLETE_SYNC_INTERVAL = 1
+AUTOCOMPLETE_MAX_LIMIT = 20
+# ranking: detail views of the most viewed products, shared between workers through the cache this often (seconds)
+AUTOCOMPLETE_POPULARITY_INTERVAL = 10
+AUTOCOMPLETE_POPULAR_SIZE = 1000
+
+# bulk product operations (millie/product/bulk.py): rows per INSERT/UPDATE
+BULK_CHUNK_SIZE = 1000
+
+# in-memory coupon index per worker (millie/product/coupon_index.py), changes of other workers are seen this often (seconds)
+COUPON_INDEX_SYNC_INTERVAL = 1
+
+# request metrics (millie/metrics.py): quantiles over the last METRICS_WINDOW requests per view, /metrics only for these clients
+METRICS_WINDOW = 1024
+METRICS_ALLOWED_IPS = ['127.0.0.1', '::1']
+# behind a reverse proxy every client comes from the proxy's address: set MILLIE_METRICS_TOKEN and scrape with
+# "Authorization: Bearer <token>" instead (proxied requests are refused without it)
+METRICS_TOKEN = os.environ.get('MILLIE_METRICS_TOKEN', '')
+
+# detail views are counted per worker and added to ProductAccessCount this often (seconds), to rank hot products
+ACCESS_COUNT_FLUSH_INTERVAL = 60
+
+# cache warm-up (millie/product/warmup.py): MILLIE_WARMUP=1 warms every server worker in the background at startup (wsgi.py/asgi.py)
+WARMUP_ON_STARTUP = os.environ.get('MILLIE_WARMUP', '0') == '1'
+WARMUP_TIME_BUDGET = 10  # seconds, the remaining steps are skipped after it
+WARMUP_TOP_PRODUCTS = 1000
+WARMUP_LIST_PAGES = 2  # first pages of the unfiltered listing and of every category
+WARMUP_CHUNK_SIZE = 200  # product details per query
+
+# hot-key tracking (millie/hot_keys.py): space-saving top-K of ProductService cache reads per worker,
+# merged into a shared top-K every HOT_KEYS_FLUSH_INTERVAL seconds (counts halve every HOT_KEYS_HALF_LIFE seconds)
+HOT_KEYS_CAPACITY = 256
+HOT_KEYS_FLUSH_INTERVAL = 10
+HOT_KEYS_HALF_LIFE = 600
+# the HOT_KEYS_HOT_SIZE most read keys are cached HOT_KEYS_TTL_FACTOR times longer
+HOT_KEYS_HOT_SIZE = 50
+HOT_KEYS_TTL_FACTOR = 4
+
+# version and generation keys (millie/cache.py) outlive every entry cached under them, hot ones included;
+# finite so keys of products that are never changed (or do not exist) do not pile up in the cache
+CACHE_VERSION_TIMEOUT = 2 * (CACHE_MAX_TIMEOUT * HOT_KEYS_TTL_FACTOR + CACHE_STALE_TIMEOUT)
+
+# catalog export (GET /product/export/): rows per DB fetch and per streamed chunk
+EXPORT_CHUNK_SIZE = 2000
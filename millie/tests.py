@@ -1,16 +1,102 @@
+import csv
+import gzip
+import io
+import json
+import os
+import shutil
+import tempfile
 import time
+from unittest import mock
 
-from django.db import IntegrityError
-from django.test import TestCase
+from django.core.management import CommandError, call_command
+from django.core.exceptions import ImproperlyConfigured
+from django.db import DatabaseError, IntegrityError, connection, connections, transaction
+from django.db.models.signals import post_save
+from django.http import JsonResponse
+from django.test.utils import CaptureQueriesContext
+from django.utils.http import parse_http_date
+from asgiref.sync import sync_to_async
+from django.test import AsyncRequestFactory, RequestFactory, TestCase
 from django.core.cache import cache
+from rest_framework.renderers import JSONRenderer
 from rest_framework.test import APIClient
 from rest_framework import status
+from .cache import L1Cache, bump_versions, get_or_rebuild, get_versions, l1_cache
+from .coupon import views as coupon_views
 from .coupon.models import Coupon
-from .product.models import Product, Category, ProductCoupon
+from .coupon.serializers import CouponSerializer, COUPON_VALUES, compact_coupons
+from . import db_router
+from .db_router import PIN_COOKIE, ReplicaPinningMiddleware, ReplicaPool
+from .product import views as product_views
+from .errors import CouponDoesNotExist, InvalidDiscountRate, ProductDoesNotExist
+from .explain import explain_query_plan, plan_problems
+from .formats import format_kst
+from .http import aiter_in_thread
+from .hot_keys import HotKeyTracker, SpaceSaving, hot_key_tracker
+from .metrics import MetricsMiddleware, metrics_registry
+from .product.access_counts import product_access_counter
+from .product.autocomplete import ProductAutocomplete, product_autocomplete
+from .product.bulk import ProductBulkService
+from .product.coupon_index import CouponIndex, coupon_index
+from .product.models import Product, Category, ProductAccessCount, ProductCoupon, ProductCount
+from .product.serializers import ProductSerializer, PRODUCT_VALUES, compact_products
+from .product.service import ProductService
+from .product.warmup import CacheWarmer, warm_on_startup
+from .settings import CACHE_MAX_TIMEOUT, SQLITE_BUSY_TIMEOUT_MS
 
+SCAN_PRODUCT = 'SCAN product_product'
+SCAN_CATEGORY = 'SCAN product_category'    # category names are loaded whole (few rows, cached)
+SORT = 'USE TEMP B-TREE FOR ORDER BY'
+COUPON_INDEX = {'SCAN product_productcoupon'}    # loading the in-memory coupon index reads every mapping
+
+# (name, url, queries on a cold cache, queries on a warm cache, full scans/sorts allowed in the plans)
+QUERY_COUNT_CASES = [
+    ('list', '/product/', 3, 0, {SCAN_CATEGORY}),
+    ('list page 2', '/product/?page=2', 3, 0, {SCAN_CATEGORY}),
+    ('list category', '/product/?category_id={category.id}', 3, 0, {SCAN_CATEGORY}),
+    ('list order name', '/product/?order_by=name', 3, 0, {SCAN_CATEGORY}),
+    ('list order name asc', '/product/?order_by=name&asc=1', 3, 0, {SCAN_CATEGORY}),
+    ('list order category_id', '/product/?order_by=category_id', 3, 0, {SCAN_CATEGORY}),
+    ('list order coupon_applicable', '/product/?order_by=coupon_applicable', 3, 0, {SCAN_CATEGORY}),
+    ('list order created_at asc', '/product/?order_by=created_at&asc=1', 3, 0, {SCAN_CATEGORY}),
+    ('list order final_price', '/product/?order_by=final_price', 3, 0, {SCAN_CATEGORY}),
+    ('list category order name', '/product/?category_id={category.id}&order_by=name&asc=1', 3, 0, {SCAN_CATEGORY}),
+    # seeks the price range, then sorts only the matching rows
+    ('list price range', '/product/?min_price=1000&max_price=500000', 3, 0, {SCAN_CATEGORY, SORT}),
+    # coupon prices are computed per row and not cached
+    ('list coupon price', '/product/?coupon_code={coupon.code}&order_by=final_price&asc=1', 4, 3, {SCAN_PRODUCT, SCAN_CATEGORY, SORT}),
+    ('list cursor', '/product/?cursor=', 2, 1, {SCAN_CATEGORY}),
+    ('list cursor category count', '/product/?cursor=&category_id={category.id}&with_count=1', 3, 2, {SCAN_CATEGORY}),
+    ('batch', '/product/batch/?ids={product.id},{other.id}', 1, 0, set()),
+    ('batch coupon', '/product/batch/?ids={product.id},{other.id}&coupon_code={coupon.code}', 3, 0, COUPON_INDEX),
+    # matches are grouped and ranked by score
+    ('search', '/product/search/?q=smart', 4, 3,
+     {'SCAN subquery', SCAN_CATEGORY, SORT, 'USE TEMP B-TREE FOR GROUP BY'}),
+    ('search category', '/product/search/?q=coin&category_id={other_category.id}', 4, 3,
+     {'SCAN subquery', SCAN_CATEGORY, SORT, 'USE TEMP B-TREE FOR GROUP BY'}),
+    ('autocomplete', '/product/autocomplete/?prefix=sm', 1, 0, set()),
+    ('detail', '/product/{product.id}/', 1, 0, set()),
+    ('detail coupon', '/product/{product.id}/?coupon_code={coupon.code}', 3, 0, COUPON_INDEX),
+    ('coupons', '/product/{product.id}/coupons/', 3, 0, COUPON_INDEX),
+    # coupon lists are not cached
+    ('coupon list', '/coupon/all/', 2, 2, set()),
+    ('coupon list inactive', '/coupon/all/?include_inactive=1', 2, 2, set()),
+    ('coupon list order code', '/coupon/all/?order_by=code', 2, 2, set()),
+    ('coupon list order active', '/coupon/all/?order_by=active&asc=1', 2, 2, set()),
+    ('coupon list cursor', '/coupon/all/?cursor=', 1, 1, set()),
+]
 
 class ShoppingAPITestCase(TestCase):
     def setUp(self):
+        l1_cache.clear()
+        product_autocomplete.clear()
+        coupon_index.clear()
+        product_access_counter.clear()
+        hot_key_tracker.clear()
+        # read from the primary even if replicas are configured (replica tests set up their own)
+        replica_pool = mock.patch.object(db_router, 'replica_pool', ReplicaPool([]))
+        replica_pool.start()
+        self.addCleanup(replica_pool.stop)
         # Set 3 categories
         self.category_1 = Category.objects.create(name='Electronics')
         self.category_2 = Category.objects.create(name='Book')
@@ -113,7 +199,7 @@ class ShoppingAPITestCase(TestCase):
         self.assertIn('total_pages', return_data)
         self.assertIn('current_page', return_data)
 
-        fields_2_return = {'id', 'name', 'description', 'price', 'category', 'discount_rate', 'coupon_applicable', 'created_at'}
+        fields_2_return = {'id', 'name', 'description', 'price', 'category', 'discount_rate', 'coupon_applicable', 'created_at', 'final_price'}
         self.assertEqual(set(return_data['products'][0].keys()), fields_2_return)
         # 'category' field returns {'id': ..., 'name': ...}
         self.assertIn('id', return_data['products'][0]['category'])
@@ -159,6 +245,341 @@ class ShoppingAPITestCase(TestCase):
         # all products filtered by category_1 are 2
         self.assertEqual(len(return_data['products']), 2)
 
+    def test_get_products_cursor_pagination(self):
+        # Test keyset pagination walks every product exactly once
+        response = self.client.get('/product/?cursor=&page_size=4')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        return_data = response.json()
+        self.assertNotIn('total_count', return_data)
+        self.assertIsNone(return_data['prev_cursor'])
+        self.assertEqual(len(return_data['products']), 4)
+        self.assertEqual(return_data['products'][0]['id'], self.product_6.id)
+
+        # next page holds the remaining 2 products
+        response = self.client.get(f'/product/?cursor={return_data["next_cursor"]}&page_size=4&with_count=1')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        return_data = response.json()
+        self.assertEqual(return_data['total_count'], 6)
+        self.assertIsNone(return_data['next_cursor'])
+        self.assertEqual([p['id'] for p in return_data['products']], [self.product_2.id, self.product_1.id])
+
+        # going back returns the first page again
+        response = self.client.get(f'/product/?cursor={return_data["prev_cursor"]}&page_size=4')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        return_data = response.json()
+        self.assertEqual([p['id'] for p in return_data['products']],
+                         [self.product_6.id, self.product_5.id, self.product_4.id, self.product_3.id])
+        self.assertIsNone(return_data['prev_cursor'])
+
+    def test_get_products_cursor_pagination_by_name(self):
+        # Test keyset pagination sorted by name with category filter
+        url = f'/product/?category_id={self.category_3.id}&order_by=name&asc=1&page_size=2'
+        response = self.client.get(url + '&cursor=')
+        return_data = response.json()
+        self.assertEqual([p['id'] for p in return_data['products']], [self.product_4.id, self.product_6.id])
+
+        response = self.client.get(url + f'&cursor={return_data["next_cursor"]}')
+        return_data = response.json()
+        self.assertEqual([p['id'] for p in return_data['products']], [self.product_5.id])
+        self.assertIsNone(return_data['next_cursor'])
+
+        # cursor issued for another ordering is rejected
+        response = self.client.get(f'/product/?order_by=created_at&cursor={return_data["prev_cursor"]}')
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        response = self.client.get('/product/?cursor=not-a-cursor')
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_product_count_store(self):
+        # Test product counts are maintained by signals instead of counting per request
+        self.assertEqual(ProductCount.objects.get(category=None).count, 6)
+        self.assertEqual(ProductCount.objects.get(category=self.category_3).count, 3)
+
+        # move a product to another category
+        self.product_6.category = self.category_2
+        self.product_6.save()
+        self.assertEqual(ProductCount.objects.get(category=self.category_3).count, 2)
+        self.assertEqual(ProductCount.objects.get(category=self.category_2).count, 2)
+        self.assertEqual(ProductCount.objects.get(category=None).count, 6)
+
+        # delete a product
+        self.product_5.delete()
+        self.assertEqual(ProductCount.objects.get(category=self.category_3).count, 1)
+        response = self.client.get('/product/')
+        self.assertEqual(response.json()['total_count'], 5)
+
+    def test_rebuild_product_counts(self):
+        # Test rebuild command fixes drift from writes that skip signals
+        Product.objects.bulk_create([
+            Product(name=f'Bulk {i}', description='bulk', price=100, category=self.category_2, discount_rate=0.0)
+            for i in range(3)
+        ])
+        self.assertEqual(ProductCount.objects.get(category=self.category_2).count, 1)
+
+        call_command('rebuild_product_counts', stdout=open(os.devnull, 'w'))
+        self.assertEqual(ProductCount.objects.get(category=self.category_2).count, 4)
+        self.assertEqual(ProductCount.objects.get(category=None).count, 9)
+        response = self.client.get(f'/product/?category_id={self.category_2.id}')
+        self.assertEqual(response.json()['total_count'], 4)
+
+        # a single count of all products, even when two workers seed it at once
+        with self.assertRaises(IntegrityError), transaction.atomic():
+            ProductCount.objects.create(category=None, count=9)
+
+    def test_product_list_category_zero(self):
+        # Test category_id=0 is cached apart from the unfiltered listing (both ways round)
+        response = self.client.get('/product/?category_id=0')
+        self.assertEqual(response.json()['total_count'], 0)
+        response = self.client.get('/product/')
+        self.assertEqual(response.json()['total_count'], 6)
+        self.assertEqual(len(response.json()['products']), 5)
+        response = self.client.get('/product/?category_id=0')
+        self.assertEqual((response.json()['total_count'], response.json()['products']), (0, []))
+        self.assertNotEqual(self.client.get('/product/?category_id=0')['ETag'], self.client.get('/product/')['ETag'])
+
+    def test_product_list_cache(self):
+        # Test list pages are cached and only invalidated for the changed category
+        self.client.get(f'/product/?category_id={self.category_3.id}')
+        self.client.get(f'/product/?category_id={self.category_1.id}')
+        self.client.get('/product/')
+        with self.assertNumQueries(0):
+            response = self.client.get(f'/product/?category_id={self.category_3.id}')
+        self.assertEqual(len(response.json()['products']), 3)
+
+        Product.objects.create(
+            name='Tablet',
+            description='New tablet',
+            price=300000,
+            category=self.category_1,
+            discount_rate=0.0
+        )
+        # other category pages are still cached
+        with self.assertNumQueries(0):
+            self.client.get(f'/product/?category_id={self.category_3.id}')
+        response = self.client.get(f'/product/?category_id={self.category_1.id}')
+        self.assertEqual(response.json()['total_count'], 3)
+        response = self.client.get('/product/')
+        self.assertEqual(response.json()['total_count'], 7)
+        self.assertEqual(response.json()['products'][0]['name'], 'Tablet')
+
+        # renaming a category invalidates its pages
+        self.category_3.name = 'Etc'
+        self.category_3.save()
+        response = self.client.get(f'/product/?category_id={self.category_3.id}')
+        self.assertEqual(response.json()['products'][0]['category']['name'], 'Etc')
+
+    def test_compact_serializers(self):
+        # Test compact list serialization renders byte-identical JSON to the serializers
+        renderer = JSONRenderer()
+        products = Product.objects.select_related('category')
+        category_names = dict(Category.objects.values_list('id', 'name'))
+        self.assertEqual(renderer.render(compact_products(products.values(*PRODUCT_VALUES), category_names)),
+                         renderer.render(ProductSerializer(products, many=True).data))
+
+        coupons = Coupon.objects.all()
+        self.assertEqual(renderer.render(compact_coupons(coupons.values(*COUPON_VALUES))),
+                         renderer.render(CouponSerializer(coupons, many=True).data))
+
+    def test_product_display_fields(self):
+        # Test display fields are computed when the row is written
+        product = Product.objects.get(id=self.product_1.id)
+        self.assertEqual(product.price_display, '500,000원')
+        self.assertEqual(product.discount_rate_display, '10.0%')
+        self.assertEqual(product.created_at_display, ProductSerializer(product).data['created_at'])
+        self.assertEqual(product.base_final_price, 450000)
+
+        product.price = 600000
+        product.save(update_fields=['price'])
+        product.refresh_from_db()
+        self.assertEqual(product.price_display, '600,000원')
+
+        # an insert is one statement, receivers see the display values
+        seen = []
+        def receiver(instance, **kwargs):
+            seen.append(instance.created_at_display)
+        post_save.connect(receiver, sender=Product)
+        self.addCleanup(post_save.disconnect, receiver, sender=Product)
+        with CaptureQueriesContext(connection) as queries:
+            new_product = Product.objects.create(name='New', description='new', price=100, category=self.category_3,
+                                                 discount_rate=0.0)
+        self.assertEqual(seen, [format_kst(new_product.created_at)])
+        product_writes = [query['sql'] for query in queries
+                          if query['sql'].startswith(('INSERT INTO "product_product"', 'UPDATE "product_product"'))]
+        self.assertEqual(len(product_writes), 1)
+        self.assertEqual(product.base_final_price, 540000)
+
+        # rows written without save() are fixed by the rebuild command
+        Product.objects.filter(id=product.id).update(discount_rate=0.2)
+        call_command('rebuild_product_display_fields', stdout=open(os.devnull, 'w'))
+        response = self.client.get(f'/product/{product.id}/')
+        self.assertEqual(response.json()['discount_rate'], '20.0%')
+        self.assertEqual(response.json()['final_price'], 480000)
+
+    def test_search_products(self):
+        # Test full-text search ranks name matches above description matches
+        Product.objects.create(
+            name='맛있는 사과',
+            description='Fresh apple from the smartphone farm',
+            price=3000,
+            category=self.category_3,
+            discount_rate=0.0
+        )
+        response = self.client.get('/product/search/?q=smart')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        return_data = response.json()
+        self.assertEqual(return_data['total_count'], 2)
+        self.assertEqual(return_data['products'][0]['id'], self.product_1.id)
+
+        # Korean words match by n-grams, every word must match
+        response = self.client.get('/product/search/?q=사과')
+        self.assertEqual([p['name'] for p in response.json()['products']], ['맛있는 사과'])
+        response = self.client.get('/product/search/?q=사과 bible')
+        self.assertEqual(response.json()['total_count'], 0)
+
+        # category filter and pagination
+        response = self.client.get(f'/product/search/?q=coin&category_id={self.category_3.id}&page_size=1&page=2')
+        return_data = response.json()
+        self.assertEqual(return_data['total_count'], 2)
+        self.assertEqual(return_data['total_pages'], 2)
+        self.assertEqual(len(return_data['products']), 1)
+
+        # index follows product updates
+        self.product_3.name = 'Holy book'
+        self.product_3.save()
+        self.assertEqual(self.client.get('/product/search/?q=bible').json()['total_count'], 0)
+        self.assertEqual(self.client.get('/product/search/?q=holy').json()['total_count'], 1)
+
+        self.assertEqual(self.client.get('/product/search/').status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_autocomplete_products(self):
+        # Test prefix match is case insensitive and ranked by detail views
+        smartwatch = Product.objects.create(name='Smartwatch', description='watch', price=300000,
+                                            category=self.category_1, discount_rate=0.0)
+        response = self.client.get('/product/autocomplete/?prefix=SMART')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.json(), [{'id': self.product_1.id, 'name': 'Smartphone'},
+                                           {'id': smartwatch.id, 'name': 'Smartwatch'}])
+        self.client.get(f'/product/{smartwatch.id}/')
+        response = self.client.get('/product/autocomplete/?prefix=smart&limit=1')
+        self.assertEqual(response.json(), [{'id': smartwatch.id, 'name': 'Smartwatch'}])
+
+        # index is updated in place on save and delete
+        self.product_3.name = 'Smart bible'
+        self.product_3.save()
+        smartwatch.delete()
+        response = self.client.get('/product/autocomplete/?prefix=smart')
+        self.assertEqual([p['name'] for p in response.json()], ['Smart bible', 'Smartphone'])
+        self.assertEqual(self.client.get('/product/autocomplete/?prefix=bible').json(), [])
+
+        self.assertEqual(self.client.get('/product/autocomplete/').status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(self.client.get('/product/autocomplete/?prefix=s&limit=x').status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_autocomplete_sync_between_workers(self):
+        # Test another worker applies only the journaled changes
+        other_worker = ProductAutocomplete(sync_interval=0)
+        self.assertEqual(other_worker.search('zeb'), [{'id': self.product_5.id, 'name': 'Zebra'}])
+        # nothing changed: no reload, even before the first change created the sequence
+        cache.delete('autocomplete_change_seq')
+        other_worker = ProductAutocomplete(sync_interval=0)
+        other_worker.search('zeb')
+        with self.assertNumQueries(0):
+            other_worker.search('zeb')
+        self.product_5.name = 'Zebu'
+        self.product_5.save()
+        self.product_6.delete()
+        with self.assertNumQueries(1):
+            self.assertEqual(other_worker.search('zeb'), [{'id': self.product_5.id, 'name': 'Zebu'}])
+        self.assertEqual(other_worker.search('5 '), [])
+
+    def test_autocomplete_shared_popularity(self):
+        # Test detail views of one worker rank the suggestions of another
+        Product.objects.create(name='Cable', description='cable', price=1000, category=self.category_1, discount_rate=0.0)
+        other_worker = ProductAutocomplete(sync_interval=0, popularity_interval=0)
+        self.assertEqual([p['name'] for p in other_worker.search('c', limit=1)], ['Cable'])
+        self.client.get(f'/product/{self.product_2.id}/')
+        product_autocomplete.sync_popularity()
+        self.assertEqual([p['name'] for p in other_worker.search('c', limit=1)], ['Computer'])
+        self.assertEqual([p['name'] for p in other_worker.search('c')], ['Computer', 'Cable'])
+
+    def test_bulk_assign_coupon(self):
+        # Test coupon is mapped to a whole category once, cached coupon rates follow
+        coupon = Coupon.objects.create(code='CAMPAIGN20', discount_rate=0.2, active=True)
+        self.assertEqual(self.client.get(f'/product/{self.product_1.id}/?coupon_code=CAMPAIGN20').status_code,
+                         status.HTTP_404_NOT_FOUND)
+        call_command('bulk_update_products', assign_coupon='CAMPAIGN20', category_id=self.category_1.id,
+                     stdout=open(os.devnull, 'w'))
+        self.assertEqual(set(coupon.products.values_list('id', flat=True)), {self.product_1.id, self.product_2.id})
+        response = self.client.get(f'/product/{self.product_1.id}/?coupon_code=CAMPAIGN20')
+        self.assertEqual(response.json()['final_price'], 500000 * 0.7)
+
+        # existing mappings are skipped
+        bulk_service = ProductBulkService()
+        self.assertEqual(bulk_service.assign_coupon('CAMPAIGN20', product_ids=[self.product_1.id, self.product_3.id]), 1)
+        self.assertEqual(bulk_service.assign_coupon('CAMPAIGN20'), 3)
+        self.assertEqual(coupon.products.count(), 6)
+        with self.assertRaises(CouponDoesNotExist):
+            bulk_service.assign_coupon('NOPE')
+
+    def test_bulk_update_discount_rate(self):
+        # Test set-based update computes the same display fields as save()
+        Product.objects.create(name='Odd', description='odd price', price=333333, category=self.category_3,
+                               discount_rate=0.0)
+        self.client.get(f'/product/?category_id={self.category_3.id}')
+        etag = self.client.get(f'/product/{self.product_5.id}/')['ETag']
+        call_command('bulk_update_products', discount_rate=0.07, category_id=self.category_3.id,
+                     stdout=open(os.devnull, 'w'))
+        for product in Product.objects.filter(category=self.category_3):
+            self.assertEqual(product.discount_rate, 0.07)
+            self.assertEqual(product.discount_rate_display, '7.0%')
+            self.assertEqual(product.base_final_price, Product.calculate_final_price(product.price, 0.07))
+        self.assertEqual(Product.objects.get(id=self.product_1.id).discount_rate, 0.1)
+
+        # cached detail and list pages are invalidated, and so is the ETag of the detail
+        response = self.client.get(f'/product/{self.product_5.id}/', HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertNotEqual(response['ETag'], etag)
+        self.assertEqual(response.json()['discount_rate'], '7.0%')
+        response = self.client.get(f'/product/?category_id={self.category_3.id}')
+        self.assertEqual({p['discount_rate'] for p in response.json()['products']}, {'7.0%'})
+
+        with self.assertRaises(InvalidDiscountRate):
+            ProductBulkService().update_discount_rate(1.5)
+
+    def test_get_products_by_final_price(self):
+        # Test final_price in lists matches the product detail, with and without a coupon
+        Product.objects.create(name='Odd', description='odd price', price=333333, category=self.category_3,
+                               discount_rate=0.07, coupon_applicable=True)
+        for coupon_code in (None, 'DISCOUNT10', 'DISCOUNT90'):
+            query = f'&coupon_code={coupon_code}' if coupon_code else ''
+            products = self.client.get(f'/product/?page_size=5&order_by=final_price&asc=1{query}').json()['products']
+            products += self.client.get(f'/product/?page_size=5&page=2&order_by=final_price&asc=1{query}').json()['products']
+            self.assertEqual(len(products), 7)
+            final_prices = [product['final_price'] for product in products]
+            self.assertEqual(final_prices, sorted(final_prices))
+            for product in products:
+                detail_query = f'?coupon_code={coupon_code}' if coupon_code and product['id'] in (self.product_1.id, self.product_2.id) else ''
+                detail = self.client.get(f'/product/{product["id"]}/{detail_query}').json()
+                self.assertEqual(product['final_price'], detail['final_price'])
+
+        # DISCOUNT90 caps the total discount rate of product_1 at 1
+        response = self.client.get('/product/?coupon_code=DISCOUNT90&max_price=0')
+        self.assertEqual([p['id'] for p in response.json()['products']], [self.product_1.id])
+
+        # price range filter counts the filtered products
+        response = self.client.get(f'/product/?min_price=1000&max_price=500000&category_id={self.category_3.id}')
+        return_data = response.json()
+        self.assertEqual(return_data['total_count'], 1)
+        self.assertEqual(return_data['products'][0]['final_price'], int(333333 * (1 - 0.07)))
+
+        # cursor pagination on final_price
+        response = self.client.get('/product/?order_by=final_price&page_size=4&cursor=&with_count=1&min_price=1000')
+        return_data = response.json()
+        self.assertEqual(return_data['total_count'], 5)
+        response = self.client.get(f'/product/?order_by=final_price&page_size=4&min_price=1000&cursor={return_data["next_cursor"]}')
+        self.assertEqual([p['id'] for p in response.json()['products']], [self.product_3.id])
+
+        self.assertEqual(self.client.get('/product/?coupon_code=DISCOUNT100').status_code, status.HTTP_404_NOT_FOUND)
+        self.assertEqual(self.client.get('/product/?min_price=cheap').status_code, status.HTTP_400_BAD_REQUEST)
+
     def test_available_coupons(self):
         # Test retrieving available coupons for a specific product
         # 3 mappings but 2 is active
@@ -179,6 +600,30 @@ class ShoppingAPITestCase(TestCase):
         return_data = response.json()
         self.assertEqual(len(return_data), 0)
 
+        # answered from the coupon index once it is loaded
+        with self.assertNumQueries(0):
+            response = self.client.get(f'/product/{self.product_1.id}/coupons/')
+        self.assertEqual([coupon['code'] for coupon in response.json()], [self.coupon_2.code, self.coupon_1.code])
+        self.assertEqual(self.client.get('/product/999/coupons/').status_code, status.HTTP_404_NOT_FOUND)
+
+    def test_coupon_index_invalidation(self):
+        # Test coupon_applicable changes reach the index, other workers reload on a generation change
+        other_worker = CouponIndex(sync_interval=0)
+        self.assertEqual(other_worker.get_coupon_rate(self.product_2.id, self.coupon_1.code), None)
+        self.product_2.coupon_applicable = True
+        self.product_2.save()
+        self.assertEqual(other_worker.get_coupon_rate(self.product_2.id, self.coupon_1.code), 0.1)
+        self.assertEqual(len(self.client.get(f'/product/{self.product_2.id}/coupons/').json()), 2)
+        with self.assertNumQueries(0):
+            # only the generation is read from the cache, nothing changed
+            other_worker.get_coupon_rate(self.product_2.id, self.coupon_1.code)
+
+        # unrelated saves keep the index (only the saved product itself is read again)
+        self.product_2.name = 'Laptop'
+        self.product_2.save()
+        with self.assertNumQueries(1):
+            self.client.get(f'/product/{self.product_2.id}/coupons/')
+
     def test_get_product_detail(self):
         # Test retrieving product detail
         response = self.client.get(f'/product/{self.product_1.id}/')
@@ -209,6 +654,139 @@ class ShoppingAPITestCase(TestCase):
         response = self.client.get(f'/product/{self.product_1.id}/?coupon_code={self.coupon_3.code}')
         self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
 
+    def test_product_detail_cache_with_coupon(self):
+        # Test cached detail never serves another coupon's final_price
+        response = self.client.get(f'/product/{self.product_1.id}/')
+        self.assertEqual(response.json()['final_price'], 450000)
+        response = self.client.get(f'/product/{self.product_1.id}/?coupon_code={self.coupon_1.code}')
+        self.assertEqual(response.json()['final_price'], 400000)
+        # coupon is still validated on cache hits
+        response = self.client.get(f'/product/{self.product_1.id}/?coupon_code={self.coupon_3.code}')
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+
+        # coupon-applied detail needs no query once both tiers are cached
+        with self.assertNumQueries(0):
+            response = self.client.get(f'/product/{self.product_1.id}/?coupon_code={self.coupon_2.code}')
+        self.assertEqual(response.json()['final_price'], 0)
+
+    def test_product_coupon_cache_invalidation(self):
+        # Test coupon tier is invalidated by Coupon/ProductCoupon changes
+        url = f'/product/{self.product_1.id}/?coupon_code={self.coupon_1.code}'
+        self.assertEqual(self.client.get(url).status_code, status.HTTP_200_OK)
+
+        self.coupon_1.discount_rate = 0.2
+        self.coupon_1.save()
+        self.assertEqual(self.client.get(url).json()['final_price'], 350000)
+
+        ProductCoupon.objects.filter(product=self.product_1, coupon=self.coupon_1).delete()
+        self.assertEqual(self.client.get(url).status_code, status.HTTP_404_NOT_FOUND)
+
+        self.product_1.coupons.add(self.coupon_1)
+        self.assertEqual(self.client.get(url).status_code, status.HTTP_200_OK)
+
+        self.coupon_3.active = True
+        self.coupon_3.save()
+        response = self.client.get(f'/product/{self.product_1.id}/?coupon_code={self.coupon_3.code}')
+        self.assertEqual(response.json()['final_price'], 0)
+
+    def test_product_detail_single_flight(self):
+        # Test only the lock holder rebuilds an expired detail, others get the stale one
+        cache_key = f'product_detail_{self.product_1.id}'
+        self.client.get(f'/product/{self.product_1.id}/')
+        l1_cache.set(cache_key, dict(cache.get(cache_key), fresh_until=0, expires_at=0))
+
+        cache.add(f'{cache_key}_rebuild_lock', 1)
+        with self.assertNumQueries(0):
+            response = self.client.get(f'/product/{self.product_1.id}/')
+        self.assertEqual(response.json()['final_price'], 450000)
+
+        cache.delete(f'{cache_key}_rebuild_lock')
+        with self.assertNumQueries(1):
+            self.client.get(f'/product/{self.product_1.id}/')
+        self.assertGreater(cache.get(cache_key)['expires_at'], time.time())
+
+    def test_rebuild_lock_ownership(self):
+        # Test a rebuild that outlived its lock leaves the next holder's lock alone
+        cache_key = 'rebuild_test'
+
+        def slow_rebuild():
+            # our lock timed out and another worker took it
+            cache.set(f'{cache_key}_rebuild_lock', 'other', timeout=None)
+            return 1
+
+        self.assertEqual(get_or_rebuild(cache_key, slow_rebuild), 1)
+        self.assertEqual(cache.get(f'{cache_key}_rebuild_lock'), 'other')
+
+        # a waiter that gives up stores its result for the next readers
+        l1_cache.delete(cache_key)
+        self.assertEqual(get_or_rebuild(cache_key, lambda: 2, wait=0), 2)
+        self.assertEqual(get_or_rebuild(cache_key, lambda: 3, wait=0), 2)
+        cache.delete(f'{cache_key}_rebuild_lock')
+
+        # a lock released without an entry (failed rebuild) ends the wait at once
+        l1_cache.delete(cache_key)
+        cache.add(f'{cache_key}_rebuild_lock', 'other', timeout=0.1)
+        started = time.monotonic()
+        with self.assertRaises(ProductDoesNotExist):
+            get_or_rebuild(cache_key, mock.Mock(side_effect=ProductDoesNotExist), wait=5)
+        self.assertLess(time.monotonic() - started, 1)
+
+    def test_product_detail_early_expiry(self):
+        # Test entries between CACHE_MIN_TIMEOUT and CACHE_MAX_TIMEOUT expire with growing probability
+        cache_key = f'product_detail_{self.product_1.id}'
+        self.client.get(f'/product/{self.product_1.id}/')
+        now = time.time()
+        l1_cache.set(cache_key, dict(cache.get(cache_key), fresh_until=now - 10, expires_at=now + 10))
+        with mock.patch('millie.cache.random.random', return_value=0.9), self.assertNumQueries(0):
+            self.client.get(f'/product/{self.product_1.id}/')
+        with mock.patch('millie.cache.random.random', return_value=0.1), self.assertNumQueries(1):
+            self.client.get(f'/product/{self.product_1.id}/')
+
+    def test_product_detail_stale_while_revalidate(self):
+        # Test saved product is served stale until one worker rebuilds it
+        cache_key = f'product_detail_{self.product_1.id}'
+        self.client.get(f'/product/{self.product_1.id}/')
+        with mock.patch('millie.product.service.CACHE_STALE_WHILE_REVALIDATE', True):
+            self.product_1.price = 600000
+            self.product_1.save()
+        self.assertIsNotNone(cache.get(cache_key))
+
+        cache.add(f'{cache_key}_rebuild_lock', 1)
+        response = self.client.get(f'/product/{self.product_1.id}/')
+        self.assertEqual(response.json()['final_price'], 450000)
+        cache.delete(f'{cache_key}_rebuild_lock')
+        response = self.client.get(f'/product/{self.product_1.id}/')
+        self.assertEqual(response.json()['final_price'], 540000)
+
+    def test_get_product_details_batch(self):
+        # Test batch detail keeps request order and reports errors per product
+        url = f'/product/batch/?ids={self.product_3.id},{self.product_1.id},999,{self.product_2.id}&coupon_code={self.coupon_1.code}'
+        # cold cache: one query for products, two to load the coupon index
+        with self.assertNumQueries(3):
+            response = self.client.get(url)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        return_data = response.json()
+        self.assertEqual([p['id'] for p in return_data], [self.product_3.id, self.product_1.id, 999, self.product_2.id])
+        # product_3 is coupon_applicable without the coupon mapping
+        self.assertEqual(return_data[0]['error'], 'coupon not found')
+        self.assertEqual(return_data[1]['final_price'], 400000)
+        self.assertEqual(return_data[2]['error'], 'product not found')
+        # product_2 is not coupon_applicable, coupon is ignored
+        self.assertEqual(return_data[3]['final_price'], 1140000)
+
+        # warm cache: only the unknown product is looked up again
+        with self.assertNumQueries(1):
+            response = self.client.get(url)
+        self.assertEqual(response.json(), return_data)
+        with self.assertNumQueries(0):
+            self.client.get(f'/product/batch/?ids={self.product_1.id},{self.product_2.id}&coupon_code={self.coupon_1.code}')
+        # same result as the single detail endpoint
+        response = self.client.get(f'/product/{self.product_1.id}/?coupon_code={self.coupon_1.code}')
+        self.assertEqual(response.json(), return_data[1])
+
+        response = self.client.get('/product/batch/?ids=1,a')
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
     def test_get_active_coupons(self):
         # Test retrieving active coupons for a product
         response = self.client.get(f'/coupon/all/')
@@ -223,6 +801,111 @@ class ShoppingAPITestCase(TestCase):
         return_data = response.json()
         self.assertEqual(len(return_data['coupons']), 3)
 
+    def test_get_active_coupons_cursor_pagination(self):
+        # Test keyset pagination on coupons sorted by code
+        response = self.client.get('/coupon/all/?include_inactive=1&order_by=code&asc=1&page_size=2&cursor=')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        return_data = response.json()
+        self.assertEqual([c['code'] for c in return_data['coupons']], ['DISCOUNT10', 'DISCOUNT100'])
+
+        response = self.client.get(f'/coupon/all/?include_inactive=1&order_by=code&asc=1&page_size=2&cursor={return_data["next_cursor"]}')
+        return_data = response.json()
+        self.assertEqual([c['code'] for c in return_data['coupons']], ['DISCOUNT90'])
+        self.assertIsNone(return_data['next_cursor'])
+
+    async def test_async_views(self):
+        # Test async views return the same responses as the sync views
+        factory = AsyncRequestFactory()
+        cases = [
+            (product_views.aget_products, f'/product/?category_id={self.category_3.id}&order_by=name&asc=1', {}),
+            (product_views.aget_products, '/product/?page=2', {}),
+            (product_views.aget_products, '/product/?order_by=price', {}),
+            (product_views.aget_product_detail, f'/product/{self.product_1.id}/?coupon_code={self.coupon_1.code}', {'product_id': self.product_1.id}),
+            (product_views.aget_product_detail, f'/product/{self.product_1.id}/?coupon_code={self.coupon_3.code}', {'product_id': self.product_1.id}),
+            (product_views.aget_product_detail, '/product/999/', {'product_id': 999}),
+            (product_views.aget_available_coupons, f'/product/{self.product_1.id}/coupons/', {'product_id': self.product_1.id}),
+            (coupon_views.aget_active_coupons, '/coupon/all/?include_inactive=1&order_by=code', {}),
+        ]
+        for view, url, kwargs in cases:
+            # async first, on a cold cache
+            async_response = await view(factory.get(url), **kwargs)
+            sync_response = await sync_to_async(self.client.get)(url)
+            self.assertEqual(async_response.status_code, sync_response.status_code, url)
+            self.assertEqual(json.loads(async_response.content), sync_response.json(), url)
+            self.assertEqual(async_response.get('ETag'), sync_response.get('ETag'), url)
+
+    def test_conditional_get(self):
+        # Test revalidation costs no query and a change of what the response depends on gives 200 again
+        detail_url = f'/product/{self.product_1.id}/'
+        response = self.client.get(detail_url)
+        etag = response['ETag']
+        self.assertRegex(etag, r'^"[0-9a-f]{32}"$')
+        self.assertIn('Last-Modified', response)
+        self.assertIn('no-cache', response['Cache-Control'])
+        with self.assertNumQueries(0):
+            response = self.client.get(detail_url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, status.HTTP_304_NOT_MODIFIED)
+        self.assertEqual((response['ETag'], response.content), (etag, b''))
+        # If-Modified-Since counts once the second of the last change is over
+        last_modified = response['Last-Modified']
+        with mock.patch('millie.http.time.time', return_value=time.time() + 2):
+            response = self.client.get(detail_url, HTTP_IF_MODIFIED_SINCE=last_modified)
+        self.assertEqual(response.status_code, status.HTTP_304_NOT_MODIFIED)
+        # other query params are another representation
+        coupon_url = f'{detail_url}?coupon_code={self.coupon_1.code}'
+        coupon_etag = self.client.get(coupon_url)['ETag']
+        self.assertNotEqual(coupon_etag, etag)
+
+        self.product_1.price += 1000
+        self.product_1.save()
+        response = self.client.get(detail_url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertNotEqual(response['ETag'], etag)
+        # coupon changes only reach responses priced with a coupon
+        etag = response['ETag']
+        coupon_etag = self.client.get(coupon_url)['ETag']
+        self.coupon_1.discount_rate = 0.25
+        self.coupon_1.save()
+        self.assertEqual(self.client.get(detail_url, HTTP_IF_NONE_MATCH=etag).status_code, status.HTTP_304_NOT_MODIFIED)
+        self.assertEqual(self.client.get(coupon_url, HTTP_IF_NONE_MATCH=coupon_etag).status_code, status.HTTP_200_OK)
+
+        # list pages follow the generation of their category and the unfiltered listing
+        list_urls = [f'/product/?category_id={self.category_1.id}', f'/product/?category_id={self.category_2.id}',
+                     '/product/?cursor=', '/coupon/all/']
+        etags = {url: self.client.get(url)['ETag'] for url in list_urls}
+        for url in list_urls:
+            with self.assertNumQueries(0):
+                self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=etags[url]).status_code, status.HTTP_304_NOT_MODIFIED)
+        self.product_1.save()
+        self.assertEqual([self.client.get(url, HTTP_IF_NONE_MATCH=etags[url]).status_code for url in list_urls], [200, 304, 200, 304])
+        etags = {url: self.client.get(url)['ETag'] for url in list_urls}
+        Coupon.objects.create(code='NEWCOUPON', discount_rate=0.1)
+        self.assertEqual([self.client.get(url, HTTP_IF_NONE_MATCH=etags[url]).status_code for url in list_urls], [304, 304, 304, 200])
+
+        # a change in the same second as the last read is not hidden by If-Modified-Since
+        for _ in range(3):
+            last_modified = self.client.get('/product/')['Last-Modified']
+            Product.objects.create(name='Same second', description='new', price=100, category=self.category_3, discount_rate=0.0)
+            self.assertEqual(self.client.get('/product/', HTTP_IF_MODIFIED_SINCE=last_modified).status_code, status.HTTP_200_OK)
+            last_modified = self.client.get(detail_url)['Last-Modified']
+            self.product_1.save()
+            self.assertEqual(self.client.get(detail_url, HTTP_IF_MODIFIED_SINCE=last_modified).status_code, status.HTTP_200_OK)
+        # versions do not run ahead of the clock under steady writes
+        for _ in range(200):
+            bump_versions(['steady'])
+        self.assertLess(get_versions(['steady'])[0], time.time_ns() + 10**9)
+        self.assertLessEqual(parse_http_date(self.client.get('/product/')['Last-Modified']), time.time())
+        # version keys expire (those of unknown ids too), a missing one restarts from the current time
+        with mock.patch('millie.cache.CACHE_VERSION_TIMEOUT', 0.05):
+            self.client.get('/product/999999/')
+        self.assertIsNotNone(cache.get('product_version_999999'))
+        time.sleep(0.1)
+        self.assertIsNone(cache.get('product_version_999999'))
+
+        # errors are not validated
+        self.assertNotIn('ETag', self.client.get('/product/999/'))
+        self.assertNotIn('ETag', self.client.get('/product/?category_id=abc'))
+
     def test_cache_invalidation(self):
         # Test cache invalidation mechanism
         # cache empty
@@ -238,3 +921,444 @@ class ShoppingAPITestCase(TestCase):
         self.product_1.price = self.product_1.price + 1000
         self.product_1.save()
         assert cache.get(product_detail_cache_key) is None
+
+    def _query_profile(self, url):
+        # (number of queries, full scans/sorts in their plans, plans to show on failure)
+        with CaptureQueriesContext(connection) as context:
+            response = self.client.get(url)
+        self.assertEqual(response.status_code, status.HTTP_200_OK, url)
+        problems, plans = set(), []
+        for query in context.captured_queries:
+            plan = explain_query_plan(query['sql'])
+            problems |= plan_problems(plan)
+            plans.append(query['sql'] + '\n    ' + '\n    '.join(plan))
+        return len(context.captured_queries), problems, '\n'.join(plans)
+
+    def _clear_memory_caches(self):
+        l1_cache.clear()
+        product_autocomplete.clear()
+        coupon_index.clear()
+
+    def test_query_counts(self):
+        # Test exact query counts (cold and warm cache) and allowed full scans/sorts of every endpoint
+        # a new query or a new 'SCAN <table>' / 'USE TEMP B-TREE' step in a plan fails here
+        for name, url, cold_queries, warm_queries, allowed_problems in QUERY_COUNT_CASES:
+            url = url.format(product=self.product_1, other=self.product_3, category=self.category_1,
+                             other_category=self.category_3, coupon=self.coupon_1)
+            with self.subTest(name):
+                self._clear_memory_caches()
+                count, problems, plans = self._query_profile(url)
+                self.assertEqual(count, cold_queries, f'{url} (cold cache)\n{plans}')
+                self.assertLessEqual(problems, allowed_problems, f'{url}\n{plans}')
+                count, problems, plans = self._query_profile(url)
+                self.assertEqual(count, warm_queries, f'{url} (warm cache)\n{plans}')
+
+    def test_plan_problems(self):
+        # Test full scans and sorts are picked out of SQLite and PostgreSQL plans
+        plan = ['SEARCH product_product USING INDEX product_pro_created_idx (created_at<?)', 'SCAN product_product',
+                'SCAN product_category USING COVERING INDEX sqlite_autoindex', 'SCAN CONSTANT ROW', SORT,
+                '  ->  Seq Scan on coupon_coupon  (cost=0.00..1.05 rows=5 width=4)']
+        self.assertEqual(plan_problems(plan), {SCAN_PRODUCT, SORT, 'Seq Scan on coupon_coupon'})
+        self.assertTrue(explain_query_plan('SELECT id FROM product_product WHERE id = %s', [1])[0].startswith('SEARCH'))
+
+    def test_explain_list_queries(self):
+        # Test every list filter/sort pair is served by an index, except the ones that cannot be
+        # (a price range sorted by another column, sort by coupon price computed per row)
+        output = io.StringIO()
+        call_command('explain_list_queries', stdout=output)
+        problems = [line.split(':')[0] for line in output.getvalue().splitlines() if line.startswith(('product ', 'coupon ')) and not line.endswith(': OK')]
+        self.assertTrue(problems)
+        for name in problems:
+            self.assertTrue(name.startswith('product price range') or name.startswith('product coupon price order_by=final_price'), name)
+        with self.assertRaises(CommandError):
+            call_command('explain_list_queries', fail_on_problems=True, stdout=open(os.devnull, 'w'))
+
+    def test_sqlite_connection_setup(self):
+        # Test the SQLite profile settings are applied to every new connection
+        if connection.vendor != 'sqlite':
+            self.skipTest('SQLite profile only')
+        with connection.cursor() as cursor:
+            self.assertEqual(cursor.execute('PRAGMA synchronous').fetchone()[0], 1)  # NORMAL
+            self.assertEqual(cursor.execute('PRAGMA busy_timeout').fetchone()[0], SQLITE_BUSY_TIMEOUT_MS)
+        self.assertEqual(connection.transaction_mode, 'IMMEDIATE')
+        self.assertIn('PRAGMA journal_mode=WAL', connection.settings_dict['OPTIONS']['init_command'])
+
+    def _create_replicas(self, count):
+        # stand-in replicas: SQLite files holding a copy of the current data (not replicated afterwards)
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory, ignore_errors=True)
+        models = (Category, Coupon, Product, ProductCoupon, ProductCount)
+        aliases = []
+        for number in range(count):
+            alias = f'test_replica_{number}'
+            connections[alias] = connections['default'].__class__({**connection.settings_dict, 'NAME': os.path.join(directory, f'{alias}.sqlite3')}, alias)
+            self.addCleanup(self._remove_replica, alias)
+            with connections[alias].schema_editor() as editor:
+                for model in models:
+                    editor.create_model(model)
+            for model in models:
+                model.objects.using(alias).bulk_create(model.objects.all())
+            aliases.append(alias)
+        return aliases
+
+    def _remove_replica(self, alias):
+        connections[alias].close()
+        del connections[alias]
+
+    def test_replica_routing(self):
+        # Test uncached read-only service reads go to the replicas in turn, reads stored in the cache to the primary
+        replicas = self._create_replicas(2)
+        Product.objects.filter(id=self.product_1.id).update(name='Renamed on primary')
+        pool = ReplicaPool(replicas, 'round_robin', check_interval=60)
+        self.assertEqual(pool.check(), replicas)
+        url = f'/product/?cursor=&category_id={self.category_1.id}&order_by=name&asc=1'
+        with mock.patch.object(db_router, 'replica_pool', pool):
+            with CaptureQueriesContext(connections[replicas[0]]) as first, CaptureQueriesContext(connections[replicas[1]]) as second:
+                for _ in range(2):
+                    response = self.client.get(url)
+                    self.assertEqual([product['name'] for product in response.json()['products']], ['Computer', 'Smartphone'])
+            self.assertEqual((len(first), len(second)), (1, 1))
+            self.assertNotIn(PIN_COOKIE, response.cookies)
+            response = self.client.get('/product/search/?q=smartphone')
+            self.assertEqual([product['name'] for product in response.json()['products']], ['Renamed on primary'])
+
+            # details and list pages are cached under the current version, so they never come from a lagging replica
+            with CaptureQueriesContext(connections[replicas[0]]) as first, CaptureQueriesContext(connections[replicas[1]]) as second:
+                self.assertEqual(self.client.get(f'/product/{self.product_1.id}/').json()['name'], 'Renamed on primary')
+                response = self.client.get(f'/product/batch/?ids={self.product_1.id}')
+                self.assertEqual(response.json()[0]['name'], 'Renamed on primary')
+                response = self.client.get(f'/product/?category_id={self.category_1.id}')
+                self.assertIn('Renamed on primary', [product['name'] for product in response.json()['products']])
+            self.assertEqual((len(first), len(second)), (0, 0))
+
+            # the coupon index is kept until the next change, so it is always loaded from the primary
+            ProductCoupon.objects.filter(product=self.product_1).delete()
+            response = self.client.get(f'/product/{self.product_1.id}/coupons/')
+            self.assertEqual(response.json(), [])
+
+    def test_replica_read_your_writes(self):
+        # Test reads after a write go to the primary, in the same request and for the client's next requests
+        replicas = self._create_replicas(1)
+        pool = ReplicaPool(replicas, 'round_robin', check_interval=60)
+        url = f'/product/?cursor=&category_id={self.category_1.id}&order_by=name&asc=1'
+
+        def view(request):
+            Product.objects.filter(id=self.product_1.id).update(name='Renamed in this request')
+            return JsonResponse(ProductService().get_products_by_cursor(category_id=self.category_1.id, order_by='name', asc=1))
+
+        with mock.patch.object(db_router, 'replica_pool', pool):
+            response = ReplicaPinningMiddleware(view)(RequestFactory().get('/'))
+            self.assertIn('Renamed in this request', [product['name'] for product in json.loads(response.content)['products']])
+            self.assertEqual(response.cookies[PIN_COOKIE]['max-age'], db_router.REPLICA_PIN_SECONDS)
+
+            self.assertIn('Smartphone', [product['name'] for product in self.client.get(url).json()['products']])
+            self.client.cookies[PIN_COOKIE] = '1'
+            self.assertIn('Renamed in this request', [product['name'] for product in self.client.get(url).json()['products']])
+
+    def test_replica_bookkeeping_writes(self):
+        # Test seeding a missing product count in a read path neither pins the client nor counts on the replica
+        ProductCount.objects.all().delete()
+        replicas = self._create_replicas(1)
+        Product.objects.create(name='Only on primary', description='new', price=100, category=self.category_3, discount_rate=0.0)
+        ProductCount.objects.all().delete()
+        pool = ReplicaPool(replicas, 'round_robin', check_interval=60)
+        with mock.patch.object(db_router, 'replica_pool', pool):
+            response = self.client.get('/product/')
+        self.assertEqual(response.json()['total_count'], 7)
+        self.assertNotIn(PIN_COOKIE, response.cookies)
+        self.assertEqual(ProductCount.objects.get(category=None).count, 7)
+
+    def test_replica_health(self):
+        # Test lagging or unreachable replicas are skipped (primary when none is left) and least latency selection
+        replicas = self._create_replicas(2)
+        pool = ReplicaPool(replicas, 'least_latency', max_lag=1.0, check_interval=60)
+        lags = {replicas[0]: 0.0, replicas[1]: 0.0}
+
+        def measure_lag(alias):
+            if lags[alias] is None:
+                raise DatabaseError('connection refused')
+            if alias == replicas[0]:
+                time.sleep(0.02)
+            return lags[alias]
+
+        with mock.patch.object(pool, '_measure_lag', side_effect=measure_lag):
+            self.assertEqual(pool.check(), replicas)
+            self.assertEqual(pool.choose(), replicas[1])
+            lags[replicas[1]] = 5.0
+            self.assertEqual(pool.check(), [replicas[0]])
+            self.assertEqual(pool.choose(), replicas[0])
+            lags[replicas[0]] = None
+            self.assertEqual(pool.check(), [])
+            self.assertIsNone(pool.choose())
+
+        Product.objects.filter(id=self.product_1.id).update(name='Renamed on primary')
+        with mock.patch.object(db_router, 'replica_pool', pool):
+            self.assertEqual(self.client.get(f'/product/{self.product_1.id}/').json()['name'], 'Renamed on primary')
+        with self.assertRaises(ImproperlyConfigured):
+            ReplicaPool(replicas, 'random')
+
+    def test_product_access_counts(self):
+        # Test detail views are added to ProductAccessCount by the request that finds the flush due
+        for _ in range(3):
+            self.client.get(f'/product/{self.product_2.id}/')
+        self.client.get(f'/product/{self.product_1.id}/')
+        self.assertFalse(ProductAccessCount.objects.exists())
+        with mock.patch.object(product_access_counter, 'flush_interval', 0):
+            self.client.get(f'/product/{self.product_1.id}/')
+        counts = dict(ProductAccessCount.objects.values_list('product_id', 'count'))
+        self.assertEqual(counts, {self.product_2.id: 3, self.product_1.id: 2})
+
+        # later flushes add up, deleted products are skipped
+        self.client.get(f'/product/{self.product_1.id}/')
+        product_access_counter.record(999999)
+        self.assertEqual(product_access_counter.flush(), 2)
+        self.assertEqual(ProductAccessCount.objects.get(product=self.product_1).count, 3)
+        self.assertFalse(ProductAccessCount.objects.filter(product_id=999999).exists())
+        self.assertEqual(product_access_counter.top_product_ids(1), [self.product_1.id])
+
+    def test_cache_warmup(self):
+        # Test the hot products, first list pages and coupon index are served without queries after the warm-up
+        ProductAccessCount.objects.create(product=self.product_1, count=10)
+        ProductAccessCount.objects.create(product=self.product_3, count=5)
+        ProductAccessCount.objects.create(product=self.product_2, count=1)
+
+        stats = CacheWarmer(budget=0).warm()
+        self.assertFalse(stats['complete'])
+        self.assertEqual((stats['products'], stats['list_pages']), (0, 0))
+
+        stats = CacheWarmer(top_products=2, list_pages=2, chunk_size=1).warm()
+        self.assertTrue(stats['complete'])
+        self.assertEqual(stats['products'], 2)
+        # 6 products: 2 pages of the unfiltered listing, 1 page for each category
+        self.assertEqual(stats['list_pages'], 5)
+        with self.assertNumQueries(0):
+            self.client.get(f'/product/{self.product_1.id}/?coupon_code={self.coupon_1.code}')
+            self.client.get(f'/product/{self.product_3.id}/')
+            self.client.get('/product/?page=2')
+            self.client.get(f'/product/?category_id={self.category_3.id}')
+        with self.assertNumQueries(1):
+            self.client.get(f'/product/{self.product_2.id}/')
+
+        out = io.StringIO()
+        call_command('warm_cache', budget=5, stdout=out)
+        self.assertIn('Warmed 3 product details and 5 list pages', out.getvalue())
+
+        # startup warm-up only when enabled (called by wsgi.py/asgi.py, not on app loading)
+        with mock.patch('millie.product.warmup.start_background_warmup') as start:
+            self.assertIsNone(warm_on_startup())
+            with mock.patch('millie.product.warmup.WARMUP_ON_STARTUP', True):
+                warm_on_startup()
+        start.assert_called_once_with()
+
+    def test_space_saving(self):
+        # Test the heavy hitters survive a stream of distinct keys (counts are upper bounds)
+        top = SpaceSaving(capacity=3)
+        for i in range(100):
+            top.add('hot')
+            top.add(f'cold_{i}')
+        self.assertEqual(len(top), 3)
+        self.assertEqual(max(top.counts, key=top.counts.get), 'hot')
+        self.assertGreaterEqual(top.counts['hot'], 100)
+        # the smallest counter is taken over, outdated heap entries are skipped
+        top = SpaceSaving(capacity=3)
+        for key in 'aaabcc':
+            top.add(key)
+        top.add('d')
+        self.assertEqual(top.counts, {'a': 3, 'c': 2, 'd': 2})
+        self.assertLessEqual(len(top._heap), 4 * top.capacity)
+
+    def test_hot_keys(self):
+        # Test reads are merged into the shared top-K and hot keys are cached longer
+        tracker = HotKeyTracker(capacity=10, hot_size=1, flush_interval=0, half_life=600, ttl_factor=4)
+        detail_key = f'product_detail_{self.product_1.id}'
+        with mock.patch('millie.product.service.hot_key_tracker', tracker), mock.patch('millie.hot_keys.hot_key_tracker', tracker), \
+                mock.patch('millie.product.warmup.hot_key_tracker', tracker):
+            for _ in range(3):
+                self.client.get(f'/product/{self.product_1.id}/')
+            self.client.get('/product/')
+            self.assertTrue(tracker.is_hot(detail_key))
+            self.assertEqual(tracker.timeout_factor(detail_key), 4)
+            self.assertEqual(tracker.timeout_factor('product_list_all_1_5_None_0_None_None'), 1)
+            # merged across flushes (other workers add to the same shared top-K)
+            top = dict(tracker.top())
+            self.assertAlmostEqual(top[detail_key], 3, places=2)
+            self.assertIn('product_list_all_1_5_None_0_None_None', top)
+
+            # hot entries expire later than the default timeout
+            l1_cache.delete(detail_key)
+            self.client.get(f'/product/{self.product_1.id}/')
+            self.assertGreater(cache.get(detail_key)['expires_at'], time.time() + CACHE_MAX_TIMEOUT)
+            self.client.get(f'/product/batch/?ids={self.product_1.id},{self.product_2.id}')
+
+            response = self.client.get('/metrics/hot-keys?limit=2')
+            self.assertEqual(response.status_code, status.HTTP_200_OK)
+            keys = response.json()['keys']
+            self.assertEqual(keys[0], {'key': detail_key, 'count': keys[0]['count'], 'hot': True})
+            self.assertEqual(len(keys), 2)
+            self.assertFalse(keys[1]['hot'])
+            self.assertEqual(self.client.get('/metrics/hot-keys', REMOTE_ADDR='10.0.0.1').status_code, status.HTTP_403_FORBIDDEN)
+            # the warm-up loads the hot products first, without counting its own reads
+            self.assertEqual(CacheWarmer(top_products=1)._hot_product_ids(), [self.product_1.id])
+            tracker.flush()
+            top = dict(tracker.top())
+            CacheWarmer(top_products=1, list_pages=1).warm()
+            tracker.flush()
+            self.assertAlmostEqual(dict(tracker.top())[detail_key], top[detail_key], places=2)
+
+    def test_export_products(self):
+        # Test the catalog is streamed as NDJSON/CSV in list item format, chunk by chunk, gzipped on request
+        response = self.client.get('/product/export/')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertTrue(response.streaming)
+        self.assertEqual(response['Content-Type'], 'application/x-ndjson')
+        self.assertEqual(response['Content-Disposition'], 'attachment; filename="products.ndjson"')
+        products = [json.loads(line) for line in b''.join(response.streaming_content).decode().splitlines()]
+        self.assertEqual([product['id'] for product in products], sorted(product.id for product in Product.objects.all()))
+        list_item = next(product for product in self.client.get('/product/?order_by=name&asc=1').json()['products']
+                         if product['id'] == self.product_4.id)
+        self.assertEqual(next(product for product in products if product['id'] == self.product_4.id), list_item)
+
+        response = self.client.get(f'/product/export/?format=csv&category_id={self.category_3.id}')
+        self.assertEqual(response['Content-Type'], 'text/csv; charset=utf-8')
+        rows = list(csv.DictReader(io.StringIO(b''.join(response.streaming_content).decode())))
+        self.assertEqual([int(row['id']) for row in rows], [self.product_4.id, self.product_5.id, self.product_6.id])
+        self.assertEqual((rows[0]['category_name'], rows[0]['price'], rows[0]['final_price']), ('Misc', '1,000원', '500'))
+
+        response = self.client.get('/product/export/', HTTP_ACCEPT_ENCODING='gzip, deflate')
+        self.assertEqual(response['Content-Encoding'], 'gzip')
+        self.assertEqual(len(gzip.decompress(b''.join(response.streaming_content)).splitlines()), 6)
+
+        # one fetch of chunk_size rows per chunk, the query starts when the stream is read
+        with self.assertNumQueries(0):
+            chunks = ProductService().export_products(chunk_size=4)
+        self.assertEqual([len(chunk) for chunk in chunks], [4, 2])
+
+        self.assertEqual(self.client.get('/product/export/?format=xml').status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(self.client.get('/product/export/?category_id=abc').status_code, status.HTTP_400_BAD_REQUEST)
+
+    async def test_export_products_asgi(self):
+        # Test the export is streamed chunk by chunk under ASGI (an async iterator, not a list of the whole catalog)
+        response = await self.async_client.get('/product/export/', headers={'Accept-Encoding': 'gzip'})
+        self.assertTrue(response.is_async)
+        self.assertEqual(response['Content-Encoding'], 'gzip')
+        content = b''.join([chunk async for chunk in response.streaming_content])
+        self.assertEqual(len(gzip.decompress(content).splitlines()), 6)
+
+        produced = []
+        def chunks():
+            for i in range(3):
+                produced.append(i)
+                yield str(i).encode()
+        stream = aiter_in_thread(chunks())
+        self.assertEqual(await anext(stream), b'0')
+        self.assertEqual(produced, [0])
+        await stream.aclose()
+
+    def test_benchmark_endpoints(self):
+        # Test the benchmark covers every endpoint without errors (tiny catalog in the test database)
+        with tempfile.TemporaryDirectory() as directory:
+            output = os.path.join(directory, 'benchmark.json')
+            call_command('benchmark_endpoints', products=[200], categories=3, coupons=5, requests=1,
+                         current_db=True, output=output, stdout=open(os.devnull, 'w'))
+            with open(output) as f:
+                results = json.load(f)
+        cases = results['catalogs'][0]['cases']
+        self.assertEqual({case['status'] for case in cases}, {200})
+        self.assertEqual({case['cache'] for case in cases}, {'cold', 'warm'})
+        self.assertIn('product list order final_price asc=1', {case['name'] for case in cases})
+        warm_detail = next(case for case in cases if case['name'] == 'product detail coupon' and case['cache'] == 'warm')
+        self.assertEqual(warm_detail['queries'], 0)
+
+    def test_request_metrics(self):
+        # Test Server-Timing header and per-view stats on /metrics
+        metrics_registry.clear()
+        response = self.client.get(f'/product/{self.product_1.id}/?coupon_code={self.coupon_1.code}')
+        self.assertRegex(response['Server-Timing'], r'^app;dur=[\d.]+, db;dur=[\d.]+;desc="3 queries", cache;desc="\d+ hits, \d+ misses", serialize;dur=[\d.]+$')
+        response = self.client.get(f'/product/{self.product_1.id}/?coupon_code={self.coupon_1.code}')
+        self.assertIn('desc="0 queries"', response['Server-Timing'])
+        self.client.get('/product/')
+
+        response = self.client.get('/metrics')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        body = response.content.decode()
+        self.assertIn('millie_request_duration_seconds_count{view="get_product_detail"} 2', body)
+        self.assertIn('millie_db_queries_sum{view="get_product_detail"} 3', body)
+        self.assertIn('millie_request_duration_seconds{view="get_products",quantile="0.99"}', body)
+        self.assertIn('millie_cache_hits_total{view="get_product_detail"}', body)
+        self.assertNotIn('view="metrics"', body)
+
+        self.assertEqual(self.client.get('/metrics', REMOTE_ADDR='10.0.0.1').status_code, status.HTTP_403_FORBIDDEN)
+        # behind a reverse proxy the local address is the proxy's: only the token is accepted
+        self.assertEqual(self.client.get('/metrics', HTTP_X_FORWARDED_FOR='203.0.113.7').status_code,
+                         status.HTTP_403_FORBIDDEN)
+        with mock.patch('millie.metrics.METRICS_TOKEN', 'secret'):
+            self.assertEqual(self.client.get('/metrics').status_code, status.HTTP_403_FORBIDDEN)
+            response = self.client.get('/metrics', HTTP_X_FORWARDED_FOR='203.0.113.7', HTTP_AUTHORIZATION='Bearer secret')
+            self.assertEqual(response.status_code, status.HTTP_200_OK)
+            self.assertEqual(self.client.get('/metrics/hot-keys', HTTP_AUTHORIZATION='Bearer wrong').status_code,
+                             status.HTTP_403_FORBIDDEN)
+
+    async def test_request_metrics_async(self):
+        # Test queries of async views (run in sync_to_async threads) are counted
+        async def get_response(request):
+            return await product_views.aget_product_detail(request, product_id=self.product_1.id)
+        middleware = MetricsMiddleware(get_response)
+        response = await middleware(AsyncRequestFactory().get(f'/product/{self.product_1.id}/'))
+        self.assertIn('desc="1 queries"', response['Server-Timing'])
+
+
+class L1CacheTestCase(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.l1_cache = L1Cache(cache, max_size=2, timeout=60, sync_interval=0)
+
+    def test_lru_eviction(self):
+        self.l1_cache.set('a', 1)
+        self.l1_cache.set('b', 2)
+        self.l1_cache.get('a')
+        self.l1_cache.set('c', 3)
+        # 'b' is the least recently used entry
+        self.assertEqual(set(self.l1_cache._entries), {'a', 'c'})
+        # evicted entries are still served by the shared cache
+        self.assertEqual(self.l1_cache.get('b'), 2)
+        stats = self.l1_cache.stats()
+        self.assertEqual(stats['size'], 2)
+        self.assertEqual(stats['evictions'], 2)
+        self.assertEqual(stats['hit_rate'], 0.5)
+
+    def test_ttl_expiry(self):
+        short_l1_cache = L1Cache(cache, max_size=2, timeout=0.05, sync_interval=0)
+        short_l1_cache.set('a', 1)
+        cache.set('a', 2)
+        self.assertEqual(short_l1_cache.get('a'), 1)
+        # expired locally, refilled from the shared cache
+        time.sleep(0.1)
+        self.assertEqual(short_l1_cache.get('a'), 2)
+
+    def test_broadcast_invalidation(self):
+        other_worker = L1Cache(cache, max_size=2, timeout=60, sync_interval=0)
+        self.l1_cache.set('a', 1)
+        self.assertEqual(other_worker.get('a'), 1)
+        # a delete on one worker drops local copies on the others
+        self.l1_cache.delete('a')
+        self.assertIsNone(other_worker.get('a'))
+
+    def test_scoped_invalidation(self):
+        # Test a delete drops only the deleted keys on other workers, the rest stay local
+        other_worker = L1Cache(cache, max_size=10, timeout=60, sync_interval=0)
+        other_worker.get('warm')
+        self.l1_cache.set('a', 1)
+        self.l1_cache.set('b', 2)
+        other_worker.get_many(['a', 'b'])
+        self.l1_cache.delete('a')
+        hits = other_worker.hits
+        self.assertEqual(other_worker.get('b'), 2)
+        self.assertEqual(other_worker.hits, hits + 1)
+        self.assertEqual(set(other_worker._entries), {'b'})
+        self.assertIsNone(other_worker.get('a'))
+
+        # a missing journal entry (e.g. expired) drops everything
+        self.l1_cache.delete('c')
+        cache.delete(f'{L1Cache.journal_prefix}{cache.get(L1Cache.seq_key)}')
+        other_worker.get('a')
+        self.assertEqual(set(other_worker._entries), set())
@@ -16,8 +16,12 @@ Including another URLconf
 """
 from django.contrib import admin
 from django.urls import path, include
+from .hot_keys import hot_keys_view
+from .metrics import metrics_view
 
 urlpatterns = [
     path('product/', include('millie.product.urls')),
     path('coupon/', include('millie.coupon.urls')),
+    path('metrics', metrics_view, name='metrics'),
+    path('metrics/hot-keys', hot_keys_view, name='hot_keys'),
 ]
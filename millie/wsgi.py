@@ -14,3 +14,7 @@ from django.core.wsgi import get_wsgi_application
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'millie.settings')
 
 application = get_wsgi_application()
+
+from millie.product.warmup import warm_on_startup  # noqa: E402 (needs the apps loaded above)
+
+warm_on_startup()